@@ -1,5 +1,13 @@
 const makeWASocket = require('@whiskeysockets/baileys').default;
-const { useMultiFileAuthState, DisconnectReason, getContentType, downloadMediaMessage } = require('@whiskeysockets/baileys');
+const {
+    useMultiFileAuthState,
+    DisconnectReason,
+    getContentType,
+    downloadMediaMessage,
+    prepareWAMessageMedia,
+    generateWAMessageFromContent,
+    proto
+} = require('@whiskeysockets/baileys');
 const { Boom } = require('@hapi/boom');
 const pino = require('pino');
 const qrcode = require('qrcode-terminal');
@@ -26,10 +34,13 @@ app.use(express.json());
 const PORT = process.env.NODE_SERVICE_PORT || 3000;
 const FRAPPE_SITE_URL = process.env.FRAPPE_SITE_URL || 'http://localhost:8000';
 const AUTH_FOLDER = process.env.AUTH_FOLDER || './auth_info_baileys';
+const CHECK_NUMBERS_CHUNK_SIZE = 50;
 
 // Store active connections
 const connections = new Map();
 const groupCache = new NodeCache({ stdTTL: 300, useClones: false });
+// Inbound media messages kept until Frappe has downloaded their media
+const mediaMessages = new NodeCache({ stdTTL: 3600, useClones: false, maxKeys: 10000 });
 
 // Message queue
 const messageQueue = new Bull('whatsapp-messages', {
@@ -163,6 +174,12 @@ async function sendMessage(connectionId, recipient, message) {
         // Format recipient JID
         const jid = recipient.includes('@') ? recipient : `${recipient}@s.whatsapp.net`;
 
+        // Media already uploaded through /api/upload-media: relay the cached
+        // handle instead of downloading and uploading the file again
+        if (message.media_handle) {
+            return await sendWithMediaHandle(sock, jid, message);
+        }
+
         // Send message
         const result = await sock.sendMessage(jid, message);
 
@@ -175,12 +192,30 @@ async function sendMessage(connectionId, recipient, message) {
     }
 }
 
+/**
+ * Send a media message using a previously uploaded media handle
+ */
+async function sendWithMediaHandle(sock, jid, message) {
+    const content = proto.Message.fromObject(message.media_handle);
+    const mediaType = getContentType(content);
+
+    if (message.caption && content[mediaType]) {
+        content[mediaType].caption = message.caption;
+    }
+
+    const msg = generateWAMessageFromContent(jid, content, { userJid: sock.user.id });
+    await sock.relayMessage(jid, msg.message, { messageId: msg.key.id });
+
+    logger.info(`Message sent to ${jid} using cached media`);
+    return msg;
+}
+
 /**
  * Notify Frappe about events
  */
 async function notifyFrappe(connectionId, event, data) {
     try {
-        await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.api.webhook_handler.handle_event`, {
+        await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.whatsapp.api.webhook_handler.handle_event`, {
             connection_id: connectionId,
             event: event,
             data: data
@@ -199,7 +234,7 @@ async function notifyFrappe(connectionId, event, data) {
  */
 async function updateConnectionStatus(connectionId, status) {
     try {
-        await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.api.webhook_handler.update_connection_status`, {
+        await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.whatsapp.api.webhook_handler.update_connection_status`, {
             connection_id: connectionId,
             status: status
         }, {
@@ -212,23 +247,50 @@ async function updateConnectionStatus(connectionId, status) {
     }
 }
 
+/**
+ * Media part of an inbound message, if it carries media
+ */
+function getMediaContent(message) {
+    const inner = message.documentWithCaptionMessage?.message || message;
+    return inner.imageMessage || inner.videoMessage || inner.ptvMessage || inner.audioMessage ||
+        inner.documentMessage || inner.stickerMessage || null;
+}
+
 /**
  * Save incoming message to Frappe
  */
 async function saveIncomingMessage(connectionId, msg, messageType) {
     try {
+        const mediaContent = getMediaContent(msg.message);
         const content = msg.message.conversation ||
             msg.message.extendedTextMessage?.text ||
-            msg.message.imageMessage?.caption ||
+            mediaContent?.caption ||
             '';
 
-        await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.api.webhook_handler.save_incoming_message`, {
+        let media = null;
+        if (mediaContent) {
+            media = {
+                mimetype: mediaContent.mimetype,
+                file_name: mediaContent.fileName,
+                file_length: Number(mediaContent.fileLength || 0),
+                // Hash of the decrypted content, lets Frappe skip media it already has
+                sha256: mediaContent.fileSha256 ? Buffer.from(mediaContent.fileSha256).toString('hex') : null
+            };
+            try {
+                mediaMessages.set(`${connectionId}:${msg.key.id}`, msg);
+            } catch (error) {
+                logger.warn(`Media cache full, media of ${msg.key.id} will not be downloadable`);
+            }
+        }
+
+        await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.whatsapp.api.webhook_handler.save_incoming_message`, {
             connection_id: connectionId,
-            from: msg.key.remoteJid,
+            from_number: msg.key.remoteJid,
             message_id: msg.key.id,
             message_type: messageType,
             content: content,
-            timestamp: msg.messageTimestamp
+            timestamp: msg.messageTimestamp,
+            media: media
         }, {
             headers: {
                 'Content-Type': 'application/json'
@@ -286,6 +348,12 @@ messageQueue.process(async (job) => {
     } catch (error) {
         logger.error('Error processing message:', error);
 
+        // Bull retries quick hiccups itself; Frappe only hears about the last
+        // attempt and decides whether to retry later
+        if (job.attemptsMade + 1 < (job.opts.attempts || 1)) {
+            throw error;
+        }
+
         // Mark as failed in Frappe
         await axios.post(`${FRAPPE_SITE_URL}/api/method/whatsapp.whatsapp.doctype.whatsapp_message_log.whatsapp_message_log.update_message_status`, {
             message_log_id: message_log_id,
@@ -362,12 +430,140 @@ app.post('/api/queue-message', async (req, res) => {
     }
 });
 
-app.get('/api/status', (req, res) => {
-    res.json({
-        active_connections: connections.size,
-        queue_waiting: messageQueue.getWaitingCount(),
-        queue_active: messageQueue.getActiveCount()
-    });
+// Batch enqueue used by the Frappe outbox relay. The message log id is the job
+// id, so a batch the relay retries after a timeout is not queued twice.
+app.post('/api/queue-messages', async (req, res) => {
+    try {
+        const { messages = [] } = req.body;
+
+        await messageQueue.addBulk(messages.map(({ connection_id, message_log_id, recipient, message, campaign_id, priority, job_id }) => ({
+            data: {
+                connection_id,
+                message_log_id,
+                recipient,
+                message,
+                campaign_id
+            },
+            opts: {
+                // Retries of a message log carry their own job id
+                jobId: String(job_id || message_log_id),
+                // Interactive (1) and transactional (2) jobs overtake the campaign backlog (no priority)
+                ...(priority ? { priority } : {}),
+                attempts: 3,
+                backoff: {
+                    type: 'exponential',
+                    delay: 2000
+                }
+            }
+        })));
+
+        res.json({ success: true, queued: messages.length });
+    } catch (error) {
+        res.status(500).json({ error: error.message });
+    }
+});
+
+// Upload media to WhatsApp once and return a reusable handle. Local files are
+// streamed in the request body; remote files are passed as a URL.
+app.post('/api/upload-media', express.raw({ type: 'application/octet-stream', limit: '100mb' }), async (req, res) => {
+    try {
+        const isRaw = Buffer.isBuffer(req.body);
+        const params = isRaw ? req.query : req.body;
+        const { connection_id, media_type, mimetype, file_name, url } = params;
+
+        const sock = connections.get(connection_id);
+        if (!sock) {
+            return res.status(404).json({ error: 'Connection not found' });
+        }
+
+        const media = { [media_type]: isRaw ? req.body : { url } };
+        if (mimetype) media.mimetype = mimetype;
+        if (media_type === 'document') media.fileName = file_name;
+
+        const prepared = await prepareWAMessageMedia(media, { upload: sock.waUploadToServer });
+
+        res.json({
+            success: true,
+            media: proto.Message.fromObject(prepared).toJSON()
+        });
+    } catch (error) {
+        logger.error('Error uploading media:', error);
+        res.status(500).json({ error: error.message });
+    }
+});
+
+// Stream the decrypted media of an inbound message; nothing is buffered in full
+app.get('/api/media/:connectionId/:messageId', async (req, res) => {
+    const { connectionId, messageId } = req.params;
+    const msg = mediaMessages.get(`${connectionId}:${messageId}`);
+    const sock = connections.get(connectionId);
+    if (!msg || !sock) {
+        return res.status(404).json({ error: 'Media not available' });
+    }
+
+    try {
+        const mediaContent = getMediaContent(msg.message);
+        const stream = await downloadMediaMessage(msg, 'stream', {}, {
+            logger,
+            reuploadRequest: sock.updateMediaMessage
+        });
+
+        res.setHeader('Content-Type', mediaContent.mimetype || 'application/octet-stream');
+        stream.on('error', (error) => {
+            logger.error('Error streaming media:', error);
+            res.destroy(error);
+        });
+        stream.on('end', () => mediaMessages.del(`${connectionId}:${messageId}`));
+        stream.pipe(res);
+    } catch (error) {
+        logger.error('Error downloading media:', error);
+        res.status(500).json({ error: error.message });
+    }
+});
+
+app.post('/api/check-numbers', async (req, res) => {
+    const { connection_id, phone_numbers = [] } = req.body;
+    const sock = connections.get(connection_id);
+    if (!sock) {
+        return res.status(404).json({ error: 'Connection not found' });
+    }
+
+    try {
+        const results = [];
+        // One usync query per chunk instead of one per number
+        for (let i = 0; i < phone_numbers.length; i += CHECK_NUMBERS_CHUNK_SIZE) {
+            const chunk = phone_numbers.slice(i, i + CHECK_NUMBERS_CHUNK_SIZE);
+            const found = new Map();
+            for (const result of (await sock.onWhatsApp(...chunk)) || []) {
+                found.set(result.jid.split('@')[0], result);
+            }
+            for (const number of chunk) {
+                const result = found.get(number);
+                results.push({ phone_number: number, exists: Boolean(result && result.exists), jid: result ? result.jid : null });
+            }
+        }
+        res.json({ results });
+    } catch (error) {
+        logger.error('Error checking numbers:', error);
+        res.status(500).json({ error: error.message });
+    }
+});
+
+app.get('/api/status', async (req, res) => {
+    try {
+        const [waiting, active] = await Promise.all([
+            messageQueue.getWaitingCount(),
+            messageQueue.getActiveCount()
+        ]);
+
+        res.json({
+            active_connections: connections.size,
+            queue_waiting: waiting,
+            queue_active: active
+        });
+    } catch (error) {
+        res.status(500).json({ error: error.message });
+    }
 });
 
 // Socket.IO for real-time updates
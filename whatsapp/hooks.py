@@ -156,6 +156,15 @@ scheduler_events = {
 		"whatsapp.whatsapp.tasks.scheduler.reset_monthly_message_counters"
 	],
 	"cron": {
+		"* * * * *": [
+			"whatsapp.whatsapp.tasks.campaign_scheduler.run_due_campaigns",
+			"whatsapp.whatsapp.tasks.scheduler.sync_message_counters",
+			"whatsapp.whatsapp.tasks.inbound.process_inbound_queue",
+			"whatsapp.whatsapp.tasks.outbox.relay_outbox",
+			"whatsapp.whatsapp.tasks.retry.retry_failed_messages",
+			"whatsapp.whatsapp.tasks.scheduler.flush_campaign_stats",
+			"whatsapp.whatsapp.tasks.scheduler.write_error_logs"
+		],
 		"*/5 * * * *": [
 			"whatsapp.whatsapp.tasks.scheduler.update_campaign_statistics"
 		]
@@ -194,12 +203,18 @@ scheduler_events = {
 # Request Events
 # ----------------
 # before_request = ["whatsapp.utils.before_request"]
-# after_request = ["whatsapp.utils.after_request"]
+after_request = [
+	"whatsapp.whatsapp.utils.metrics.maybe_flush",
+	"whatsapp.whatsapp.utils.error_reporter.flush"
+]
 
 # Job Events
 # ----------
 # before_job = ["whatsapp.utils.before_job"]
-# after_job = ["whatsapp.utils.after_job"]
+after_job = [
+	"whatsapp.whatsapp.utils.metrics.maybe_flush",
+	"whatsapp.whatsapp.utils.error_reporter.flush"
+]
 
 # User Data Protection
 # --------------------
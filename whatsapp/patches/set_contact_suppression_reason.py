@@ -0,0 +1,15 @@
+import frappe
+
+from whatsapp.whatsapp.utils.recipient_filter import SUPPRESSION_KEY
+
+
+def execute():
+	"""Suppress contacts that opted out before suppression reasons existed"""
+	frappe.db.sql(
+		"""
+		UPDATE `tabWhatsApp Contact`
+		SET suppression_reason = 'Opted Out'
+		WHERE opt_in_status = 'Opted Out' AND IFNULL(suppression_reason, '') = ''
+		"""
+	)
+	frappe.cache().delete_value(SUPPRESSION_KEY)
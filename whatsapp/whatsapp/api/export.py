@@ -0,0 +1,39 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import frappe
+import json
+
+from whatsapp.whatsapp.tasks.export import EXPORTS, FORMATS
+
+
+@frappe.whitelist()
+def start_export(export_type, file_format="csv", filters=None):
+	"""Start a background export; the file URL is pushed on the `whatsapp_export` realtime event"""
+	if export_type not in EXPORTS:
+		frappe.throw(f"Unknown export type: {export_type}")
+	if file_format not in FORMATS:
+		frappe.throw(f"Unsupported format: {file_format}")
+
+	filters = json.loads(filters) if isinstance(filters, str) else (filters or {})
+
+	if export_type == "Campaign Recipients":
+		if not filters.get("campaign"):
+			frappe.throw("Campaign is required for a campaign recipient export")
+		frappe.has_permission("WhatsApp Campaign", "read", filters.get("campaign"), throw=True)
+	elif export_type == "Contacts":
+		frappe.has_permission("WhatsApp Contact", "export", throw=True)
+	else:
+		frappe.has_permission("WhatsApp Message Log", "export", throw=True)
+
+	frappe.enqueue(
+		"whatsapp.whatsapp.tasks.export.run_export",
+		queue="long",
+		timeout=4 * 60 * 60,
+		export_type=export_type,
+		file_format=file_format,
+		filters=filters,
+		user=frappe.session.user,
+	)
+
+	return {"success": True, "message": "Export started. You will be notified when the file is ready."}
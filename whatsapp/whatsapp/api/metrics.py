@@ -0,0 +1,51 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import frappe
+from werkzeug.wrappers import Response
+
+from whatsapp.whatsapp.utils.metrics import BUCKETS, get_snapshot
+from whatsapp.whatsapp.utils.profiler import read_recent_samples
+
+
+@frappe.whitelist()
+def get_metrics():
+	"""Expose hot-path metrics in the Prometheus text format"""
+	frappe.only_for("System Manager")
+
+	histograms, counters = get_snapshot()
+	return Response(render_prometheus(histograms, counters), mimetype="text/plain; version=0.0.4")
+
+
+@frappe.whitelist()
+def get_profile_samples(endpoint=None, limit=20):
+	"""Return recent sampled webhook profiles, newest first"""
+	frappe.only_for("System Manager")
+	return read_recent_samples(endpoint, limit)
+
+
+def render_prometheus(histograms, counters):
+	"""Render a metrics snapshot as Prometheus exposition text"""
+	lines = [
+		"# HELP whatsapp_stage_duration_seconds Time spent per hot-path stage",
+		"# TYPE whatsapp_stage_duration_seconds histogram",
+	]
+
+	for stage in sorted(histograms):
+		histogram = histograms[stage]
+		cumulative = 0
+		for bound, count in zip(BUCKETS, histogram["buckets"]):
+			cumulative += count
+			lines.append(f'whatsapp_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+		lines.append(f'whatsapp_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+		lines.append(f'whatsapp_stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+		lines.append(f'whatsapp_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+	lines += [
+		"# HELP whatsapp_events_total Hot-path event counters",
+		"# TYPE whatsapp_events_total counter",
+	]
+	for name in sorted(counters):
+		lines.append(f'whatsapp_events_total{{event="{name}"}} {counters[name]}')
+
+	return "\n".join(lines) + "\n"
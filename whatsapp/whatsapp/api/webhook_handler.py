@@ -4,87 +4,103 @@
 import frappe
 import json
 
+from whatsapp.whatsapp.utils.connection_state import (
+	clear_pairing_state,
+	get_connection_state,
+	set_pairing_state,
+	update_connection_state,
+)
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.inbound_queue import enqueue_inbound
+from whatsapp.whatsapp.utils.metrics import increment, timed
+from whatsapp.whatsapp.utils.profiler import profiled
+
 
 @frappe.whitelist(allow_guest=True)
+@timed("handle_event")
+@profiled("handle_event")
 def handle_event(connection_id, event, data):
 	"""Handle events from Node.js service"""
 	try:
 		data = json.loads(data) if isinstance(data, str) else data
+		increment(f"handle_event.{event}")
 		
-		if event == 'qr_code':
-			# Update connection with QR code
-			doc = frappe.get_doc("WhatsApp Connection", connection_id)
-			doc.qr_code = f'<div id="qr-code-{connection_id}"><pre>{data.get("qr", "")}</pre></div>'
-			doc.save(ignore_permissions=True)
-			
-		elif event == 'pairing_code':
-			# Update connection with pairing code
-			doc = frappe.get_doc("WhatsApp Connection", connection_id)
-			doc.pairing_code = data.get("code")
-			doc.save(ignore_permissions=True)
+		if event in ('qr_code', 'pairing_code'):
+			if not frappe.db.exists("WhatsApp Connection", connection_id):
+				return {"success": False, "error": "Unknown connection"}
+
+			# Pairing data is short-lived: cache it and push it to the form
+			# instead of writing the connection document on every refresh
+			if event == 'qr_code':
+				set_pairing_state(connection_id, qr=data.get("qr", ""))
+			else:
+				set_pairing_state(connection_id, pairing_code=data.get("code"))
 		
 		return {"success": True}
 		
 	except Exception as e:
-		frappe.log_error(f"Webhook Event Error: {str(e)}")
+		report_error("Webhook Event Error", e)
 		return {"success": False, "error": str(e)}
 
 
 @frappe.whitelist(allow_guest=True)
+@timed("update_connection_status")
+@profiled("update_connection_status")
 def update_connection_status(connection_id, status):
 	"""Update connection status from Node.js service"""
 	try:
-		doc = frappe.get_doc("WhatsApp Connection", connection_id)
-		doc.status = status
-		
-		if status == "Connected":
-			doc.last_connected = frappe.utils.now()
-		elif status == "Disconnected":
-			doc.last_disconnected = frappe.utils.now()
-		
-		doc.save(ignore_permissions=True)
-		frappe.db.commit()
+		state = get_connection_state(connection_id)
+		if not state:
+			return {"success": False, "error": "Unknown connection"}
+
+		# Reconnect loops repeat the same status; only real changes hit the DB
+		if state.status != status:
+			values = {"status": status}
+			if status == "Connected":
+				values["last_connected"] = frappe.utils.now()
+			elif status == "Disconnected":
+				values["last_disconnected"] = frappe.utils.now()
+
+			frappe.db.set_value("WhatsApp Connection", connection_id, values)
+			frappe.db.commit()
+			update_connection_state(connection_id, status=status)
+
+		if status in ("Connected", "Disconnected", "Failed"):
+			clear_pairing_state(connection_id)
 		
 		return {"success": True}
 		
 	except Exception as e:
-		frappe.log_error(f"Connection Status Update Error: {str(e)}")
+		report_error("Connection Status Update Error", e)
 		return {"success": False, "error": str(e)}
 
 
 @frappe.whitelist(allow_guest=True)
-def save_incoming_message(connection_id, from_number, message_id, message_type, content, timestamp):
-	"""Save incoming message from Node.js service"""
+@timed("save_incoming_message")
+@profiled("save_incoming_message")
+def save_incoming_message(connection_id, message_id, message_type=None, content=None, timestamp=None, from_number=None, media=None, **kwargs):
+	"""Queue an incoming message from Node.js service for background processing"""
 	try:
-		# Clean phone number
-		phone = from_number.replace("@s.whatsapp.net", "").replace("@g.us", "")
-		
-		# Check if contact exists, create if not
-		if not frappe.db.exists("WhatsApp Contact", phone):
-			contact = frappe.get_doc({
-				"doctype": "WhatsApp Contact",
-				"phone_number": phone,
-				"whatsapp_id": from_number,
-				"opt_in_status": "Opted In"
-			})
-			contact.insert(ignore_permissions=True)
-		
-		# Create message log
-		message_log = frappe.get_doc({
-			"doctype": "WhatsApp Message Log",
+		# Older Node.js services post the sender as `from`
+		from_number = from_number or kwargs.get("from")
+		if not from_number:
+			return {"success": False, "error": "Missing sender"}
+
+		if not get_connection_state(connection_id):
+			return {"success": False, "error": "Unknown connection"}
+
+		enqueue_inbound("message", {
+			"connection_id": connection_id,
+			"from_number": from_number,
 			"message_id": message_id,
-			"direction": "Inbound",
-			"contact": phone,
 			"message_type": message_type,
 			"content": content,
-			"status": "Received",
-			"timestamp": frappe.utils.get_datetime(timestamp)
+			"timestamp": timestamp,
+			"media": json.loads(media) if isinstance(media, str) else media
 		})
-		message_log.insert(ignore_permissions=True)
-		frappe.db.commit()
 		
-		return {"success": True, "message_log_id": message_log.name}
+		return {"success": True, "queued": True}
 		
 	except Exception as e:
-		frappe.log_error(f"Save Incoming Message Error: {str(e)}")
+		report_error("Save Incoming Message Error", e)
 		return {"success": False, "error": str(e)}
@@ -5,16 +5,32 @@ import frappe
 import json
 import requests
 
+from whatsapp.whatsapp.tasks.outbox import trigger_relay
+from whatsapp.whatsapp.utils.connection_state import check_rate_limit, get_connection_state, record_messages_sent
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.media_cache import apply_media_handle, get_media_handle
+from whatsapp.whatsapp.utils.metrics import increment, timed
+from whatsapp.whatsapp.utils.number_check import check_numbers, get_ttl_days, save_results
+from whatsapp.whatsapp.utils.priority_lanes import get_lane
+
 
 @frappe.whitelist()
 def send_message(connection, recipient, message_type, content, media_url=None, template=None):
 	"""Send a WhatsApp message"""
+	return queue_message(connection, recipient, message_type, content, media_url, template, caller="API")
+
+
+@timed("send_message")
+def queue_message(connection, recipient, message_type, content, media_url=None, template=None, caller="API"):
+	"""Queue a message in the outbox, in the priority lane for `caller` and the template category"""
 	try:
-		# Get connection
-		conn = frappe.get_doc("WhatsApp Connection", connection)
+		# Get connection state from the registry
+		conn = get_connection_state(connection)
+		if not conn:
+			return {"success": False, "error": f"WhatsApp Connection {connection} not found"}
 		
 		# Check rate limit
-		can_send, message = conn.check_rate_limit()
+		can_send, message = check_rate_limit(conn)
 		if not can_send:
 			return {"success": False, "error": message}
 		
@@ -42,81 +58,94 @@ def send_message(connection, recipient, message_type, content, media_url=None, t
 				"document": {"url": media_url},
 				"caption": content
 			}
+
+		# Reuse the uploaded media instead of re-sending the URL each time
+		if media_url and message_type != "Text":
+			apply_media_handle(message_obj, connection, media_url, message_type)
 		
-		# Create message log
+		template_category = template and frappe.get_cached_value("WhatsApp Message Template", template, "category")
+
+		# Create message log; the outbox relay hands it to the Node.js service
 		message_log = frappe.get_doc({
 			"doctype": "WhatsApp Message Log",
 			"direction": "Outbound",
+			"connection": connection,
 			"contact": recipient,
 			"message_type": message_type,
 			"content": content,
 			"media_url": media_url,
 			"template": template,
-			"status": "Queued"
+			"status": "Queued",
+			"priority_lane": get_lane(caller, template_category),
+			"message_payload": json.dumps(message_obj)
 		})
 		message_log.insert()
-		
-		# Send to Node.js service
-		node_service_url = conn.get_node_service_url()
-		response = requests.post(
-			f"{node_service_url}/api/queue-message",
-			json={
-				"connection_id": connection,
-				"message_log_id": message_log.name,
-				"recipient": recipient,
-				"message": message_obj
-			},
-			timeout=5
-		)
-		
-		if response.status_code == 200:
-			conn.increment_message_count()
-			return {"success": True, "message_log_id": message_log.name}
-		else:
-			message_log.mark_failed(f"Failed to queue: {response.text}")
-			return {"success": False, "error": response.text}
+		trigger_relay()
+
+		record_messages_sent(connection)
+		increment("send_message.queued")
+		return {"success": True, "message_log_id": message_log.name}
 		
 	except Exception as e:
-		frappe.log_error(f"Send Message Error: {str(e)}")
+		increment("send_message.failed")
+		report_error("Send Message Error", e)
 		return {"success": False, "error": str(e)}
 
 
 @frappe.whitelist()
 def get_contact_info(connection, phone_number):
-	"""Get contact information from WhatsApp"""
+	"""Whether a number is on WhatsApp, from the contact's cached check when it is recent"""
 	try:
-		conn = frappe.get_doc("WhatsApp Connection", connection)
-		node_service_url = conn.get_node_service_url()
-		
-		response = requests.post(
-			f"{node_service_url}/api/get-contact-info",
-			json={
-				"connection_id": connection,
-				"phone_number": phone_number
-			},
-			timeout=5
+		contact = frappe.db.get_value(
+			"WhatsApp Contact",
+			{"phone_number": phone_number},
+			["name", "whatsapp_status", "whatsapp_checked_at"],
+			as_dict=True,
 		)
-		
-		if response.status_code == 200:
-			return response.json()
-		else:
-			return {"success": False, "error": response.text}
+		cutoff = frappe.utils.add_days(frappe.utils.now_datetime(), -get_ttl_days())
+		if contact and contact.whatsapp_checked_at and contact.whatsapp_checked_at >= cutoff:
+			return {
+				"success": True,
+				"phone_number": phone_number,
+				"exists": contact.whatsapp_status == "Valid",
+				"checked_at": contact.whatsapp_checked_at
+			}
+
+		exists = check_numbers(connection, [phone_number])[phone_number]
+		if contact:
+			save_results([contact.name] if exists else [], [] if exists else [contact.name])
+
+		return {"success": True, "phone_number": phone_number, "exists": exists, "checked_at": frappe.utils.now()}
 		
 	except Exception as e:
-		frappe.log_error(f"Get Contact Info Error: {str(e)}")
+		report_error("Get Contact Info Error", e)
 		return {"success": False, "error": str(e)}
 
 
 @frappe.whitelist()
-def upload_media(file_url):
-	"""Upload media file for WhatsApp"""
+def upload_media(file_url, connection=None, message_type="Image"):
+	"""Upload media file for WhatsApp
+
+	With a connection, the file is uploaded to WhatsApp once and the cached
+	media handle is returned for reuse in later sends.
+	"""
 	try:
-		# This would handle media upload to WhatsApp servers
-		# For now, return the file URL
-		return {"success": True, "media_url": file_url}
+		if not connection:
+			return {"success": True, "media_url": file_url}
+
+		handle = get_media_handle(connection, file_url, message_type)
+		if not handle:
+			return {"success": False, "error": "Media upload failed"}
+
+		return {
+			"success": True,
+			"media_url": file_url,
+			"media_handle": handle["media"],
+			"expires_at": handle.get("expires_at")
+		}
 		
 	except Exception as e:
-		frappe.log_error(f"Upload Media Error: {str(e)}")
+		report_error("Upload Media Error", e)
 		return {"success": False, "error": str(e)}
 
 
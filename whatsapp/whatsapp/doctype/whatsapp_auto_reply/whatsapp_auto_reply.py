@@ -5,82 +5,170 @@ import frappe
 from frappe.model.document import Document
 import re
 
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.metrics import increment, timed, timer
+
+RULES_KEY = "whatsapp:auto_reply_rules"
+COOLDOWN_KEY = "whatsapp:auto_reply_cooldown:{}:{}"
+BUDGET_KEY = "whatsapp:auto_reply_budget:{}"
+DEFAULT_REPLY_BUDGET = 10
+BUDGET_WINDOW = 60 * 60
+
 
 class WhatsAppAutoReply(Document):
-	pass
+	def on_update(self):
+		frappe.cache().delete_value(RULES_KEY)
 
+	def on_trash(self):
+		frappe.cache().delete_value(RULES_KEY)
 
-def check_auto_reply(connection, from_number, message_content):
-	"""Check if message matches any auto-reply rules"""
-	try:
-		# Get active auto-reply rules for this connection
-		rules = frappe.get_all(
+
+def get_rules():
+	"""Active rules of all connections, in priority order, cached until a rule changes"""
+	return frappe.cache().get_value(
+		RULES_KEY,
+		generator=lambda: frappe.get_all(
 			"WhatsApp Auto Reply",
-			filters={
-				"active": 1,
-				"connection": ["in", [connection, ""]]
-			},
-			fields=["name", "trigger_type", "trigger_value", "reply_template", "custom_reply", "priority"],
+			filters={"active": 1},
+			fields=[
+				"name", "connection", "trigger_type", "trigger_value", "reply_template", "custom_reply",
+				"priority", "cooldown_seconds"
+			],
 			order_by="priority asc"
-		)
+		),
+	)
+
+
+def get_reply_budget():
+	budget = frappe.conf.get("whatsapp_auto_reply_budget")
+	return DEFAULT_REPLY_BUDGET if budget is None else frappe.utils.cint(budget)
+
+
+def is_over_budget(contact):
+	"""Whether the contact has had `whatsapp_auto_reply_budget` replies within the hour"""
+	budget = get_reply_budget()
+	if not budget:
+		return False
+	cache = frappe.cache()
+	return frappe.utils.cint(cache.execute_command("GET", cache.make_key(BUDGET_KEY.format(contact)))) >= budget
+
+
+def is_cooling_down(rule, contact):
+	if not rule.cooldown_seconds:
+		return False
+	cache = frappe.cache()
+	return bool(cache.execute_command("EXISTS", cache.make_key(COOLDOWN_KEY.format(rule.name, contact))))
+
+
+def claim_reply(rule, contact):
+	"""Start the rule's cooldown for the contact and spend one reply of its budget
+
+	Returns False if another worker replied first or the budget ran out.
+	"""
+	cache = frappe.cache()
+	if rule.cooldown_seconds and not cache.set(
+		cache.make_key(COOLDOWN_KEY.format(rule.name, contact)), 1, nx=True, ex=rule.cooldown_seconds
+	):
+		return False
+
+	budget = get_reply_budget()
+	if not budget:
+		return True
+
+	key = cache.make_key(BUDGET_KEY.format(contact))
+	replies = cache.execute_command("INCR", key)
+	if replies == 1:
+		cache.execute_command("EXPIRE", key, BUDGET_WINDOW)
+	return replies <= budget
+
+
+@timed("check_auto_reply")
+def check_auto_reply(connection, from_number, message_content, is_first_message=None):
+	"""Check if message matches any auto-reply rules
+
+	Cooldowns and the reply budget live in Redis and are checked before any
+	database or Node.js work, so a contact or bot flooding messages costs a
+	few cache lookups per message. Callers that already know whether this is
+	the contact's first message pass `is_first_message` to skip the count.
+	"""
+	try:
+		if is_over_budget(from_number):
+			increment("check_auto_reply.over_budget")
+			return False
+
+		# Get active auto-reply rules for this connection
+		rules = [rule for rule in get_rules() if rule.connection in (connection, None, "")]
 		
-		for rule in rules:
-			matched = False
-			
-			if rule.trigger_type == "All Messages":
-				matched = True
-			elif rule.trigger_type == "Keyword":
-				if rule.trigger_value.lower() in message_content.lower():
-					matched = True
-			elif rule.trigger_type == "Pattern":
-				if re.search(rule.trigger_value, message_content, re.IGNORECASE):
-					matched = True
-			elif rule.trigger_type == "First Message":
-				# Check if this is first message from contact
-				message_count = frappe.db.count("WhatsApp Message Log", {
-					"contact": from_number,
-					"direction": "Inbound"
-				})
-				if message_count == 1:
-					matched = True
-			
-			if matched:
-				send_auto_reply(connection, from_number, rule)
-				return True
+		with timer("check_auto_reply.match"):
+			matched_rule = None
+			for rule in rules:
+				if rule.trigger_type == "All Messages":
+					matched_rule = rule
+				elif rule.trigger_type == "Keyword":
+					if rule.trigger_value.lower() in message_content.lower():
+						matched_rule = rule
+				elif rule.trigger_type == "Pattern":
+					if re.search(rule.trigger_value, message_content, re.IGNORECASE):
+						matched_rule = rule
+				elif rule.trigger_type == "First Message":
+					# Only a contact's first message can match, so skip the count while the rule cools down
+					if is_cooling_down(rule, from_number):
+						continue
+					# Check if this is first message from contact
+					if is_first_message is None:
+						is_first_message = frappe.db.count("WhatsApp Message Log", {
+							"contact": from_number,
+							"direction": "Inbound"
+						}) == 1
+					if is_first_message:
+						matched_rule = rule
+
+				if matched_rule:
+					break
+
+		if matched_rule:
+			# A cooling-down rule swallows the message rather than handing it to a lower-priority rule
+			if not claim_reply(matched_rule, from_number):
+				increment("check_auto_reply.cooldown")
+				return False
+
+			increment("check_auto_reply.matched")
+			send_auto_reply(connection, from_number, matched_rule)
+			return True
 		
 		return False
 		
 	except Exception as e:
-		frappe.log_error(f"Auto Reply Check Error: {str(e)}")
+		report_error("Auto Reply Check Error", e)
 		return False
 
 
 def send_auto_reply(connection, recipient, rule):
 	"""Send auto-reply message"""
 	try:
-		from whatsapp.whatsapp.api.whatsapp_api import send_message
+		from whatsapp.whatsapp.api.whatsapp_api import queue_message
 		
 		if rule.reply_template:
 			template = frappe.get_doc("WhatsApp Message Template", rule.reply_template)
 			message_obj = template.get_message_object()
 			
-			send_message(
+			queue_message(
 				connection=connection,
 				recipient=recipient,
 				message_type=template.template_type,
 				content=template.content,
 				media_url=template.media_url or template.media_file,
-				template=rule.reply_template
+				template=rule.reply_template,
+				caller="Auto Reply"
 			)
 		elif rule.custom_reply:
-			send_message(
+			queue_message(
 				connection=connection,
 				recipient=recipient,
 				message_type="Text",
-				content=rule.custom_reply
+				content=rule.custom_reply,
+				caller="Auto Reply"
 			)
 		
-		frappe.log_error(f"Auto-reply sent to {recipient} using rule {rule.name}", "Auto Reply")
-		
 	except Exception as e:
-		frappe.log_error(f"Send Auto Reply Error: {str(e)}")
+		report_error("Send Auto Reply Error", e)
@@ -0,0 +1,15 @@
+// Copyright (c) 2025, INIA GLOBAL and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on("WhatsApp Campaign", {
+	setup(frm) {
+		// Counters are pushed as they change, so the form never needs to poll for them
+		frappe.realtime.on("whatsapp_campaign_stats", (data) => {
+			if (data.campaign !== frm.doc.name || frm.is_dirty()) return;
+			Object.entries(data.changes).forEach(([fieldname, value]) => {
+				frm.doc[fieldname] = value;
+				frm.refresh_field(fieldname);
+			});
+		});
+	},
+});
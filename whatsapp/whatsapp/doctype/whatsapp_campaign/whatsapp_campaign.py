@@ -3,131 +3,274 @@
 
 import frappe
 from frappe.model.document import Document
-import requests
+import datetime
 import json
 
+from whatsapp.whatsapp.tasks.outbox import trigger_relay
+from whatsapp.whatsapp.utils.campaign_stats import get_stats, set_stats
+from whatsapp.whatsapp.utils.connection_state import check_rate_limit, get_connection_state
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.number_check import refresh_contacts
+from whatsapp.whatsapp.utils.priority_lanes import get_lane
+from whatsapp.whatsapp.utils.recipient_filter import filter_recipients, get_suppressed, record_sends
+from whatsapp.whatsapp.utils.template_context import get_batch_context, get_template_variables
+
+DISPATCH_BATCH_SIZE = 1000
+
 
 class WhatsAppCampaign(Document):
 	def validate(self):
 		"""Validate campaign settings"""
-		if self.schedule_type == "Scheduled" and not self.schedule_datetime:
+		if self.schedule_type in ("Scheduled", "Recurring") and not self.schedule_datetime:
 			frappe.throw("Schedule Date & Time is required for scheduled campaigns")
+
+		if self.schedule_type == "Recurring" and not self.recurrence:
+			frappe.throw("Repeat is required for recurring campaigns")
+
+		if self.campaign_type == "Drip" and not self.drip_steps:
+			frappe.throw("Drip campaigns need at least one drip step")
 		
 		# Get total contacts from segment
 		if self.target_segment:
 			segment = frappe.get_doc("WhatsApp Contact Segment", self.target_segment)
 			self.total_contacts = segment.contact_count
 
+	def on_update(self):
+		"""Refresh the stats cache and open forms after a status or settings change"""
+		set_stats(self.name, self.as_dict())
+
 	def before_submit(self):
 		"""Validate before starting campaign"""
 		# Check connection status
-		connection = frappe.get_doc("WhatsApp Connection", self.connection)
-		if connection.status != "Connected":
+		connection = get_connection_state(self.connection)
+		if not connection or connection.status != "Connected":
 			frappe.throw("WhatsApp connection is not active")
 		
 		# Check rate limits
-		can_send, message = connection.check_rate_limit()
+		can_send, message = check_rate_limit(connection)
 		if not can_send:
 			frappe.throw(message)
 
 	def start_campaign(self):
-		"""Start the campaign"""
+		"""Start the campaign, or schedule it if it is not an immediate one"""
+		if self.schedule_type in ("Scheduled", "Recurring"):
+			return self.schedule_campaign()
+
+		return self.run_campaign()
+
+	def schedule_campaign(self):
+		"""Hand the campaign to the scheduler, which runs it at `schedule_datetime`"""
+		self.status = "Scheduled"
+		self.next_run_at = self.schedule_datetime
+		self.save()
+		frappe.msgprint(f"Campaign scheduled for {frappe.utils.format_datetime(self.next_run_at)}")
+
+	def run_campaign(self):
+		"""Run the campaign now: fan a broadcast out, or enroll contacts into the drip steps"""
 		try:
 			self.status = "Running"
-			self.started_at = frappe.utils.now()
+			self.started_at = self.started_at or frappe.utils.now()
 			self.save()
 			
+			if self.campaign_type == "Triggered":
+				frappe.msgprint("Campaign started. Contacts are enrolled as they are triggered.")
+				return
+			
 			# Get contacts from segment
 			segment = frappe.get_doc("WhatsApp Contact Segment", self.target_segment)
 			contacts = segment.get_contacts()
+
+			if self.campaign_type == "Drip":
+				enrolled = self.enroll_contacts(contacts)
+				frappe.msgprint(f"Campaign started. {enrolled} contacts enrolled.")
+				return
 			
 			# Get message template
 			template = frappe.get_doc("WhatsApp Message Template", self.message_template)
 			
-			# Queue messages for sending
-			for contact in contacts:
-				self.queue_message(contact, template)
+			# Queue messages for sending, skipping suppressed and over-cap recipients batch by batch
+			queued = skipped = 0
+			for batch in frappe.utils.create_batch(contacts, DISPATCH_BATCH_SIZE):
+				if frappe.conf.get("whatsapp_check_numbers_at_dispatch"):
+					self.check_numbers(batch)
+				allowed, suppressed, capped = filter_recipients(batch)
+				self.queue_messages(allowed, template)
+				record_sends([contact.get("name") for contact in allowed])
+				queued += len(allowed)
+				skipped += len(suppressed) + len(capped)
+
+			if skipped:
+				self.db_set("messages_suppressed", frappe.utils.cint(self.messages_suppressed) + skipped)
+
+			if self.schedule_type == "Recurring":
+				self.schedule_next_run()
 			
-			frappe.msgprint(f"Campaign started. {len(contacts)} messages queued.")
+			frappe.msgprint(f"Campaign started. {queued} messages queued, {skipped} recipients suppressed or over the frequency cap.")
 			
 		except Exception as e:
 			self.status = "Failed"
 			self.save()
-			frappe.log_error(f"Campaign Start Error: {str(e)}")
+			report_error("Campaign Start Error", e)
 			frappe.throw(f"Failed to start campaign: {str(e)}")
 
+	def check_numbers(self, contacts):
+		"""Check numbers without a recent result, so those not on WhatsApp are suppressed before sending"""
+		try:
+			refresh_contacts(self.connection, [contact.get("name") for contact in contacts])
+		except Exception as e:
+			# Sending to an unchecked number only costs a failed message; do not stop the campaign
+			report_error("Number Check Error", e)
+
+	def schedule_next_run(self):
+		"""Move a recurring campaign on to its next occurrence"""
+		next_run_at = frappe.utils.get_datetime(self.next_run_at or self.schedule_datetime)
+		now = frappe.utils.now_datetime()
+
+		while next_run_at <= now:
+			if self.recurrence == "Daily":
+				next_run_at = frappe.utils.add_days(next_run_at, 1)
+			elif self.recurrence == "Weekly":
+				next_run_at = frappe.utils.add_days(next_run_at, 7)
+			else:
+				next_run_at = frappe.utils.add_months(next_run_at, 1)
+
+		self.status = "Scheduled"
+		self.next_run_at = next_run_at
+		self.save()
+
+	def get_steps(self):
+		"""Drip steps as (template, delay) pairs; a campaign without steps sends its template once"""
+		if not self.drip_steps:
+			return [(self.message_template, datetime.timedelta(0))]
+
+		return [(row.message_template, get_step_delay(row)) for row in self.drip_steps]
+
+	def enroll_contacts(self, contacts):
+		"""Schedule the first step for each contact not already enrolled"""
+		names = [contact.get("name") for contact in contacts if contact.get("name")]
+		if not names:
+			return 0
+
+		enrolled = set()
+		for chunk in frappe.utils.create_batch(names, 1000):
+			enrolled.update(
+				frappe.get_all(
+					"WhatsApp Scheduled Step",
+					filters={"campaign": self.name, "contact": ["in", chunk], "status": ["in", ["Pending", "Paused"]]},
+					pluck="contact",
+				)
+			)
+
+		_template, delay = self.get_steps()[0]
+		due_at = frappe.utils.now_datetime() + delay
+		new_steps = [(name, 1, due_at) for name in names if name not in enrolled]
+		insert_scheduled_steps(self.name, new_steps)
+
+		return len(new_steps)
+
+	def run_due_steps(self, steps):
+		"""Send the due drip steps and schedule each contact's next step"""
+		contacts = {
+			contact.name: contact
+			for contact in frappe.get_all(
+				"WhatsApp Contact",
+				filters={"name": ["in", [step.contact for step in steps]]},
+				fields=["name", "phone_number", "name1", "opt_in_status"],
+			)
+		}
+		suppressed = get_suppressed(list(contacts))
+		campaign_steps = self.get_steps()
+		templates = {}
+		now = frappe.utils.now_datetime()
+
+		done, cancelled, next_steps = [], [], []
+		recipients = {}
+		for step in steps:
+			contact = contacts.get(step.contact)
+			if not contact or step.contact in suppressed or step.step > len(campaign_steps):
+				cancelled.append(step.name)
+				continue
+
+			template_name, _delay = campaign_steps[step.step - 1]
+			if template_name not in templates:
+				templates[template_name] = frappe.get_doc("WhatsApp Message Template", template_name)
+
+			recipients.setdefault(template_name, []).append(contact)
+			done.append(step.name)
+
+			if step.step < len(campaign_steps):
+				next_steps.append((step.contact, step.step + 1, now + campaign_steps[step.step][1]))
+
+		for template_name, template_contacts in recipients.items():
+			self.queue_messages(template_contacts, templates[template_name])
+
+		# Drip steps count towards the frequency cap but are not held back by it
+		done_steps = set(done)
+		record_sends([step.contact for step in steps if step.name in done_steps])
+		set_scheduled_step_status(done, "Done")
+		set_scheduled_step_status(cancelled, "Cancelled")
+		insert_scheduled_steps(self.name, next_steps)
+
 	def pause_campaign(self):
 		"""Pause the campaign"""
 		self.status = "Paused"
 		self.save()
+		update_campaign_steps(self.name, "Pending", "Paused")
 		frappe.msgprint("Campaign paused")
 
 	def resume_campaign(self):
 		"""Resume the campaign"""
 		self.status = "Running"
 		self.save()
+		update_campaign_steps(self.name, "Paused", "Pending")
 		frappe.msgprint("Campaign resumed")
 
 	def stop_campaign(self):
 		"""Stop the campaign"""
 		self.status = "Completed"
 		self.completed_at = frappe.utils.now()
+		self.next_run_at = None
 		self.save()
+		update_campaign_steps(self.name, ["Pending", "Paused"], "Cancelled")
 		frappe.msgprint("Campaign stopped")
 
-	def queue_message(self, contact, template):
-		"""Queue a message for sending"""
+	def queue_messages(self, contacts, template):
+		"""Render a template for a batch of contacts and queue the messages"""
+		if not contacts:
+			return
+
+		# One query for the context of the whole batch, covering only the template's variables
+		contexts = get_batch_context([contact.get("name") for contact in contacts], get_template_variables(template))
+		messages = template.get_message_objects(contexts, connection=self.connection)
+		for contact in contacts:
+			self.queue_message(contact, template, messages.get(contact.get("name")))
+
+	def queue_message(self, contact, template, message_object=None):
+		"""Queue a message for sending through the outbox relay"""
 		try:
+			if message_object is None:
+				context = get_batch_context([contact.get("name")], get_template_variables(template))
+				message_object = template.get_message_object(context.get(contact.get("name")), connection=self.connection)
+
 			# Create message log
 			message_log = frappe.get_doc({
 				"doctype": "WhatsApp Message Log",
 				"campaign": self.name,
+				"connection": self.connection,
 				"contact": contact.get("phone_number"),
 				"direction": "Outbound",
 				"message_type": template.template_type,
+				"content": message_object.get("text") or message_object.get("caption"),
 				"status": "Queued",
-				"template": template.name
+				"template": template.name,
+				"priority_lane": get_lane("Campaign", template.category),
+				"message_payload": json.dumps(message_object)
 			})
 			message_log.insert(ignore_permissions=True)
+			trigger_relay()
 			
-			# Send to Node.js service for processing
-			self.send_to_queue(message_log.name, contact, template)
-			
-		except Exception as e:
-			frappe.log_error(f"Error queuing message: {str(e)}")
-
-	def send_to_queue(self, message_log_id, contact, template):
-		"""Send message to Node.js queue"""
-		try:
-			connection = frappe.get_doc("WhatsApp Connection", self.connection)
-			node_service_url = connection.get_node_service_url()
-			
-			# Prepare message context
-			context = {
-				"name": contact.get("name1", ""),
-				"phone": contact.get("phone_number", "")
-			}
-			
-			message_object = template.get_message_object(context)
-			
-			# Send to Node.js service
-			response = requests.post(
-				f"{node_service_url}/api/queue-message",
-				json={
-					"connection_id": self.connection,
-					"message_log_id": message_log_id,
-					"recipient": contact.get("phone_number"),
-					"message": message_object,
-					"campaign_id": self.name
-				},
-				timeout=5
-			)
-			
-			if response.status_code != 200:
-				frappe.log_error(f"Failed to queue message: {response.text}")
-				
 		except Exception as e:
-			frappe.log_error(f"Error sending to queue: {str(e)}")
+			report_error("Error queuing message", e)
 
 	def update_statistics(self):
 		"""Update campaign statistics"""
@@ -143,17 +286,74 @@ class WhatsAppCampaign(Document):
 			WHERE campaign = %s
 		""", self.name, as_dict=True)[0]
 		
-		self.messages_sent = stats.sent or 0
-		self.messages_delivered = stats.delivered or 0
-		self.messages_read = stats.read or 0
-		self.messages_failed = stats.failed or 0
+		values = {
+			"messages_sent": stats.sent or 0,
+			"messages_delivered": stats.delivered or 0,
+			"messages_read": stats.read or 0,
+			"messages_failed": stats.failed or 0
+		}
 		
 		# Calculate rates
-		if self.messages_sent > 0:
-			self.delivery_rate = (self.messages_delivered / self.messages_sent) * 100
-			self.read_rate = (self.messages_read / self.messages_sent) * 100
+		if values["messages_sent"] > 0:
+			values["delivery_rate"] = (values["messages_delivered"] / values["messages_sent"]) * 100
+			values["read_rate"] = (values["messages_read"] / values["messages_sent"]) * 100
 		
-		self.save(ignore_permissions=True)
+		# Counters only; a full save would also make every open form of the campaign stale
+		self.db_set(values, update_modified=False)
+		set_stats(self.name, self.as_dict())
+
+
+def get_step_delay(row):
+	"""Delay of a drip step as a timedelta"""
+	unit = {"Minutes": "minutes", "Hours": "hours"}.get(row.delay_unit, "days")
+	return datetime.timedelta(**{unit: row.delay or 0})
+
+
+def insert_scheduled_steps(campaign, steps):
+	"""Bulk insert (contact, step, due_at) rows into the scheduled step table"""
+	if not steps:
+		return
+
+	now = frappe.utils.now()
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		"WhatsApp Scheduled Step",
+		fields=["campaign", "contact", "step", "due_at", "status", "creation", "modified", "owner", "modified_by"],
+		values=[(campaign, contact, step, due_at, "Pending", now, now, user, user) for contact, step, due_at in steps],
+	)
+
+
+def set_scheduled_step_status(names, status):
+	for chunk in frappe.utils.create_batch(names, 1000):
+		frappe.db.set_value(
+			"WhatsApp Scheduled Step", {"name": ["in", chunk]}, "status", status, update_modified=False
+		)
+
+
+def update_campaign_steps(campaign, from_status, to_status):
+	"""Move all of a campaign's steps from one status to another"""
+	if isinstance(from_status, str):
+		from_status = [from_status]
+
+	frappe.db.set_value(
+		"WhatsApp Scheduled Step",
+		{"campaign": campaign, "status": ["in", from_status]},
+		"status",
+		to_status,
+		update_modified=False,
+	)
+
+
+@frappe.whitelist()
+def enroll_contact(campaign_name, contact):
+	"""Enroll a single contact into a triggered or drip campaign"""
+	doc = frappe.get_doc("WhatsApp Campaign", campaign_name)
+	if doc.campaign_type not in ("Drip", "Triggered"):
+		frappe.throw("Only drip and triggered campaigns accept enrollments")
+	if doc.status not in ("Running", "Scheduled"):
+		frappe.throw("Campaign is not running")
+
+	return {"enrolled": doc.enroll_contacts([{"name": contact}])}
 
 
 @frappe.whitelist()
@@ -186,16 +386,6 @@ def stop_campaign(campaign_name):
 
 @frappe.whitelist()
 def get_campaign_stats(campaign_name):
-	"""Get campaign statistics"""
-	doc = frappe.get_doc("WhatsApp Campaign", campaign_name)
-	doc.update_statistics()
-	return {
-		"total_contacts": doc.total_contacts,
-		"messages_sent": doc.messages_sent,
-		"messages_delivered": doc.messages_delivered,
-		"messages_read": doc.messages_read,
-		"messages_failed": doc.messages_failed,
-		"delivery_rate": doc.delivery_rate,
-		"read_rate": doc.read_rate,
-		"status": doc.status
-	}
+	"""Get campaign statistics from the stats cache; never recomputes or writes"""
+	frappe.has_permission("WhatsApp Campaign", "read", campaign_name, throw=True)
+	return get_stats(campaign_name)
@@ -1,8 +1,40 @@
 // Copyright (c) 2025, INIA GLOBAL and contributors
 // For license information, please see license.txt
 
-// frappe.ui.form.on("WhatsApp Connection", {
-// 	refresh(frm) {
+frappe.ui.form.on("WhatsApp Connection", {
+	refresh(frm) {
+		if (frm.is_new()) return;
 
-// 	},
-// });
+		// QR and pairing codes are not saved on the document; they are cached
+		// server-side and pushed over realtime while the number is pairing
+		frappe.call({
+			method: "whatsapp.whatsapp.doctype.whatsapp_connection.whatsapp_connection.get_pairing_info",
+			args: { connection_name: frm.doc.name },
+			callback(r) {
+				render_pairing_state(frm, r.message || {});
+			},
+		});
+
+		frappe.realtime.off("whatsapp_pairing");
+		frappe.realtime.on("whatsapp_pairing", (data) => {
+			if (data.connection !== frm.doc.name) return;
+			render_pairing_state(frm, data.cleared ? {} : data);
+		});
+	},
+});
+
+function render_pairing_state(frm, state) {
+	const wrapper = frm.get_field("qr_code").$wrapper;
+	let html = "";
+
+	if (state.qr) {
+		html += `<div id="qr-code-${frappe.utils.escape_html(frm.doc.name)}"><pre>${frappe.utils.escape_html(
+			state.qr
+		)}</pre></div>`;
+	}
+	if (state.pairing_code) {
+		html += `<div class="pairing-code"><h3>${frappe.utils.escape_html(state.pairing_code)}</h3></div>`;
+	}
+
+	wrapper.html(html);
+}
@@ -6,6 +6,18 @@ from frappe.model.document import Document
 import json
 import requests
 
+from whatsapp.whatsapp.utils.connection_state import (
+	check_rate_limit,
+	get_connection_state,
+	get_node_service_url,
+	get_pairing_state,
+	invalidate_connection_state,
+	record_messages_sent,
+	set_pairing_state,
+	update_connection_state,
+)
+from whatsapp.whatsapp.utils.error_reporter import report_error
+
 
 class WhatsAppConnection(Document):
 	def validate(self):
@@ -25,6 +37,17 @@ class WhatsAppConnection(Document):
 			elif self.status == "Disconnected":
 				self.last_disconnected = frappe.utils.now()
 
+		# Counters are owned by the registry; only refresh status and limits
+		update_connection_state(
+			self.name,
+			status=self.status,
+			daily_message_limit=self.daily_message_limit,
+			monthly_message_limit=self.monthly_message_limit,
+		)
+
+	def on_trash(self):
+		invalidate_connection_state(self.name)
+
 	def after_insert(self):
 		"""Initiate WhatsApp connection"""
 		try:
@@ -43,14 +66,12 @@ class WhatsAppConnection(Document):
 				timeout=10
 			)
 
-			frappe.log_error("Connection response", response)
-
 			if response.status_code == 200:
 				data = response.json()
 				self.status = "Connecting"
 				
 				if self.connection_method == "Pairing Code" and data.get("pairing_code"):
-					self.pairing_code = data.get("pairing_code")
+					set_pairing_state(self.name, pairing_code=data.get("pairing_code"))
 				
 				self.save()
 				frappe.msgprint(f"Connection initiated. Status: {self.status}")
@@ -59,7 +80,7 @@ class WhatsAppConnection(Document):
 				frappe.throw(f"Failed to connect: {response.text}")
 				
 		except Exception as e:
-			frappe.log_error(f"WhatsApp Connection Error: {str(e)}")
+			report_error("WhatsApp Connection Error", e)
 			self.status = "Failed"
 			self.save()
 			frappe.throw(f"Connection failed: {str(e)}")
@@ -82,35 +103,30 @@ class WhatsAppConnection(Document):
 				frappe.throw(f"Failed to disconnect: {response.text}")
 				
 		except Exception as e:
-			frappe.log_error(f"WhatsApp Disconnect Error: {str(e)}")
+			report_error("WhatsApp Disconnect Error", e)
 			frappe.throw(f"Disconnect failed: {str(e)}")
 
 	def get_node_service_url(self):
 		"""Get Node.js service URL from site config"""
-		return frappe.conf.get("whatsapp_node_service_url", "http://localhost:3000")
+		return get_node_service_url(self.name)
 
 	def check_rate_limit(self):
 		"""Check if rate limit is exceeded"""
-		if self.messages_sent_today >= self.daily_message_limit:
-			return False, "Daily message limit exceeded"
-		
-		if self.messages_sent_this_month >= self.monthly_message_limit:
-			return False, "Monthly message limit exceeded"
-		
-		return True, "OK"
+		return check_rate_limit(get_connection_state(self.name))
 
 	def increment_message_count(self):
 		"""Increment message counters"""
-		self.db_set("messages_sent_today", self.messages_sent_today + 1)
-		self.db_set("messages_sent_this_month", self.messages_sent_this_month + 1)
+		record_messages_sent(self.name)
 
 	def reset_daily_counter(self):
 		"""Reset daily message counter (called by scheduler)"""
 		self.db_set("messages_sent_today", 0)
+		update_connection_state(self.name, messages_sent_today=0)
 
 	def reset_monthly_counter(self):
 		"""Reset monthly message counter (called by scheduler)"""
 		self.db_set("messages_sent_this_month", 0)
+		update_connection_state(self.name, messages_sent_this_month=0)
 
 
 @frappe.whitelist()
@@ -127,15 +143,23 @@ def disconnect_whatsapp(connection_name):
 	return doc.disconnect()
 
 
+@frappe.whitelist()
+def get_pairing_info(connection_name):
+	"""Get the current QR/pairing code for a connection that is pairing"""
+	frappe.has_permission("WhatsApp Connection", "read", connection_name, throw=True)
+	return get_pairing_state(connection_name) or {}
+
+
 @frappe.whitelist()
 def get_connection_status(connection_name):
 	"""Get current connection status"""
 	doc = frappe.get_doc("WhatsApp Connection", connection_name)
+	state = get_connection_state(connection_name)
 	return {
 		"status": doc.status,
 		"last_connected": doc.last_connected,
-		"messages_sent_today": doc.messages_sent_today,
-		"messages_sent_this_month": doc.messages_sent_this_month,
+		"messages_sent_today": state.messages_sent_today,
+		"messages_sent_this_month": state.messages_sent_this_month,
 		"daily_limit": doc.daily_message_limit,
 		"monthly_limit": doc.monthly_message_limit
 	}
@@ -5,6 +5,11 @@ import frappe
 from frappe.model.document import Document
 import json
 
+from whatsapp.whatsapp.utils.contact_attributes import get_attribute_values, sync_contact_attributes
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.recipient_filter import suppress, unsuppress
+from whatsapp.whatsapp.utils.tag_index import next_contact_ordinal, remove_contact, update_contact_tags
+
 
 class WhatsAppContact(Document):
 	def validate(self):
@@ -27,6 +32,48 @@ class WhatsAppContact(Document):
 			except json.JSONDecodeError:
 				frappe.throw("Custom fields must be valid JSON")
 
+		# Opt-outs are suppressed; opting back in lifts only an opt-out suppression
+		if self.opt_in_status == "Opted Out":
+			self.suppression_reason = self.suppression_reason or "Opted Out"
+		elif self.suppression_reason == "Opted Out":
+			self.suppression_reason = None
+
+		# Typed values of the declared attributes, written to the attribute store on update
+		if self.has_value_changed("custom_fields"):
+			self.flags.attribute_values = get_attribute_values(self.custom_fields)
+
+	def before_insert(self):
+		if not self.ordinal:
+			self.ordinal = next_contact_ordinal()
+
+	def on_update(self):
+		"""Keep the tag bitmap index and suppression set in step with the contact"""
+		previous = self.get_doc_before_save()
+		try:
+			old_tags = {row.tag for row in previous.tags} if previous else set()
+			new_tags = {row.tag for row in self.tags}
+			update_contact_tags(self.ordinal, new_tags - old_tags, old_tags - new_tags, is_new=not previous)
+		except Exception as e:
+			report_error("Error updating tag index", e)
+
+		old_reason = previous.suppression_reason if previous else None
+		if (old_reason or None) != (self.suppression_reason or None):
+			(suppress if self.suppression_reason else unsuppress)([self.name])
+
+		if self.flags.attribute_values is not None:
+			sync_contact_attributes(self.name, self.flags.attribute_values)
+			self.flags.attribute_values = None
+
+	def on_trash(self):
+		try:
+			remove_contact(self.ordinal, {row.tag for row in self.tags})
+		except Exception as e:
+			report_error("Error updating tag index", e)
+
+		frappe.db.delete("WhatsApp Contact Attribute Value", {"contact": self.name})
+		if self.suppression_reason:
+			unsuppress([self.name])
+
 	def opt_in(self):
 		"""Mark contact as opted in"""
 		self.opt_in_status = "Opted In"
@@ -102,6 +149,11 @@ def import_contacts(contacts_data):
 				if contact.get("tags"):
 					for tag in contact.get("tags"):
 						doc.add_tag(tag)
+				if contact.get("custom_fields"):
+					# Merged into the existing JSON; declared attributes are re-projected on save
+					custom_fields = json.loads(doc.custom_fields) if doc.custom_fields else {}
+					custom_fields.update(contact.get("custom_fields"))
+					doc.custom_fields = json.dumps(custom_fields)
 				
 				doc.save(ignore_permissions=True)
 				imported += 1
@@ -116,7 +168,7 @@ def import_contacts(contacts_data):
 		}
 		
 	except Exception as e:
-		frappe.log_error(f"Contact Import Error: {str(e)}")
+		report_error("Contact Import Error", e)
 		return {
 			"success": False,
 			"error": str(e)
@@ -0,0 +1,21 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from whatsapp.whatsapp.utils.contact_attributes import REINDEX_METHOD, clear_attributes_cache
+
+
+class WhatsAppContactAttribute(Document):
+	def on_update(self):
+		"""Project existing contacts' values when the attribute is declared or retyped"""
+		clear_attributes_cache()
+		if self.has_value_changed("attribute_type"):
+			frappe.enqueue(
+				REINDEX_METHOD, queue="long", timeout=60 * 60, enqueue_after_commit=True, attribute=self.name
+			)
+
+	def on_trash(self):
+		clear_attributes_cache()
+		frappe.db.delete("WhatsApp Contact Attribute Value", {"attribute": self.name})
@@ -0,0 +1,17 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class WhatsAppContactAttributeValue(Document):
+	pass
+
+
+def on_doctype_update():
+	"""Indexes for segment filters on each value type and for replacing a contact's values"""
+	frappe.db.add_index("WhatsApp Contact Attribute Value", ["attribute", "value_text"])
+	frappe.db.add_index("WhatsApp Contact Attribute Value", ["attribute", "value_number"])
+	frappe.db.add_index("WhatsApp Contact Attribute Value", ["attribute", "value_date"])
+	frappe.db.add_index("WhatsApp Contact Attribute Value", ["contact", "attribute"])
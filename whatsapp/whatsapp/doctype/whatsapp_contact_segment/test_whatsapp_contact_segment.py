@@ -4,6 +4,23 @@
 # import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from whatsapp.whatsapp.doctype.whatsapp_contact_segment.whatsapp_contact_segment import estimate_from_sample
+
 
 class TestWhatsAppContactSegment(FrappeTestCase):
-	pass
+	def test_estimate_scales_sample_rate(self):
+		estimate = estimate_from_sample(matches=500, sample_size=2000, population=1_000_000)
+		self.assertEqual(estimate["count"], 250_000)
+		self.assertFalse(estimate["exact"])
+		# 1.96 * 1M * sqrt(0.25 * 0.75 / 2000), less the finite population correction
+		self.assertAlmostEqual(estimate["error"], 18_959, delta=5)
+
+	def test_estimate_without_matches_has_an_upper_bound(self):
+		estimate = estimate_from_sample(matches=0, sample_size=2000, population=1_000_000)
+		self.assertEqual(estimate["count"], 0)
+		self.assertEqual(estimate["error"], 1500)
+
+	def test_full_match_has_no_error(self):
+		estimate = estimate_from_sample(matches=2000, sample_size=2000, population=1_000_000)
+		self.assertEqual(estimate["count"], 1_000_000)
+		self.assertEqual(estimate["error"], 0)
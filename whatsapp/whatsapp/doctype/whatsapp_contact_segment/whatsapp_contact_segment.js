@@ -0,0 +1,81 @@
+// Copyright (c) 2025, INIA GLOBAL and contributors
+// For license information, please see license.txt
+
+const SEGMENT_MODULE = "whatsapp.whatsapp.doctype.whatsapp_contact_segment.whatsapp_contact_segment";
+
+frappe.ui.form.on("WhatsApp Contact Segment", {
+	onload(frm) {
+		frappe.realtime.off("whatsapp_number_check");
+		frappe.realtime.on("whatsapp_number_check", (data) => {
+			if (data.error) {
+				frappe.msgprint(__("Number validation of {0} failed: {1}", [data.segment, data.error]));
+			} else if (data.done) {
+				frappe.msgprint(
+					__("Checked {0} contacts of {1}; {2} are not on WhatsApp and will be skipped by campaigns", [
+						data.contacts,
+						data.segment,
+						data.invalid,
+					])
+				);
+			}
+		});
+	},
+
+	refresh(frm) {
+		if (!frm.is_new()) {
+			frm.add_custom_button(__("Count Exactly"), () => {
+				frappe.call({
+					method: `${SEGMENT_MODULE}.refresh_segment`,
+					args: { segment_name: frm.doc.name },
+					freeze: true,
+					callback() {
+						frm.reload_doc();
+					},
+				});
+			});
+			frm.add_custom_button(__("Validate Numbers"), () => {
+				frappe.prompt(
+					{ fieldname: "connection", fieldtype: "Link", options: "WhatsApp Connection", label: __("Connection"), reqd: 1 },
+					(values) => {
+						frappe.call({
+							method: `${SEGMENT_MODULE}.start_number_validation`,
+							args: { segment_name: frm.doc.name, connection: values.connection },
+							callback(r) {
+								if (r.message) frappe.show_alert(r.message.message);
+							},
+						});
+					},
+					__("Validate Numbers")
+				);
+			});
+		}
+		preview_count(frm);
+	},
+
+	filter_conditions(frm) {
+		// Estimates are cheap but the field changes on every keystroke
+		clearTimeout(frm.__preview_timeout);
+		frm.__preview_timeout = setTimeout(() => preview_count(frm), 500);
+	},
+});
+
+function preview_count(frm) {
+	frappe.call({
+		method: `${SEGMENT_MODULE}.preview_segment_count`,
+		args: { filter_conditions: frm.doc.filter_conditions || "{}" },
+		callback(r) {
+			const estimate = r.message || {};
+			if (estimate.invalid) {
+				frm.set_intro(__("Filter conditions are not valid yet"), "orange");
+				return;
+			}
+			const count = format_number(estimate.count || 0, null, 0);
+			frm.set_intro(
+				estimate.exact
+					? __("{0} matching contacts", [count])
+					: __("About {0} matching contacts (± {1})", [count, format_number(estimate.error, null, 0)]),
+				"blue"
+			);
+		},
+	});
+}
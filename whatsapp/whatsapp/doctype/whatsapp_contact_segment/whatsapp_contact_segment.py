@@ -4,6 +4,17 @@
 import frappe
 from frappe.model.document import Document
 import json
+import math
+import random
+
+from whatsapp.whatsapp.utils.contact_attributes import count_matching_contacts, get_filter_query, get_matching_contacts
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.number_check import VALIDATE_METHOD
+from whatsapp.whatsapp.utils.tag_index import evaluate, get_sql_condition, load_bitmaps, parse_tag_expression
+
+COUNT_METHOD = "whatsapp.whatsapp.doctype.whatsapp_contact_segment.whatsapp_contact_segment.update_segment_count"
+DEFAULT_SAMPLE_SIZE = 2000
+POPULATION_CACHE_KEY = "whatsapp:contact_population"
 
 
 class WhatsAppContactSegment(Document):
@@ -11,23 +22,27 @@ class WhatsAppContactSegment(Document):
 		"""Validate filter conditions JSON"""
 		if self.filter_conditions:
 			try:
-				json.loads(self.filter_conditions)
+				filters = json.loads(self.filter_conditions)
 			except json.JSONDecodeError:
 				frappe.throw("Filter conditions must be valid JSON")
 
+			# Raises on a malformed tag expression or attribute condition
+			get_tag_expression(filters)
+			if filters.get("custom_field"):
+				get_filter_query(filters["custom_field"])
+
 	def on_update(self):
-		"""Update contact count when segment is updated"""
+		"""Recount in the background so saving a segment stays fast"""
 		if self.auto_update:
-			self.update_contact_count()
+			schedule_count(self.name)
 
 	def update_contact_count(self):
 		"""Update the contact count based on filter conditions"""
 		try:
-			contacts = self.get_contacts()
-			self.db_set("contact_count", len(contacts))
+			self.db_set("contact_count", self.count_contacts())
 			self.db_set("last_updated", frappe.utils.now())
 		except Exception as e:
-			frappe.log_error(f"Error updating contact count: {str(e)}")
+			report_error("Error updating contact count", e)
 
 	def get_contacts(self):
 		"""Get contacts matching the segment filters"""
@@ -41,15 +56,82 @@ class WhatsAppContactSegment(Document):
 			query = frappe.db.get_all(
 				"WhatsApp Contact",
 				filters=self._build_filters(filters),
-				fields=["name", "phone_number", "name1", "opt_in_status"]
+				fields=["name", "phone_number", "name1", "opt_in_status", "ordinal"]
 			)
+
+			tag_expression = get_tag_expression(filters)
+			if tag_expression:
+				query = filter_by_tags(query, tag_expression)
+
+			if filters.get("custom_field"):
+				matching = get_matching_contacts(filters["custom_field"])
+				query = [contact for contact in query if contact.name in matching]
 			
 			return query
 			
 		except Exception as e:
-			frappe.log_error(f"Error getting segment contacts: {str(e)}")
+			report_error("Error getting segment contacts", e)
 			return []
 
+	def count_contacts(self):
+		"""Number of contacts in the segment
+
+		Tag-only segments are counted from the bitmap index and attribute-only
+		segments from the attribute store, without loading the contacts.
+		"""
+		filters = json.loads(self.filter_conditions or "{}")
+		tag_expression = get_tag_expression(filters)
+		if tag_expression and not self._build_filters(filters) and not filters.get("custom_field"):
+			bitmap = evaluate(tag_expression)
+			if bitmap is not None:
+				return bitmap.count()
+
+		if filters.get("custom_field") and not self._build_filters(filters) and not tag_expression:
+			return count_matching_contacts(filters["custom_field"])
+
+		return len(self.get_contacts())
+
+	def estimate_contact_count(self):
+		"""Estimated number of contacts in the segment with a 95% error bound
+
+		The filters are applied to a uniform random sample of contact ordinals
+		and the match rate is scaled up to all contacts. Tag-only segments and
+		small contact bases are counted exactly.
+		"""
+		filters = json.loads(self.filter_conditions or "{}")
+		standard_filters = self._build_filters(filters)
+		tag_expression = get_tag_expression(filters)
+		custom_filters = filters.get("custom_field")
+
+		if tag_expression and not standard_filters and not custom_filters:
+			bitmap = evaluate(tag_expression)
+			if bitmap is not None:
+				return {"count": bitmap.count(), "error": 0, "exact": True}
+
+		population, max_ordinal = get_contact_population()
+		sample_size = frappe.utils.cint(frappe.conf.get("whatsapp_segment_sample_size")) or DEFAULT_SAMPLE_SIZE
+		if population <= sample_size:
+			return {"count": self.count_contacts(), "error": 0, "exact": True}
+
+		# Ordinals of deleted contacts are holes, so the sample is what the lookup finds
+		ordinals = random.sample(range(1, max_ordinal + 1), min(sample_size, max_ordinal))
+		sampled = frappe.get_all("WhatsApp Contact", filters={"ordinal": ["in", ordinals]}, pluck="name")
+		if not sampled:
+			return {"count": self.count_contacts(), "error": 0, "exact": True}
+
+		matches = frappe.get_all(
+			"WhatsApp Contact",
+			filters={**standard_filters, "ordinal": ["in", ordinals]},
+			fields=["name", "ordinal"],
+		)
+		if tag_expression:
+			matches = filter_by_tags(matches, tag_expression)
+		if custom_filters:
+			matching = get_matching_contacts(custom_filters, contacts=[contact.name for contact in matches])
+			matches = [contact for contact in matches if contact.name in matching]
+
+		return estimate_from_sample(len(matches), len(sampled), population)
+
 	def _build_filters(self, filter_conditions):
 		"""Build Frappe filters from JSON conditions"""
 		filters = {}
@@ -60,13 +142,16 @@ class WhatsAppContactSegment(Document):
 		#   "tags": ["VIP", "Active"],
 		#   "custom_field": {"city": "New York"}
 		# }
+		#
+		# "tags" is either a list of tags that must all be present or a boolean
+		# expression such as "VIP AND (Active OR Trial) AND NOT Churned"
 		
 		for key, value in filter_conditions.items():
 			if key == "tags":
 				# Handle tag filtering separately
 				continue
 			elif key == "custom_field":
-				# Handle custom field filtering
+				# Matched against the attribute store, see get_matching_contacts
 				continue
 			else:
 				filters[key] = value
@@ -74,6 +159,121 @@ class WhatsAppContactSegment(Document):
 		return filters
 
 
+def get_tag_expression(filter_conditions):
+	"""Parsed tag expression of a segment's filters, or None"""
+	tags = filter_conditions.get("tags")
+	if not tags:
+		return None
+
+	if isinstance(tags, str):
+		return parse_tag_expression(tags)
+
+	return ("and", [("tag", tag) for tag in tags])
+
+
+def filter_by_tags(contacts, tag_expression):
+	"""Keep the contacts matching a parsed tag expression"""
+	bitmap = evaluate(tag_expression)
+	if bitmap is not None:
+		return [contact for contact in contacts if contact.ordinal and contact.ordinal in bitmap]
+
+	# Index unavailable (being rebuilt): evaluate the expression in SQL
+	matching = set(frappe.db.sql_list(
+		f"SELECT name FROM `tabWhatsApp Contact` contact WHERE {get_sql_condition(tag_expression)}"
+	))
+	return [contact for contact in contacts if contact.name in matching]
+
+
+@frappe.whitelist()
+def preview_tag_expression(expression):
+	"""Count the contacts matching a tag expression"""
+	frappe.has_permission("WhatsApp Contact", "read", throw=True)
+	tree = parse_tag_expression(expression)
+
+	bitmap = evaluate(tree)
+	if bitmap is not None:
+		return {"count": bitmap.count()}
+
+	count = frappe.db.sql(f"SELECT COUNT(*) FROM `tabWhatsApp Contact` contact WHERE {get_sql_condition(tree)}")[0][0]
+	return {"count": count}
+
+
+def estimate_from_sample(matches, sample_size, population):
+	"""Scale a sample's match rate to the population, with a 95% normal-approximation bound"""
+	rate = matches / sample_size
+	if matches == 0:
+		# Rule of three: with no match in n draws the rate is below 3/n at 95%
+		error = math.ceil(3 * population / sample_size)
+	else:
+		correction = (population - sample_size) / (population - 1)
+		error = math.ceil(1.96 * population * math.sqrt(rate * (1 - rate) / sample_size * correction))
+	return {"count": round(rate * population), "error": error, "exact": False, "sample_size": sample_size}
+
+
+def get_contact_population():
+	"""(number of contacts with an ordinal, highest ordinal), cached for a minute"""
+	cache = frappe.cache()
+	population = cache.get_value(POPULATION_CACHE_KEY)
+	if population:
+		return population
+
+	bitmaps = load_bitmaps(())
+	max_ordinal = frappe.db.sql("SELECT IFNULL(MAX(ordinal), 0) FROM `tabWhatsApp Contact`")[0][0]
+	if bitmaps is not None:
+		count = bitmaps[None].bit_count()
+	else:
+		count = frappe.db.sql("SELECT COUNT(*) FROM `tabWhatsApp Contact` WHERE ordinal > 0")[0][0]
+
+	population = (count, max_ordinal)
+	cache.set_value(POPULATION_CACHE_KEY, population, expires_in_sec=60)
+	return population
+
+
+def schedule_count(segment_name):
+	"""Enqueue an exact recount unless one is already waiting"""
+	cache = frappe.cache()
+	if cache.set(cache.make_key(f"whatsapp:segment_count:{segment_name}"), 1, nx=True, ex=10 * 60):
+		frappe.enqueue(COUNT_METHOD, queue="long", enqueue_after_commit=True, segment_name=segment_name)
+
+
+def update_segment_count(segment_name):
+	cache = frappe.cache()
+	# Cleared first, so edits made while counting schedule another count
+	cache.delete(cache.make_key(f"whatsapp:segment_count:{segment_name}"))
+	if frappe.db.exists("WhatsApp Contact Segment", segment_name):
+		frappe.get_doc("WhatsApp Contact Segment", segment_name).update_contact_count()
+		frappe.db.commit()
+
+
+@frappe.whitelist()
+def preview_segment_count(filter_conditions):
+	"""Estimated contact count for filters being edited, before the segment is saved"""
+	frappe.has_permission("WhatsApp Contact", "read", throw=True)
+	segment = frappe.get_doc({"doctype": "WhatsApp Contact Segment", "filter_conditions": filter_conditions})
+	try:
+		segment.validate()
+	except frappe.ValidationError as e:
+		# Half-typed filters are expected while editing; no error dialog
+		frappe.clear_messages()
+		return {"invalid": str(e)}
+	return segment.estimate_contact_count()
+
+
+@frappe.whitelist()
+def start_number_validation(segment_name, connection):
+	"""Check in the background which of the segment's numbers are on WhatsApp"""
+	frappe.has_permission("WhatsApp Contact", "write", throw=True)
+	frappe.enqueue(
+		VALIDATE_METHOD,
+		queue="long",
+		timeout=4 * 60 * 60,
+		segment_name=segment_name,
+		connection=connection,
+		user=frappe.session.user,
+	)
+	return {"success": True, "message": "Number validation started. You will be notified when it is done."}
+
+
 @frappe.whitelist()
 def get_segment_contacts(segment_name):
 	"""API method to get contacts in a segment"""
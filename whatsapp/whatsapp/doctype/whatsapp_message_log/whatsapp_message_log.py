@@ -4,69 +4,210 @@
 import frappe
 from frappe.model.document import Document
 
+from whatsapp.whatsapp.tasks.retry import TRANSIENT, classify_error, get_max_retries, get_next_retry_at
+from whatsapp.whatsapp.utils.campaign_stats import mark_stats_stale
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.metrics import increment, timed
+from whatsapp.whatsapp.utils.profiler import profiled
+from whatsapp.whatsapp.utils.recipient_filter import is_bounce, suppress
+
+FULLTEXT_INDEX = "content_fulltext"
+SEARCH_FIELDS = (
+	"name", "direction", "connection", "contact", "campaign", "message_type", "content", "status",
+	"timestamp", "creation",
+)
+
+
+# Outbound statuses in the order receipts move a message through; pending ones share the lowest rank
+STATUS_RANK = {"Queued": 0, "Sending": 0, "Retrying": 0, "Sent": 1, "Delivered": 2, "Read": 3}
+STATUS_TIMESTAMPS = {"Sent": "sent_at", "Delivered": "delivered_at", "Read": "read_at"}
+# Only a message still waiting on Node can fail; a late failure report never undoes a receipt
+FAILABLE_STATUSES = ("Queued", "Sending")
+
 
 class WhatsAppMessageLog(Document):
 	def on_update(self):
-		"""Update contact statistics when message status changes"""
-		if self.has_value_changed("status") and self.contact:
+		"""Count a new inbound message on the contact; outbound ones are counted once sent"""
+		if self.flags.in_insert and self.direction == "Inbound" and self.contact:
 			try:
 				contact = frappe.get_doc("WhatsApp Contact", self.contact)
 				contact.update_message_stats(self.message_type, self.direction)
 			except Exception as e:
-				frappe.log_error(f"Error updating contact stats: {str(e)}")
+				report_error("Error updating contact stats", e)
 
 	def mark_sent(self, message_id=None):
 		"""Mark message as sent"""
-		self.status = "Sent"
-		self.sent_at = frappe.utils.now()
-		if message_id:
-			self.message_id = message_id
-		self.save(ignore_permissions=True)
+		return self._transition("Sent", message_id)
 
 	def mark_delivered(self):
 		"""Mark message as delivered"""
-		self.status = "Delivered"
-		self.delivered_at = frappe.utils.now()
-		self.save(ignore_permissions=True)
+		return self._transition("Delivered")
 
 	def mark_read(self):
 		"""Mark message as read"""
-		self.status = "Read"
-		self.read_at = frappe.utils.now()
-		self.save(ignore_permissions=True)
+		return self._transition("Read")
+
+	def _transition(self, status, message_id=None):
+		"""Apply a status through `transition_status`, like a receipt from Node; returns whether it changed"""
+		changed = transition_status(self.name, status, message_id)
+		if changed:
+			if status == "Sent":
+				record_sent(self.name, self)
+			if self.campaign:
+				mark_stats_stale(self.campaign)
+		self.reload()
+		return changed
 
 	def mark_failed(self, error_message):
-		"""Mark message as failed"""
-		self.status = "Failed"
-		self.failed_at = frappe.utils.now()
+		"""Mark message as failed, or schedule a retry if the error is transient"""
+		error_class = classify_error(error_message)
+		now = frappe.utils.now()
+		self.append("attempts", {
+			"attempted_at": now,
+			"status": "Failed",
+			"error_class": error_class,
+			"error_message": error_message
+		})
 		self.error_message = error_message
+
+		if error_class == TRANSIENT and self.direction == "Outbound" and frappe.utils.cint(self.retry_count) < get_max_retries():
+			self.retry_count = frappe.utils.cint(self.retry_count) + 1
+			self.status = "Retrying"
+			self.next_retry_at = get_next_retry_at(self.retry_count)
+			increment("message.retry_scheduled")
+		else:
+			self.status = "Failed"
+			self.failed_at = now
+			self.next_retry_at = None
 		self.save(ignore_permissions=True)
 
+		# Numbers that cannot receive WhatsApp messages are kept out of future campaigns
+		if self.contact and is_bounce(error_message):
+			if not frappe.db.get_value("WhatsApp Contact", self.contact, "suppression_reason"):
+				frappe.db.set_value("WhatsApp Contact", self.contact, "suppression_reason", "Bounced")
+				suppress([self.contact])
+
+
+def on_doctype_update():
+	"""Indexes for the outbox relay's per-lane scans, per-campaign reads, due retries and search"""
+	frappe.db.add_index("WhatsApp Message Log", ["status", "connection", "priority_lane", "creation"])
+	frappe.db.add_index("WhatsApp Message Log", ["campaign"])
+	frappe.db.add_index("WhatsApp Message Log", ["status", "next_retry_at"])
+	frappe.db.add_index("WhatsApp Message Log", ["timestamp"])
+	add_content_fulltext_index()
+
+
+def add_content_fulltext_index():
+	"""Native full-text index over message content (MariaDB only)"""
+	if frappe.db.db_type != "mariadb" or frappe.db.has_index("tabWhatsApp Message Log", FULLTEXT_INDEX):
+		return
+
+	frappe.db.sql_ddl(f"ALTER TABLE `tabWhatsApp Message Log` ADD FULLTEXT INDEX `{FULLTEXT_INDEX}` (content)")
+
+
+def transition_status(message_log, status, message_id=None):
+	"""Move a message forward to Sent, Delivered or Read with one conditional UPDATE
+
+	The row only changes if its current status ranks below `status`, so
+	receipts that arrive late or more than once change nothing. Returns
+	whether the row changed.
+	"""
+	timestamp_field = STATUS_TIMESTAMPS[status]
+	values = {
+		"name": message_log,
+		"status": status,
+		"now": frappe.utils.now(),
+		"previous": tuple(previous for previous, rank in STATUS_RANK.items() if rank < STATUS_RANK[status]),
+	}
+	extra = ""
+	if status == "Sent":
+		extra = ", message_id = COALESCE(%(message_id)s, message_id), next_retry_at = NULL"
+		values["message_id"] = message_id
+
+	query = f"""
+		UPDATE `tabWhatsApp Message Log`
+		SET status = %(status)s, {timestamp_field} = %(now)s, modified = %(now)s{extra}
+		WHERE name = %(name)s AND status IN %(previous)s
+	"""
+	if frappe.db.db_type == "postgres":
+		return bool(frappe.db.sql(f"{query} RETURNING name", values))
+
+	frappe.db.sql(query, values)
+	# The status condition means a matched row is always a changed row
+	return frappe.db.sql("SELECT ROW_COUNT()")[0][0] > 0
+
+
+def record_sent(message_log, log):
+	"""Contact stats and retry history of a message that has just been sent"""
+	if log.contact:
+		frappe.db.sql(
+			"""
+			UPDATE `tabWhatsApp Contact`
+			SET total_messages_sent = IFNULL(total_messages_sent, 0) + 1,
+				last_message_date = %s,
+				last_message_type = %s
+			WHERE name = %s
+			""",
+			(frappe.utils.now(), log.message_type, log.contact),
+		)
+
+	if log.retry_count:
+		# First-time sends are not recorded, only the attempt that ended a retry sequence
+		doc = frappe.get_doc("WhatsApp Message Log", message_log)
+		doc.append("attempts", {"attempted_at": frappe.utils.now(), "status": "Sent"}).db_insert()
+
 
 @frappe.whitelist()
-def update_message_status(message_log_id, status, **kwargs):
-	"""Update message status from Node.js service"""
+@timed("update_message_status")
+@profiled("update_message_status")
+def update_message_status(message_log_id=None, status=None, **kwargs):
+	"""Update message status from Node.js service
+
+	Sends are reported by message log, receipts by WhatsApp message ID.
+	"""
 	try:
-		doc = frappe.get_doc("WhatsApp Message Log", message_log_id)
-		
-		if status == "Sent":
-			doc.mark_sent(kwargs.get("message_id"))
-		elif status == "Delivered":
-			doc.mark_delivered()
-		elif status == "Read":
-			doc.mark_read()
-		elif status == "Failed":
-			doc.mark_failed(kwargs.get("error_message", "Unknown error"))
-		
-		# Update campaign statistics if this is part of a campaign
-		if doc.campaign:
-			campaign = frappe.get_doc("WhatsApp Campaign", doc.campaign)
-			campaign.update_statistics()
-		
-		return {"success": True}
+		increment(f"update_message_status.{status}")
+		if not message_log_id:
+			message_log_id = frappe.db.get_value(
+				"WhatsApp Message Log", {"message_id": kwargs.get("message_id"), "direction": "Outbound"}, "name"
+			)
+			if not message_log_id:
+				increment("update_message_status.unknown")
+				return {"success": True, "changed": False}
+
+		if status == "Failed":
+			doc = frappe.get_doc("WhatsApp Message Log", message_log_id)
+			changed = doc.status in FAILABLE_STATUSES
+			if changed:
+				doc.mark_failed(kwargs.get("error_message", "Unknown error"))
+			campaign = doc.campaign
+		elif status in STATUS_TIMESTAMPS:
+			changed = transition_status(message_log_id, status, kwargs.get("message_id"))
+			campaign = None
+			if changed:
+				log = frappe.db.get_value(
+					"WhatsApp Message Log",
+					message_log_id,
+					["campaign", "contact", "message_type", "retry_count"],
+					as_dict=True,
+				)
+				campaign = log.campaign
+				if status == "Sent":
+					record_sent(message_log_id, log)
+		else:
+			frappe.throw(f"Unknown message status: {status}")
+
+		if not changed:
+			increment("update_message_status.unchanged")
+
+		# Campaign statistics are re-aggregated once a minute, not once per receipt
+		if changed and campaign:
+			mark_stats_stale(campaign)
+
+		return {"success": True, "changed": changed}
 		
 	except Exception as e:
-		frappe.log_error(f"Error updating message status: {str(e)}")
+		report_error("Error updating message status", e)
 		return {"success": False, "error": str(e)}
 
 
@@ -81,3 +222,71 @@ def get_conversation(contact):
 		limit=100
 	)
 	return messages
+
+
+@frappe.whitelist()
+@timed("search_messages")
+def search_messages(
+	query, connection=None, contact=None, direction=None, from_date=None, to_date=None, start=0, page_length=20,
+	before=None
+):
+	"""Full-text search over message content, newest first
+
+	`query` uses boolean full-text syntax: `"exact phrase"`, `+required`,
+	`-excluded`, `prefix*`. The full-text index is MariaDB only; on Postgres
+	`query` is matched as a plain substring with ILIKE, which scans the table.
+	Dates, order and the cursor use the message `timestamp` (when it was sent
+	or received), not when the log was written. For the next page, pass the
+	last result's `cursor` as `before` instead of an offset in `start`.
+	"""
+	frappe.has_permission("WhatsApp Message Log", "read", throw=True)
+
+	conditions, values = [], {}
+	if frappe.db.db_type == "mariadb":
+		conditions.append("MATCH(content) AGAINST(%(query)s IN BOOLEAN MODE)")
+		values["query"] = query
+	else:
+		conditions.append("content ILIKE %(query)s")
+		values["query"] = f"%{query.strip(chr(34))}%"
+
+	for field, value in (("connection", connection), ("contact", contact), ("direction", direction)):
+		if value:
+			conditions.append(f"{field} = %({field})s")
+			values[field] = value
+	if from_date:
+		conditions.append("timestamp >= %(from_date)s")
+		values["from_date"] = frappe.utils.get_datetime(from_date)
+	if to_date:
+		conditions.append("timestamp < %(to_date)s")
+		values["to_date"] = frappe.utils.add_days(frappe.utils.getdate(to_date), 1)
+
+	if before:
+		# Keyset cursor: name breaks ties between messages with the same timestamp
+		before_timestamp, _, before_name = before.partition("|")
+		conditions.append(
+			"(timestamp < %(before_timestamp)s OR (timestamp = %(before_timestamp)s AND name < %(before_name)s))"
+		)
+		values["before_timestamp"] = frappe.utils.get_datetime(before_timestamp)
+		values["before_name"] = before_name
+		start = 0
+
+	values["start"] = frappe.utils.cint(start)
+	values["page_length"] = min(frappe.utils.cint(page_length) or 20, 100)
+
+	fields = ", ".join(SEARCH_FIELDS)
+	where = " AND ".join(conditions)
+	messages = frappe.db.sql(
+		f"""
+		SELECT {fields}
+		FROM `tabWhatsApp Message Log`
+		WHERE {where}
+		ORDER BY timestamp DESC, name DESC
+		LIMIT %(page_length)s OFFSET %(start)s
+		""",
+		values,
+		as_dict=True,
+	)
+
+	for message in messages:
+		message.cursor = f"{message.timestamp}|{message.name}"
+	return messages
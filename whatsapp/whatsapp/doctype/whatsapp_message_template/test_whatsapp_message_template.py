@@ -1,9 +1,59 @@
 # Copyright (c) 2025, INIA GLOBAL and Contributors
 # See license.txt
 
-# import frappe
+import json
+import random
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from whatsapp.whatsapp.utils.query_recorder import QueryRecorder
+from whatsapp.whatsapp.utils.template_context import get_batch_context, get_template_variables
+
 
 class TestWhatsAppMessageTemplate(FrappeTestCase):
-	pass
+	def make_template(self, content):
+		return frappe.get_doc({
+			"doctype": "WhatsApp Message Template",
+			"template_type": "Text",
+			"content": content,
+		})
+
+	def test_render_leaves_unknown_variables(self):
+		template = self.make_template("Hi {{name}}, your code is {{code}}")
+		self.assertEqual(template.render({"name": "Ana"}), "Hi Ana, your code is {{code}}")
+
+	def test_message_objects_are_rendered_per_context(self):
+		template = self.make_template("Hi {{name}} from {{city}}")
+		messages = template.get_message_objects({
+			"1": {"name": "Ana", "city": "Lima"},
+			"2": {"name": "Bo", "city": ""},
+		})
+		self.assertEqual(messages["1"], {"text": "Hi Ana from Lima"})
+		self.assertEqual(messages["2"], {"text": "Hi Bo from "})
+
+	def test_batch_rendering_queries_do_not_grow_with_recipients(self):
+		template = self.make_template("Hi {{name}} from {{city}} ({{tags}})")
+		variables = get_template_variables(template)
+		contacts = [self.make_contact(i) for i in range(25)]
+
+		def render(names):
+			with QueryRecorder() as recorder:
+				messages = template.get_message_objects(get_batch_context(names, variables))
+			return recorder.count, messages
+
+		few, _ = render(contacts[:2])
+		many, messages = render(contacts)
+
+		self.assertEqual(many, few)
+		self.assertEqual(len(messages), len(contacts))
+		self.assertEqual(messages[contacts[7]], {"text": "Hi Contact 7 from City 7 (VIP)"})
+
+	def make_contact(self, index):
+		return frappe.get_doc({
+			"doctype": "WhatsApp Contact",
+			"phone_number": f"+1555{random.randrange(10**7):07d}{index:02d}",
+			"name1": f"Contact {index}",
+			"custom_fields": json.dumps({"city": f"City {index}"}),
+			"tags": [{"tag": "VIP"}],
+		}).insert(ignore_permissions=True).name
@@ -6,31 +6,40 @@ from frappe.model.document import Document
 import json
 import re
 
+from whatsapp.whatsapp.utils.media_cache import apply_media_handle
+
+
+VARIABLE_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
 
 class WhatsAppMessageTemplate(Document):
 	def validate(self):
 		"""Validate template and extract variables"""
 		if self.content:
 			# Extract variables from content
-			variables = re.findall(r'\{\{(\w+)\}\}', self.content)
-			if variables:
-				self.variables = json.dumps(list(set(variables)))
+			variables = self.get_variables()
+			self.variables = json.dumps(sorted(set(variables))) if variables else None
+
+	def get_variables(self):
+		return VARIABLE_PATTERN.findall(self.content or "")
 
 	def render(self, context=None):
 		"""Render template with context variables"""
 		if not context:
 			context = {}
 		
-		content = self.content
-		
-		# Replace variables
-		for key, value in context.items():
-			content = content.replace(f"{{{{{key}}}}}", str(value))
-		
-		return content
+		# Replace variables in one pass; unknown ones are left as they are
+		return VARIABLE_PATTERN.sub(
+			lambda match: str(context[match.group(1)]) if match.group(1) in context else match.group(0),
+			self.content or ""
+		)
 
-	def get_message_object(self, context=None):
-		"""Get WhatsApp message object for sending"""
+	def get_message_object(self, context=None, connection=None):
+		"""Get WhatsApp message object for sending
+
+		When a connection is given, media is uploaded once per connection and
+		the cached media handle is attached to the message.
+		"""
 		message = {}
 		
 		if self.template_type == "Text":
@@ -64,9 +73,28 @@ class WhatsAppMessageTemplate(Document):
 				},
 				"caption": self.render(context)
 			}
+
+		if connection and self.template_type in ("Image", "Video", "Audio", "Document"):
+			apply_media_handle(message, connection, self.media_url or self.media_file, self.template_type)
 		
 		return message
 
+	def get_message_objects(self, contexts, connection=None):
+		"""{key: message object} for a batch of {key: context}
+
+		Media handles are resolved once for the batch, not per message.
+		"""
+		base = self.get_message_object(connection=connection)
+		text_key = "text" if "text" in base else "caption" if "caption" in base else None
+
+		messages = {}
+		for key, context in contexts.items():
+			message = dict(base)
+			if text_key:
+				message[text_key] = self.render(context)
+			messages[key] = message
+		return messages
+
 
 @frappe.whitelist()
 def preview_template(template_name, context=None):
@@ -0,0 +1,15 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class WhatsAppScheduledStep(Document):
+	pass
+
+
+def on_doctype_update():
+	"""Indexes for picking up due work and pausing/cancelling a campaign's steps"""
+	frappe.db.add_index("WhatsApp Scheduled Step", ["status", "due_at"])
+	frappe.db.add_index("WhatsApp Scheduled Step", ["campaign", "status"])
@@ -0,0 +1,343 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""End-to-end load harness for the WhatsApp app
+
+Runs the real send, campaign and webhook code paths against a local stub of
+the Node.js service, so the app can be load-tested without WhatsApp numbers.
+Run it on a test site:
+
+	bench --site test.local execute whatsapp.whatsapp.loadtest.harness.run \\
+		--kwargs "{'messages': 1000, 'latency_ms': 20, 'failure_rate': 0.01}"
+"""
+
+import math
+import random
+import time
+
+import frappe
+
+from whatsapp.whatsapp.loadtest.stub_node_service import StubNodeService
+from whatsapp.whatsapp.utils.query_recorder import QueryRecorder
+
+PHONE_PREFIX = "+1999"
+FIXTURE_NAME = "Load Test"
+DEFAULT_SCENARIOS = ("send_message", "campaign", "inbound", "receipts")
+
+
+def run(
+	messages=500,
+	inbound=500,
+	receipts_per_message=2,
+	latency_ms=20,
+	jitter_ms=5,
+	failure_rate=0.0,
+	drain_rate=0,
+	scenarios=None,
+	seed=None,
+	cleanup=True,
+):
+	"""Run the load harness and print a throughput/latency/query report"""
+	context = frappe._dict(
+		messages=int(messages),
+		inbound=int(inbound),
+		receipts_per_message=int(receipts_per_message),
+		random=random.Random(seed),
+		message_logs=[],
+	)
+	scenarios = scenarios or DEFAULT_SCENARIOS
+	if isinstance(scenarios, str):
+		scenarios = [s.strip() for s in scenarios.split(",")]
+
+	results = []
+	original_url = frappe.conf.get("whatsapp_node_service_url")
+
+	with StubNodeService(
+		latency_ms=latency_ms, jitter_ms=jitter_ms, failure_rate=failure_rate, drain_rate=drain_rate, seed=seed
+	) as stub:
+		context.stub = stub
+		frappe.conf.whatsapp_node_service_url = stub.url
+
+		try:
+			setup_fixtures(context)
+			for scenario in scenarios:
+				stub.reset()
+				results.append(SCENARIOS[scenario](context))
+				frappe.db.commit()
+		finally:
+			frappe.conf.whatsapp_node_service_url = original_url
+			if cleanup:
+				cleanup_fixtures()
+
+	print_report(results)
+	return results
+
+
+def setup_fixtures(context):
+	"""Create the connection, contacts, template and segment used by the scenarios"""
+	context.phones = [f"{PHONE_PREFIX}{i:07d}" for i in range(context.messages)]
+
+	if not frappe.db.exists("WhatsApp Connection", FIXTURE_NAME):
+		frappe.get_doc(
+			{
+				"doctype": "WhatsApp Connection",
+				"connection_name": FIXTURE_NAME,
+				"phone_number": f"{PHONE_PREFIX}0000000",
+				"connection_method": "QR Code",
+			}
+		).insert(ignore_permissions=True)
+
+	frappe.db.set_value(
+		"WhatsApp Connection",
+		FIXTURE_NAME,
+		{
+			"status": "Connected",
+			"daily_message_limit": 10**9,
+			"monthly_message_limit": 10**9,
+			"messages_sent_today": 0,
+			"messages_sent_this_month": 0,
+		},
+	)
+
+	existing = set(
+		frappe.get_all("WhatsApp Contact", filters={"name": ["like", f"{PHONE_PREFIX}%"]}, pluck="name")
+	)
+	for i, phone in enumerate(context.phones):
+		if phone in existing:
+			continue
+		frappe.get_doc(
+			{
+				"doctype": "WhatsApp Contact",
+				"phone_number": phone,
+				"name1": f"Load Test {i}",
+				"opt_in_status": "Opted In",
+			}
+		).insert(ignore_permissions=True)
+
+	if not frappe.db.exists("WhatsApp Message Template", FIXTURE_NAME):
+		frappe.get_doc(
+			{
+				"doctype": "WhatsApp Message Template",
+				"template_name": FIXTURE_NAME,
+				"template_type": "Text",
+				"category": "Marketing",
+				"content": "Hello {{name}}, this is a load test",
+			}
+		).insert(ignore_permissions=True)
+
+	if not frappe.db.exists("WhatsApp Contact Segment", FIXTURE_NAME):
+		frappe.get_doc(
+			{
+				"doctype": "WhatsApp Contact Segment",
+				"segment_name": FIXTURE_NAME,
+				"auto_update": 0,
+				"filter_conditions": frappe.as_json({"phone_number": ["like", f"{PHONE_PREFIX}%"]}),
+			}
+		).insert(ignore_permissions=True)
+
+	frappe.db.commit()
+
+
+def cleanup_fixtures():
+	"""Delete everything the harness created"""
+	phone_filter = {"contact": ["like", f"{PHONE_PREFIX}%"]}
+	campaigns = frappe.get_all("WhatsApp Campaign", filters={"campaign_name": FIXTURE_NAME}, pluck="name")
+
+	frappe.db.delete("WhatsApp Message Log", phone_filter)
+	if campaigns:
+		frappe.db.delete("WhatsApp Message Log", {"campaign": ["in", campaigns]})
+		frappe.db.delete("WhatsApp Campaign", {"name": ["in", campaigns]})
+	# Deleted as documents so their hooks clear the tag index, attribute values,
+	# suppression set and connection registry along with the rows
+	for contact in frappe.get_all("WhatsApp Contact", filters={"name": ["like", f"{PHONE_PREFIX}%"]}, pluck="name"):
+		frappe.delete_doc("WhatsApp Contact", contact, ignore_permissions=True, force=True)
+	for doctype in ("WhatsApp Contact Segment", "WhatsApp Message Template", "WhatsApp Connection"):
+		if frappe.db.exists(doctype, FIXTURE_NAME):
+			frappe.delete_doc(doctype, FIXTURE_NAME, ignore_permissions=True, force=True)
+	frappe.db.commit()
+
+
+def drain_outbox():
+	"""Relay everything the scenario queued, retrying after injected failures"""
+	from whatsapp.whatsapp.tasks.outbox import relay_pending
+
+	for _ in range(10):
+		if relay_pending(run_seconds=300):
+			break
+
+
+def run_send_message(context):
+	"""Drive `send_message` once per synthetic recipient
+
+	Latency is the `send_message` call; the outbox is then relayed inline and
+	its queries count towards the scenario.
+	"""
+	from whatsapp.whatsapp.api.whatsapp_api import send_message
+
+	latencies = []
+	errors = 0
+
+	with QueryRecorder() as recorder:
+		start = time.perf_counter()
+		for phone in context.phones:
+			call_start = time.perf_counter()
+			result = send_message(
+				connection=FIXTURE_NAME,
+				recipient=phone,
+				message_type="Text",
+				content="Load test message",
+			)
+			latencies.append(time.perf_counter() - call_start)
+
+			if result.get("success"):
+				context.message_logs.append(result["message_log_id"])
+			else:
+				errors += 1
+
+		drain_outbox()
+		elapsed = time.perf_counter() - start
+
+	return make_result("send_message", latencies, errors, elapsed, recorder.count)
+
+
+def run_campaign(context):
+	"""Fan a campaign out to every synthetic contact
+
+	Latency is measured per message, from the moment the campaign is started
+	until the stub Node service receives that message.
+	"""
+	campaign = frappe.get_doc(
+		{
+			"doctype": "WhatsApp Campaign",
+			"campaign_name": FIXTURE_NAME,
+			"connection": FIXTURE_NAME,
+			"target_segment": FIXTURE_NAME,
+			"message_template": FIXTURE_NAME,
+			"schedule_type": "Immediate",
+		}
+	).insert(ignore_permissions=True)
+	frappe.db.commit()
+
+	with QueryRecorder() as recorder:
+		started_at = time.time()
+		start = time.perf_counter()
+		campaign.start_campaign()
+		frappe.db.commit()
+		drain_outbox()
+		elapsed = time.perf_counter() - start
+
+	received = dict(context.stub.received)
+	latencies = [received_at - started_at for received_at in received.values()]
+	context.message_logs.extend(name for name in received if name)
+	errors = max(len(context.phones) - len(received), 0)
+
+	return make_result("campaign", latencies, errors, elapsed, recorder.count, operations=len(context.phones))
+
+
+def run_inbound(context):
+	"""Send synthetic inbound traffic through `save_incoming_message`
+
+	Most messages come from known contacts; the rest create new contacts.
+	Latency is the webhook acknowledgement; the queue is then drained inline
+	and its queries count towards the scenario.
+	"""
+	from whatsapp.whatsapp.api.webhook_handler import save_incoming_message
+	from whatsapp.whatsapp.tasks.inbound import process_inbound_queue
+
+	latencies = []
+	errors = 0
+
+	with QueryRecorder() as recorder:
+		start = time.perf_counter()
+		for i in range(context.inbound):
+			if context.phones and context.random.random() < 0.8:
+				phone = context.random.choice(context.phones)
+			else:
+				phone = f"{PHONE_PREFIX}9{i:06d}"
+
+			call_start = time.perf_counter()
+			result = save_incoming_message(
+				connection_id=FIXTURE_NAME,
+				from_number=f"{phone.lstrip('+')}@s.whatsapp.net",
+				message_id=f"LOADTEST-IN-{i}-{context.random.getrandbits(32)}",
+				message_type="Text",
+				content=f"Inbound load test message {i}",
+				timestamp=frappe.utils.now(),
+			)
+			latencies.append(time.perf_counter() - call_start)
+
+			if not result.get("success"):
+				errors += 1
+
+		process_inbound_queue()
+		elapsed = time.perf_counter() - start
+
+	return make_result("inbound", latencies, errors, elapsed, recorder.count)
+
+
+def run_receipts(context):
+	"""Replay a storm of out-of-order, duplicated delivery receipts"""
+	from whatsapp.whatsapp.doctype.whatsapp_message_log.whatsapp_message_log import update_message_status
+
+	receipts = [
+		(message_log, status)
+		for message_log in context.message_logs
+		for status in ("Sent", "Delivered", "Read")
+		for _ in range(context.receipts_per_message)
+	]
+	context.random.shuffle(receipts)
+
+	latencies = []
+	errors = 0
+
+	with QueryRecorder() as recorder:
+		start = time.perf_counter()
+		for message_log, status in receipts:
+			call_start = time.perf_counter()
+			result = update_message_status(message_log_id=message_log, status=status)
+			latencies.append(time.perf_counter() - call_start)
+
+			if not result.get("success"):
+				errors += 1
+		elapsed = time.perf_counter() - start
+
+	return make_result("receipts", latencies, errors, elapsed, recorder.count)
+
+
+SCENARIOS = {
+	"send_message": run_send_message,
+	"campaign": run_campaign,
+	"inbound": run_inbound,
+	"receipts": run_receipts,
+}
+
+
+def make_result(scenario, latencies, errors, elapsed, query_count, operations=None):
+	operations = operations if operations is not None else len(latencies)
+	return frappe._dict(
+		scenario=scenario,
+		operations=operations,
+		errors=errors,
+		duration=round(elapsed, 3),
+		throughput=round(operations / elapsed, 1) if elapsed else 0,
+		p50_ms=round(percentile(latencies, 50) * 1000, 2),
+		p99_ms=round(percentile(latencies, 99) * 1000, 2),
+		queries=query_count,
+		queries_per_message=round(query_count / operations, 2) if operations else 0,
+	)
+
+
+def percentile(values, pct):
+	"""Nearest-rank percentile"""
+	if not values:
+		return 0
+	ordered = sorted(values)
+	rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+	return ordered[rank]
+
+
+def print_report(results):
+	columns = ("scenario", "operations", "errors", "duration", "throughput", "p50_ms", "p99_ms", "queries_per_message")
+	print(" | ".join(f"{column:>19}" for column in columns))
+	for result in results:
+		print(" | ".join(f"{result[column]!s:>19}" for column in columns))
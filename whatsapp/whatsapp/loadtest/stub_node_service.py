@@ -0,0 +1,159 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubNodeService:
+	"""Local HTTP stand-in for the Baileys Node.js service
+
+	Implements the endpoints the Frappe side calls (`/api/connect`,
+	`/api/queue-message`, `/api/queue-messages`, `/api/upload-media` and
+	`/api/status`) with configurable latency and failure rate, and records
+	when every queued message arrived so the harness can measure end-to-end
+	enqueue latency. With a `drain_rate` (messages per second) the reported
+	queue depth drains at that pace, so relay backpressure can be exercised.
+	"""
+
+	def __init__(
+		self, host="127.0.0.1", port=0, latency_ms=0, jitter_ms=0, failure_rate=0.0, drain_rate=0, seed=None
+	):
+		self.latency_ms = latency_ms
+		self.drain_rate = drain_rate
+		self.backlog = 0
+		self.drained_at = time.monotonic()
+		self.jitter_ms = jitter_ms
+		self.failure_rate = failure_rate
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.received = {}
+		self.uploads = 0
+		self.requests = 0
+		self.failures = 0
+		self.server = ThreadingHTTPServer((host, port), self._make_handler())
+		self.server.daemon_threads = True
+		self.thread = None
+
+	@property
+	def url(self):
+		host, port = self.server.server_address[:2]
+		return f"http://{host}:{port}"
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def reset(self):
+		with self.lock:
+			self.received.clear()
+			self.backlog = 0
+			self.drained_at = time.monotonic()
+			self.uploads = 0
+			self.requests = 0
+			self.failures = 0
+
+	def _delay(self):
+		"""Sleep for the configured latency and decide whether this call fails"""
+		with self.lock:
+			self.requests += 1
+			delay = self.latency_ms + (self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+			fail = self.random.random() < self.failure_rate
+			if fail:
+				self.failures += 1
+
+		if delay > 0:
+			time.sleep(delay / 1000)
+
+		return fail
+
+	def _record(self, jobs):
+		with self.lock:
+			now = time.time()
+			for job in jobs:
+				self.received[job.get("message_log_id")] = now
+			if self.drain_rate:
+				self.backlog += len(jobs)
+
+	def _queue_depth(self):
+		"""Messages accepted but not yet drained; 0 without a `drain_rate`"""
+		with self.lock:
+			now = time.monotonic()
+			# Kept fractional: truncating per call would never drain when polled often
+			self.backlog = max(self.backlog - (now - self.drained_at) * self.drain_rate, 0)
+			self.drained_at = now
+			return math.ceil(self.backlog)
+
+	def _make_handler(self):
+		stub = self
+
+		class Handler(BaseHTTPRequestHandler):
+			def log_message(self, format, *args):
+				pass
+
+			def _send(self, status, body):
+				payload = json.dumps(body).encode()
+				self.send_response(status)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(payload)))
+				self.end_headers()
+				self.wfile.write(payload)
+
+			def _body(self):
+				length = int(self.headers.get("Content-Length") or 0)
+				raw = self.rfile.read(length) if length else b""
+				if self.headers.get("Content-Type", "").startswith("application/json"):
+					return json.loads(raw or b"{}")
+				return {}
+
+			def do_GET(self):
+				if self.path != "/api/status":
+					return self._send(404, {"error": "Not found"})
+
+				stub._delay()
+				self._send(200, {"active_connections": 1, "queue_waiting": stub._queue_depth(), "queue_active": 0})
+
+			def do_POST(self):
+				body = self._body()
+
+				if stub._delay():
+					return self._send(500, {"error": "Injected failure"})
+
+				if self.path == "/api/connect":
+					return self._send(200, {"success": True})
+
+				if self.path == "/api/queue-message":
+					stub._record([body])
+					return self._send(200, {"success": True})
+
+				if self.path == "/api/queue-messages":
+					stub._record(body.get("messages") or [])
+					return self._send(200, {"success": True, "queued": len(body.get("messages") or [])})
+
+				if self.path.startswith("/api/upload-media"):
+					with stub.lock:
+						stub.uploads += 1
+						upload_id = stub.uploads
+					return self._send(
+						200,
+						{"success": True, "media": {"imageMessage": {"url": f"https://stub.invalid/media/{upload_id}"}}},
+					)
+
+				self._send(404, {"error": "Not found"})
+
+		return Handler
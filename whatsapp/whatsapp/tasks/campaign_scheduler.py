@@ -0,0 +1,125 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Due-work engine for scheduled, recurring and drip campaigns
+
+Every tick picks up the campaigns whose `next_run_at` has passed and the
+drip steps whose `due_at` has passed. Steps live in `WhatsApp Scheduled
+Step`, indexed on (status, due_at), and are processed in bounded batches so
+the tick never scans all campaigns or contacts.
+"""
+
+from collections import defaultdict
+
+import frappe
+
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.locks import acquire_lock, release_lock
+from whatsapp.whatsapp.utils.metrics import increment, timed
+
+LOCK_NAME = "campaign_scheduler"
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_BATCHES = 20
+RETRY_DELAY_MINUTES = 10
+
+
+@timed("scheduler.run_due_campaigns")
+def run_due_campaigns():
+	"""Start due scheduled/recurring campaigns and send due drip steps"""
+	if not acquire_lock(LOCK_NAME, timeout=300):
+		return
+
+	try:
+		start_due_campaigns()
+		process_due_steps()
+	finally:
+		release_lock(LOCK_NAME)
+
+
+def start_due_campaigns():
+	"""Run every Scheduled campaign whose next run time has passed"""
+	campaigns = frappe.get_all(
+		"WhatsApp Campaign",
+		filters={"status": "Scheduled", "next_run_at": ["<=", frappe.utils.now()]},
+		pluck="name",
+	)
+
+	for name in campaigns:
+		try:
+			campaign = frappe.get_doc("WhatsApp Campaign", name)
+			campaign.run_campaign()
+			frappe.db.commit()
+			increment("scheduler.campaigns_started")
+		except Exception as e:
+			frappe.db.rollback()
+			# The rollback also undid run_campaign's Failed status; without it the campaign
+			# would stay Scheduled in the past and be retried every tick
+			frappe.db.set_value("WhatsApp Campaign", name, {"status": "Failed", "next_run_at": None})
+			frappe.db.commit()
+			report_error(f"Scheduled Campaign Error ({name})", e)
+
+
+def process_due_steps(batch_size=None, max_batches=None):
+	"""Send due drip steps, at most `batch_size * max_batches` per tick"""
+	batch_size = batch_size or frappe.utils.cint(frappe.conf.get("whatsapp_scheduler_batch_size")) or DEFAULT_BATCH_SIZE
+	max_batches = max_batches or frappe.utils.cint(frappe.conf.get("whatsapp_scheduler_max_batches")) or DEFAULT_MAX_BATCHES
+
+	touched = set()
+	for _ in range(max_batches):
+		steps = frappe.db.sql(
+			"""
+			SELECT name, campaign, contact, step
+			FROM `tabWhatsApp Scheduled Step`
+			WHERE status = 'Pending' AND due_at <= %s
+			ORDER BY due_at
+			LIMIT %s
+			""",
+			(frappe.utils.now(), batch_size),
+			as_dict=True,
+		)
+		if not steps:
+			break
+
+		by_campaign = defaultdict(list)
+		for step in steps:
+			by_campaign[step.campaign].append(step)
+
+		for campaign_name, campaign_steps in by_campaign.items():
+			try:
+				campaign = frappe.get_doc("WhatsApp Campaign", campaign_name)
+				campaign.run_due_steps(campaign_steps)
+				frappe.db.commit()
+				touched.add(campaign_name)
+				increment("scheduler.steps_processed", len(campaign_steps))
+			except Exception as e:
+				frappe.db.rollback()
+				# Retry later so a failing campaign does not block the head of the queue
+				frappe.db.set_value(
+					"WhatsApp Scheduled Step",
+					{"name": ["in", [step.name for step in campaign_steps]]},
+					"due_at",
+					frappe.utils.add_to_date(None, minutes=RETRY_DELAY_MINUTES),
+					update_modified=False,
+				)
+				frappe.db.commit()
+				report_error(f"Drip Step Error ({campaign_name})", e)
+
+		if len(steps) < batch_size:
+			break
+
+	complete_finished_campaigns(touched)
+
+
+def complete_finished_campaigns(campaigns):
+	"""Mark running drip campaigns with no outstanding steps as completed"""
+	for name in campaigns:
+		if frappe.db.get_value("WhatsApp Campaign", name, "campaign_type") != "Drip":
+			continue
+
+		if frappe.db.exists("WhatsApp Scheduled Step", {"campaign": name, "status": ["in", ["Pending", "Paused"]]}):
+			continue
+
+		frappe.db.set_value(
+			"WhatsApp Campaign", name, {"status": "Completed", "completed_at": frappe.utils.now()}
+		)
+	frappe.db.commit()
@@ -0,0 +1,226 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Streaming exports of message logs, campaign recipients and contacts
+
+Rows are read in keyset pages (`name > last_name ORDER BY name LIMIT n`)
+and written straight into a gzip stream, so memory stays flat however many
+rows are exported. The finished file is attached as a private File.
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+
+import frappe
+
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.file_records import insert_file_record
+from whatsapp.whatsapp.utils.metrics import increment, timed
+
+DEFAULT_PAGE_SIZE = 5000
+PROGRESS_EVERY_PAGES = 20
+EXPORT_EVENT = "whatsapp_export"
+FORMATS = ("csv", "ndjson")
+
+MESSAGE_LOG_FIELDS = (
+	"name", "message_id", "direction", "connection", "contact", "campaign", "message_type", "template",
+	"status", "priority_lane", "timestamp", "sent_at", "delivered_at", "read_at", "failed_at",
+	"error_message", "content",
+)
+CAMPAIGN_RECIPIENT_FIELDS = (
+	"name", "contact", "contact_name", "status", "sent_at", "delivered_at", "read_at", "failed_at",
+	"error_message",
+)
+CONTACT_FIELDS = (
+	"name", "name1", "email", "whatsapp_id", "opt_in_status", "opt_in_date", "opt_out_date",
+	"last_message_date", "last_message_type", "total_messages_sent", "total_messages_received", "tags",
+)
+
+
+@timed("export.run_export")
+def run_export(export_type, file_format="csv", filters=None, user=None):
+	"""Write the export to a private file, attach it and notify `user`"""
+	filters = frappe._dict(filters or {})
+	columns, pages = EXPORTS[export_type]
+	file_name = f"{frappe.scrub(export_type)}-{frappe.generate_hash(length=8)}.{file_format}.gz"
+	path = frappe.get_site_path("private", "files", file_name)
+
+	rows = 0
+	try:
+		with gzip.open(path, "wb") as compressed, io.TextIOWrapper(compressed, encoding="utf-8", newline="") as out:
+			write = get_writer(out, file_format, columns)
+			for page_number, page in enumerate(pages(filters), 1):
+				for row in page:
+					write(row)
+				rows += len(page)
+
+				if page_number % PROGRESS_EVERY_PAGES == 0:
+					frappe.publish_realtime(
+						EXPORT_EVENT, {"export_type": export_type, "rows": rows}, user=user, after_commit=False
+					)
+
+		# Inserted directly: File.insert would read the whole export back into
+		# memory, reject it above max_file_size and write a second copy
+		file_doc = insert_file_record(
+			file_name,
+			f"/private/files/{file_name}",
+			os.path.getsize(path),
+			content_hash=get_file_hash(path),
+		)
+		frappe.db.commit()
+	except Exception as e:
+		if os.path.exists(path):
+			os.remove(path)
+		report_error(f"Export Error ({export_type})", e)
+		frappe.publish_realtime(
+			EXPORT_EVENT, {"export_type": export_type, "error": str(e)}, user=user, after_commit=False
+		)
+		return
+
+	increment("export.rows", rows)
+	frappe.publish_realtime(
+		EXPORT_EVENT,
+		{"export_type": export_type, "rows": rows, "file_url": file_doc.file_url, "done": True},
+		user=user,
+		after_commit=False,
+	)
+	return file_doc.file_url
+
+
+def get_writer(out, file_format, columns):
+	if file_format == "ndjson":
+		def write(row):
+			out.write(json.dumps(dict(zip(columns, row)), default=str))
+			out.write("\n")
+
+		return write
+
+	writer = csv.writer(out)
+	writer.writerow(columns)
+	return writer.writerow
+
+
+def keyset_pages(query, values, alias, page_size=None):
+	"""Yield pages of `query`, resuming each page after the last name seen
+
+	`query` selects `name` first, orders by it and has a `{keyset}`
+	placeholder in its WHERE clause.
+	"""
+	page_size = page_size or frappe.utils.cint(frappe.conf.get("whatsapp_export_page_size")) or DEFAULT_PAGE_SIZE
+	last_name = None
+	while True:
+		keyset = f"AND {alias}.name > %(last_name)s" if last_name is not None else ""
+		page = frappe.db.sql(
+			query.format(keyset=keyset),
+			{**values, "last_name": last_name, "page_size": page_size},
+		)
+		if not page:
+			return
+
+		yield page
+		if len(page) < page_size:
+			return
+		last_name = page[-1][0]
+
+
+def message_log_pages(filters):
+	conditions, values = [], {}
+	for field in ("campaign", "connection", "contact", "direction", "status"):
+		if filters.get(field):
+			conditions.append(f"log.{field} = %({field})s")
+			values[field] = filters[field]
+	if filters.get("from_date"):
+		conditions.append("log.creation >= %(from_date)s")
+		values["from_date"] = frappe.utils.get_datetime(filters.from_date)
+	if filters.get("to_date"):
+		conditions.append("log.creation < %(to_date)s")
+		values["to_date"] = frappe.utils.add_days(frappe.utils.getdate(filters.to_date), 1)
+
+	where = " AND ".join(conditions) or "1 = 1"
+	fields = ", ".join(f"log.{field}" for field in MESSAGE_LOG_FIELDS)
+	return keyset_pages(
+		f"""
+		SELECT {fields}
+		FROM `tabWhatsApp Message Log` log
+		WHERE {where} {{keyset}}
+		ORDER BY log.name
+		LIMIT %(page_size)s
+		""",
+		values,
+		"log",
+	)
+
+
+def campaign_recipient_pages(filters):
+	if not filters.get("campaign"):
+		frappe.throw("Campaign is required for a campaign recipient export")
+
+	return keyset_pages(
+		"""
+		SELECT log.name, log.contact, contact.name1, log.status, log.sent_at, log.delivered_at,
+			log.read_at, log.failed_at, log.error_message
+		FROM `tabWhatsApp Message Log` log
+		LEFT JOIN `tabWhatsApp Contact` contact ON contact.name = log.contact
+		WHERE log.campaign = %(campaign)s {keyset}
+		ORDER BY log.name
+		LIMIT %(page_size)s
+		""",
+		{"campaign": filters.campaign},
+		"log",
+	)
+
+
+def contact_pages(filters):
+	conditions, values = [], {}
+	if filters.get("opt_in_status"):
+		conditions.append("contact.opt_in_status = %(opt_in_status)s")
+		values["opt_in_status"] = filters.opt_in_status
+
+	where = " AND ".join(conditions) or "1 = 1"
+	fields = ", ".join(f"contact.{field}" for field in CONTACT_FIELDS[:-1])
+	pages = keyset_pages(
+		f"""
+		SELECT {fields}
+		FROM `tabWhatsApp Contact` contact
+		WHERE {where} {{keyset}}
+		ORDER BY contact.name
+		LIMIT %(page_size)s
+		""",
+		values,
+		"contact",
+	)
+
+	for page in pages:
+		# One query per page for the tags of the page's contacts
+		tags = {}
+		for parent, tag in frappe.db.sql(
+			"""
+			SELECT parent, tag FROM `tabWhatsApp Contact Tag`
+			WHERE parenttype = 'WhatsApp Contact' AND parent IN %s
+			ORDER BY idx
+			""",
+			(tuple(row[0] for row in page),),
+		):
+			tags.setdefault(parent, []).append(tag)
+
+		yield [(*row, ", ".join(tags.get(row[0], []))) for row in page]
+
+
+def get_file_hash(path):
+	"""MD5 of a file, as File stores it in `content_hash`, read in chunks"""
+	md5 = hashlib.md5()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(1024 * 1024), b""):
+			md5.update(chunk)
+	return md5.hexdigest()
+
+
+EXPORTS = {
+	"Message Log": (MESSAGE_LOG_FIELDS, message_log_pages),
+	"Campaign Recipients": (CAMPAIGN_RECIPIENT_FIELDS, campaign_recipient_pages),
+	"Contacts": (CONTACT_FIELDS, contact_pages),
+}
@@ -0,0 +1,273 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Background processing of inbound WhatsApp messages
+
+Drains the Redis inbound queue filled by `save_incoming_message` in batches.
+Each batch upserts contacts, bulk inserts message logs, updates contact
+statistics with one query per contact, queues media downloads and then runs
+auto-reply matching.
+"""
+
+import datetime
+import json
+from collections import defaultdict
+
+import frappe
+
+from whatsapp.whatsapp.doctype.whatsapp_auto_reply.whatsapp_auto_reply import check_auto_reply, get_rules
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.inbound_queue import (
+	QUEUE_KEY,
+	ack_inbound_batch,
+	clear_drain_flag,
+	get_queue_length,
+	pop_inbound_batch,
+	reclaim_inbound,
+	schedule_drain,
+)
+from whatsapp.whatsapp.utils.locks import acquire_lock, release_lock
+from whatsapp.whatsapp.utils.media_store import enqueue_media_downloads
+from whatsapp.whatsapp.utils.metrics import increment, timed, timer
+
+LOCK_NAME = "inbound_queue"
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_MAX_BATCHES = 50
+MAX_ATTEMPTS = 3
+
+# Baileys content types mapped to `WhatsApp Message Log` message types
+MESSAGE_TYPES = {
+	"conversation": "Text",
+	"extendedTextMessage": "Text",
+	"imageMessage": "Image",
+	"stickerMessage": "Image",
+	"videoMessage": "Video",
+	"ptvMessage": "Video",
+	"audioMessage": "Audio",
+	"documentMessage": "Document",
+	"documentWithCaptionMessage": "Document",
+	"locationMessage": "Location",
+	"liveLocationMessage": "Location",
+	"contactMessage": "Contact",
+	"contactsArrayMessage": "Contact",
+	"pollCreationMessage": "Poll",
+	"pollCreationMessageV2": "Poll",
+	"pollCreationMessageV3": "Poll",
+	"reactionMessage": "Reaction",
+}
+LOG_MESSAGE_TYPES = frozenset(MESSAGE_TYPES.values())
+
+
+@timed("scheduler.process_inbound_queue")
+def process_inbound_queue(batch_size=None, max_batches=None):
+	"""Drain the inbound queue; also run every minute as a safety net"""
+	batch_size = batch_size or frappe.utils.cint(frappe.conf.get("whatsapp_inbound_batch_size")) or DEFAULT_BATCH_SIZE
+	max_batches = max_batches or frappe.utils.cint(frappe.conf.get("whatsapp_inbound_max_batches")) or DEFAULT_MAX_BATCHES
+
+	if not acquire_lock(LOCK_NAME, timeout=600):
+		return
+
+	try:
+		if reclaim_inbound():
+			increment("inbound.reclaimed")
+
+		for _ in range(max_batches):
+			events = pop_inbound_batch(batch_size)
+			if not events:
+				break
+
+			process_batch(events)
+	finally:
+		release_lock(LOCK_NAME)
+		clear_drain_flag()
+
+	# Events that arrived after the last pop, or beyond this run's budget
+	if get_queue_length():
+		schedule_drain()
+
+
+def process_batch(events):
+	"""Process one batch of queued events, putting it back on failure"""
+	messages = [event for event in events if event.kind == "message"]
+
+	try:
+		with timer("inbound.batch"):
+			saved = save_messages(messages)
+			enqueue_media_downloads(saved)
+			frappe.db.commit()
+		ack_inbound_batch()
+		increment("inbound.messages", len(saved))
+	except Exception as e:
+		frappe.db.rollback()
+		requeue(events)
+		ack_inbound_batch()
+		report_error("Inbound Batch Error", e)
+		return
+
+	# Auto-replies send messages of their own; run them after the batch is committed
+	for message in saved:
+		if message.content:
+			check_auto_reply(
+				message.connection_id, message.contact, message.content, is_first_message=message.is_first_message
+			)
+	frappe.db.commit()
+
+
+def save_messages(messages):
+	"""Upsert contacts, insert message logs and update contact statistics"""
+	messages = dedupe(normalize(message) for message in messages)
+	if not messages:
+		return []
+
+	upsert_contacts(messages)
+	mark_first_messages(messages)
+	insert_message_logs(messages)
+	update_contact_stats(messages)
+
+	return messages
+
+
+def normalize(message):
+	message.whatsapp_id = message.from_number
+	message.phone = message.from_number.replace("@s.whatsapp.net", "").replace("@g.us", "").lstrip("+")
+	message.message_type = get_message_type(message.message_type)
+	message.timestamp = get_timestamp(message.timestamp)
+	return message
+
+
+def dedupe(messages):
+	"""Drop messages already saved, e.g. when the Node.js service retries a webhook"""
+	messages = {message.message_id: message for message in messages}
+	if not messages:
+		return []
+
+	existing = frappe.get_all(
+		"WhatsApp Message Log",
+		filters={"message_id": ["in", list(messages)], "direction": "Inbound"},
+		pluck="message_id",
+	)
+	for message_id in existing:
+		messages.pop(message_id, None)
+
+	return list(messages.values())
+
+
+def upsert_contacts(messages):
+	"""Resolve each message's contact, creating contacts for unknown numbers"""
+	phones = {message.phone for message in messages}
+	candidates = [*phones, *(f"+{phone}" for phone in phones)]
+	existing = set(frappe.get_all("WhatsApp Contact", filters={"name": ["in", candidates]}, pluck="name"))
+
+	for message in messages:
+		# Contacts are usually stored with a leading +, older inbound ones without
+		if f"+{message.phone}" in existing:
+			message.contact = f"+{message.phone}"
+		elif message.phone in existing:
+			message.contact = message.phone
+		else:
+			message.contact = f"+{message.phone}"
+			frappe.get_doc({
+				"doctype": "WhatsApp Contact",
+				"phone_number": message.contact,
+				"whatsapp_id": message.whatsapp_id,
+				"opt_in_status": "Opted In"
+			}).insert(ignore_permissions=True)
+			existing.add(message.contact)
+
+
+def mark_first_messages(messages):
+	"""Flag each contact's first message ever, counting from before this batch
+
+	Counting after the insert would see every message of the batch, so a new
+	contact sending two messages at once would never get a "First Message" reply.
+	"""
+	if not any(rule.trigger_type == "First Message" for rule in get_rules()):
+		return
+
+	contacts = {message.contact for message in messages}
+	known = set(
+		frappe.get_all(
+			"WhatsApp Message Log",
+			filters={"contact": ["in", list(contacts)], "direction": "Inbound"},
+			pluck="contact",
+			distinct=True,
+		)
+	)
+	for message in sorted(messages, key=lambda message: message.timestamp):
+		message.is_first_message = message.contact not in known
+		known.add(message.contact)
+
+
+def insert_message_logs(messages):
+	now = frappe.utils.now()
+	user = frappe.session.user
+	# Message logs are hash-named (the doctype has no autoname), so bulk_insert needs explicit names
+	frappe.db.bulk_insert(
+		"WhatsApp Message Log",
+		fields=[
+			"name", "message_id", "direction", "connection", "contact", "message_type", "content", "status",
+			"timestamp", "media_status", "creation", "modified", "owner", "modified_by",
+		],
+		values=[
+			(
+				frappe.generate_hash(length=10), message.message_id, "Inbound", message.connection_id,
+				message.contact, message.message_type, message.content or "", "Received", message.timestamp,
+				"Pending" if message.media else "", now, now, user, user,
+			)
+			for message in messages
+		],
+	)
+
+
+def update_contact_stats(messages):
+	"""One UPDATE per contact instead of a document save per message"""
+	by_contact = defaultdict(list)
+	for message in messages:
+		by_contact[message.contact].append(message)
+
+	for contact, contact_messages in by_contact.items():
+		last = max(contact_messages, key=lambda message: message.timestamp)
+		frappe.db.sql(
+			"""
+			UPDATE `tabWhatsApp Contact`
+			SET total_messages_received = IFNULL(total_messages_received, 0) + %s,
+				last_message_date = %s,
+				last_message_type = %s
+			WHERE name = %s
+			""",
+			(len(contact_messages), last.timestamp, last.message_type, contact),
+		)
+
+
+def requeue(events):
+	"""Put a failed batch back on the queue, dropping events that keep failing"""
+	cache = frappe.cache()
+	retry = []
+	for event in events:
+		event.attempts = (event.attempts or 0) + 1
+		if event.attempts < MAX_ATTEMPTS:
+			retry.append(json.dumps(event, default=str))
+		else:
+			report_error(f"Dropped inbound event after {MAX_ATTEMPTS} attempts", json.dumps(event, default=str))
+
+	if retry:
+		cache.execute_command("RPUSH", cache.make_key(QUEUE_KEY), *retry)
+
+
+def get_message_type(content_type):
+	if content_type in LOG_MESSAGE_TYPES:
+		return content_type
+	return MESSAGE_TYPES.get(content_type, "Text")
+
+
+def get_timestamp(timestamp):
+	"""Baileys sends epoch seconds; older callers send a datetime string"""
+	if not timestamp:
+		return frappe.utils.now_datetime()
+
+	if isinstance(timestamp, (int, float)) or str(timestamp).isdigit():
+		# Stored in the system timezone like every other datetime, not the server's
+		utc = datetime.datetime.fromtimestamp(int(timestamp), tz=datetime.timezone.utc)
+		return frappe.utils.convert_utc_to_system_timezone(utc).replace(tzinfo=None)
+
+	return frappe.utils.get_datetime(timestamp)
@@ -0,0 +1,236 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Outbox relay from `WhatsApp Message Log` to the Node.js service
+
+Senders only insert a Queued message log carrying the message payload, in
+the same transaction as the rest of their work. The relay hands Queued logs
+to the Node.js service in batches and marks them Sending. Before every batch
+it reads `queue_waiting` and `queue_active` from `/api/status` and only
+sends enough to top the Bull queue up to a target depth, waiting while the
+queue is full instead of flooding Redis. Once the target is reached, only the
+priority lanes are still relayed, up to a small headroom above it.
+
+With `"whatsapp_outbox_transport": "bull"` jobs are written straight to
+the Bull queue in Redis and the depth is read from there, skipping the
+HTTP hop through the Node.js service.
+"""
+
+import json
+import time
+from collections import defaultdict
+
+import frappe
+import requests
+
+from whatsapp.whatsapp.utils.bull_producer import BullProducer, use_bull_transport
+from whatsapp.whatsapp.utils.connection_state import get_node_service_url
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.locks import acquire_lock, release_lock
+from whatsapp.whatsapp.utils.metrics import increment, timed, timer
+from whatsapp.whatsapp.utils.priority_lanes import (
+	BULL_PRIORITIES,
+	LANES,
+	PRIORITY_LANES,
+	allocate,
+)
+
+LOCK_NAME = "outbox_relay"
+TRIGGER_FLAG_KEY = "whatsapp:outbox_relay_scheduled"
+RELAY_METHOD = "whatsapp.whatsapp.tasks.outbox.relay_outbox"
+
+DEFAULT_TARGET_DEPTH = 1000
+DEFAULT_MAX_BATCH = 500
+MIN_BATCH = 10
+PRIORITY_BATCH = 50
+DEFAULT_PRIORITY_HEADROOM = 200
+DEFAULT_RUN_SECONDS = 50
+POLL_INTERVAL = 1
+
+
+def trigger_relay():
+	"""Run the relay once the current transaction commits, unless one is pending"""
+	cache = frappe.cache()
+	if cache.set(cache.make_key(TRIGGER_FLAG_KEY), 1, nx=True, ex=DEFAULT_RUN_SECONDS + 10):
+		frappe.enqueue(RELAY_METHOD, queue="short", enqueue_after_commit=True)
+
+
+@timed("scheduler.relay_outbox")
+def relay_outbox():
+	"""Relay Queued messages to the Node.js service; also run every minute"""
+	if not acquire_lock(LOCK_NAME, timeout=DEFAULT_RUN_SECONDS * 2):
+		return
+
+	run_seconds = frappe.utils.cint(frappe.conf.get("whatsapp_outbox_run_seconds")) or DEFAULT_RUN_SECONDS
+	try:
+		drained = relay_pending(run_seconds)
+	finally:
+		release_lock(LOCK_NAME)
+		cache = frappe.cache()
+		cache.execute_command("DEL", cache.make_key(TRIGGER_FLAG_KEY))
+
+	# A sender may have committed between the last empty batch and the flag reset
+	if drained and frappe.db.exists("WhatsApp Message Log", {"status": "Queued"}):
+		trigger_relay()
+
+
+def relay_pending(run_seconds):
+	"""Relay batches for up to `run_seconds`; returns True once nothing is left"""
+	deadline = time.monotonic() + run_seconds
+	while time.monotonic() < deadline:
+		capacity = get_queue_capacity()
+		if capacity is None:
+			return False
+
+		capacity, priority_capacity = capacity
+		if capacity < MIN_BATCH:
+			# Bull queue is at its target depth: let Node drain it. Priority
+			# lanes still go through, they overtake the backlog in Bull anyway,
+			# but only up to their headroom so an API blast is throttled too.
+			if priority_capacity <= 0 or not relay_batch(priority_capacity, lanes=PRIORITY_LANES):
+				increment("outbox.backpressure")
+				time.sleep(POLL_INTERVAL)
+			continue
+
+		relayed = relay_batch(capacity)
+		if not relayed:
+			return relayed == 0
+
+	return False
+
+
+def get_queue_capacity():
+	"""(jobs that fit in the Bull queue, priority jobs that fit), or None if Node is unreachable
+
+	Priority lanes may go `whatsapp_outbox_priority_headroom` jobs past the
+	target depth, at most `PRIORITY_BATCH` at a time.
+	"""
+	target_depth = frappe.utils.cint(frappe.conf.get("whatsapp_outbox_target_depth")) or DEFAULT_TARGET_DEPTH
+	max_batch = frappe.utils.cint(frappe.conf.get("whatsapp_outbox_max_batch")) or DEFAULT_MAX_BATCH
+	headroom = frappe.utils.cint(frappe.conf.get("whatsapp_outbox_priority_headroom")) or DEFAULT_PRIORITY_HEADROOM
+
+	try:
+		if use_bull_transport():
+			status = BullProducer().get_depth()
+		else:
+			response = requests.get(f"{get_node_service_url()}/api/status", timeout=5)
+			response.raise_for_status()
+			status = response.json()
+	except Exception as e:
+		report_error("Outbox Relay Status Error", e)
+		return None
+
+	depth = frappe.utils.cint(status.get("queue_waiting")) + frappe.utils.cint(status.get("queue_active"))
+	return (
+		min(max(target_depth - depth, 0), max_batch),
+		min(max(target_depth + headroom - depth, 0), PRIORITY_BATCH),
+	)
+
+
+def relay_batch(size, lanes=None):
+	"""Hand up to `size` Queued messages to Node; returns how many were relayed
+
+	The batch is shared fairly between connections and, within a connection,
+	between priority lanes by weight. Quota a lane cannot use passes on to
+	the next lane of the same connection.
+	"""
+	lanes_by_connection = get_queued_lanes(lanes)
+	quotas = allocate(size, lanes_by_connection)
+
+	logs = []
+	for connection, connection_lanes in lanes_by_connection.items():
+		leftover = 0
+		for lane in sorted(connection_lanes, key=LANES.index):
+			# Lanes and connections that did not fit in this batch have no quota
+			limit = quotas.get((connection, lane), 0) + leftover
+			if not limit:
+				continue
+			rows = frappe.db.sql(
+				"""
+				SELECT name, connection, contact, campaign, priority_lane, retry_count, message_payload
+				FROM `tabWhatsApp Message Log`
+				WHERE status = 'Queued' AND connection = %s AND priority_lane = %s
+				ORDER BY creation, name
+				LIMIT %s
+				""",
+				(connection, lane, limit),
+				as_dict=True,
+			)
+			leftover = limit - len(rows)
+			logs.extend(rows)
+
+	if not logs:
+		return 0
+
+	jobs = [
+		{
+			"connection_id": log.connection,
+			"message_log_id": log.name,
+			"recipient": log.contact,
+			"message": json.loads(log.message_payload or "{}"),
+			"campaign_id": log.campaign,
+			"priority": BULL_PRIORITIES.get(log.priority_lane, 0),
+			# Bull keeps the job of a failed attempt; a retry needs an id of its own
+			"job_id": f"{log.name}:{log.retry_count}" if log.retry_count else str(log.name),
+		}
+		for log in logs
+	]
+
+	try:
+		with timer("outbox.node_request", track_queries=False):
+			enqueue_jobs(jobs)
+	except Exception as e:
+		# Leave the batch Queued; Node dedupes jobs by message log, so a retry is safe
+		increment("outbox.failed")
+		report_error("Outbox Relay Error", e)
+		return None
+
+	# Node may already have reported some of them as Sent; never move those back
+	frappe.db.sql(
+		"""
+		UPDATE `tabWhatsApp Message Log`
+		SET status = 'Sending'
+		WHERE name IN %s AND status = 'Queued'
+		""",
+		(tuple(log.name for log in logs),),
+	)
+	frappe.db.commit()
+	increment("outbox.relayed", len(logs))
+
+	return len(logs)
+
+
+def get_queued_lanes(lanes=None):
+	"""{connection: {lane, ...}} for every connection with Queued messages
+
+	Only outbound messages are ever Queued. Served from the
+	(status, connection, priority_lane) index without reading the rows.
+	"""
+	lanes_by_connection = defaultdict(set)
+	for connection, lane in frappe.db.sql(
+		"""
+		SELECT DISTINCT connection, priority_lane
+		FROM `tabWhatsApp Message Log`
+		WHERE status = 'Queued' AND connection IS NOT NULL
+		"""
+	):
+		if not lanes or lane in lanes:
+			lanes_by_connection[connection].add(lane)
+
+	return lanes_by_connection
+
+
+def enqueue_jobs(jobs):
+	"""Add jobs to the Bull queue, directly in Redis or through the Node.js service"""
+	if use_bull_transport():
+		BullProducer().add_jobs(
+			(job, {"jobId": job["job_id"], "priority": job["priority"]}) for job in jobs
+		)
+		return
+
+	response = requests.post(
+		f"{get_node_service_url()}/api/queue-messages",
+		json={"messages": jobs},
+		timeout=30,
+	)
+	response.raise_for_status()
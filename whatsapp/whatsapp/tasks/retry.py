@@ -0,0 +1,148 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Retries of failed outbound messages
+
+When the Node.js service reports a message Failed, its error is classified.
+Transient errors (the service or WhatsApp being briefly unavailable) put the
+message in Retrying with a `next_retry_at` from exponential backoff with
+jitter; permanent errors and exhausted retries stay Failed. Every minute the
+due retries are moved back to Queued in batches, within each connection's
+remaining daily and monthly limits, and the outbox relay sends them again.
+"""
+
+import datetime
+import random
+import re
+
+import frappe
+
+from whatsapp.whatsapp.tasks.outbox import trigger_relay
+from whatsapp.whatsapp.utils.connection_state import get_connection_state, record_messages_sent
+from whatsapp.whatsapp.utils.locks import acquire_lock, release_lock
+from whatsapp.whatsapp.utils.metrics import increment, timed
+from whatsapp.whatsapp.utils.recipient_filter import is_bounce
+
+TRANSIENT = "Transient"
+PERMANENT = "Permanent"
+
+LOCK_NAME = "retry_failed_messages"
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 60
+DEFAULT_MAX_DELAY = 60 * 60
+BATCH_SIZE = 500
+
+# Errors that no amount of retrying fixes; anything unrecognised is retried
+PERMANENT_PATTERN = re.compile(
+	r"bad request|forbidden|not.?authori[sz]ed|unsupported|too large|invalid|"
+	r"blocked|not allowed|media.*(not found|expired)|\b(400|401|403|404|413)\b",
+	re.I,
+)
+
+
+def classify_error(error_message):
+	"""Transient or Permanent"""
+	if is_bounce(error_message) or (error_message and PERMANENT_PATTERN.search(error_message)):
+		return PERMANENT
+	return TRANSIENT
+
+
+def get_max_retries():
+	retries = frappe.conf.get("whatsapp_retry_max_attempts")
+	return DEFAULT_MAX_RETRIES if retries is None else frappe.utils.cint(retries)
+
+
+def get_next_retry_at(retry_count):
+	"""Exponential backoff with equal jitter for the `retry_count`-th retry"""
+	base = frappe.utils.cint(frappe.conf.get("whatsapp_retry_base_delay")) or DEFAULT_BASE_DELAY
+	ceiling = frappe.utils.cint(frappe.conf.get("whatsapp_retry_max_delay")) or DEFAULT_MAX_DELAY
+	delay = min(base * 2 ** max(retry_count - 1, 0), ceiling)
+	# Half fixed, half random, so a burst of failures does not retry in lockstep
+	delay = delay / 2 + random.uniform(0, delay / 2)
+	return frappe.utils.now_datetime() + datetime.timedelta(seconds=delay)
+
+
+@timed("scheduler.retry_failed_messages")
+def retry_failed_messages():
+	"""Move due retries back to Queued for the outbox relay; runs every minute"""
+	if not acquire_lock(LOCK_NAME, timeout=5 * 60):
+		return
+
+	try:
+		requeued = 0
+		# Connections out of quota for this run; their retries wait for the next one
+		blocked = set()
+		while True:
+			rows, batch_requeued = requeue_due_batch(blocked)
+			requeued += batch_requeued
+			if rows < BATCH_SIZE:
+				break
+
+		if requeued:
+			increment("retry.requeued", requeued)
+			trigger_relay()
+	finally:
+		release_lock(LOCK_NAME)
+
+
+def requeue_due_batch(blocked):
+	"""Requeue one batch of due retries; returns (rows looked at, rows requeued)"""
+	conditions, values = "", {"now": frappe.utils.now_datetime(), "batch_size": BATCH_SIZE}
+	if blocked:
+		conditions = "AND connection NOT IN %(blocked)s"
+		values["blocked"] = tuple(blocked)
+
+	rows = frappe.db.sql(
+		f"""
+		SELECT name, connection
+		FROM `tabWhatsApp Message Log`
+		WHERE status = 'Retrying' AND next_retry_at <= %(now)s AND connection IS NOT NULL {conditions}
+		ORDER BY next_retry_at
+		LIMIT %(batch_size)s
+		""",
+		values,
+		as_dict=True,
+	)
+
+	by_connection = {}
+	for row in rows:
+		by_connection.setdefault(row.connection, []).append(row.name)
+
+	requeued = 0
+	for connection, names in by_connection.items():
+		allowed = min(len(names), get_remaining_quota(connection))
+		if allowed < len(names):
+			blocked.add(connection)
+			increment("retry.rate_limited", len(names) - allowed)
+		if not allowed:
+			continue
+
+		frappe.db.sql(
+			"""
+			UPDATE `tabWhatsApp Message Log`
+			SET status = 'Queued'
+			WHERE name IN %s AND status = 'Retrying'
+			""",
+			(tuple(names[:allowed]),),
+		)
+		# A retry is another send and counts towards the connection's limits
+		record_messages_sent(connection, allowed)
+		requeued += allowed
+
+	frappe.db.commit()
+	return len(rows), requeued
+
+
+def get_remaining_quota(connection):
+	"""Messages the connection may still send today and this month"""
+	state = get_connection_state(connection)
+	if not state:
+		return 0
+
+	return max(
+		min(
+			state.daily_message_limit - state.messages_sent_today,
+			state.monthly_message_limit - state.messages_sent_this_month,
+		),
+		0,
+	)
@@ -3,7 +3,46 @@
 
 import frappe
 
+from whatsapp.whatsapp.utils.campaign_stats import flush_pending_stats, update_stale_stats
+from whatsapp.whatsapp.utils.connection_state import flush_message_counters
+from whatsapp.whatsapp.utils.error_reporter import write_error_logs as write_aggregated_errors
+from whatsapp.whatsapp.utils.metrics import timed
 
+
+@timed("scheduler.sync_message_counters")
+def sync_message_counters():
+	"""Write message counters from the connection registry to the database"""
+	try:
+		flush_message_counters()
+		frappe.db.commit()
+		
+	except Exception as e:
+		frappe.log_error(f"Error syncing message counters: {str(e)}")
+
+
+@timed("scheduler.flush_campaign_stats")
+def flush_campaign_stats():
+	"""Re-aggregate campaigns with new receipts and push changes held back by the realtime throttle"""
+	try:
+		update_stale_stats()
+		flush_pending_stats()
+		
+	except Exception as e:
+		frappe.log_error(f"Error pushing campaign statistics: {str(e)}")
+
+
+@timed("scheduler.write_error_logs")
+def write_error_logs():
+	"""Write one Error Log per kind of error reported in the last minute"""
+	try:
+		write_aggregated_errors()
+		frappe.db.commit()
+		
+	except Exception as e:
+		frappe.log_error(f"Error writing aggregated errors: {str(e)}")
+
+
+@timed("scheduler.reset_daily_message_counters")
 def reset_daily_message_counters():
 	"""Reset daily message counters for all connections"""
 	try:
@@ -19,6 +58,7 @@ def reset_daily_message_counters():
 		frappe.log_error(f"Error resetting daily counters: {str(e)}")
 
 
+@timed("scheduler.reset_monthly_message_counters")
 def reset_monthly_message_counters():
 	"""Reset monthly message counters for all connections"""
 	try:
@@ -34,6 +74,7 @@ def reset_monthly_message_counters():
 		frappe.log_error(f"Error resetting monthly counters: {str(e)}")
 
 
+@timed("scheduler.update_campaign_statistics")
 def update_campaign_statistics():
 	"""Update statistics for running campaigns"""
 	try:
@@ -53,6 +94,7 @@ def update_campaign_statistics():
 		frappe.log_error(f"Error updating campaign statistics: {str(e)}")
 
 
+@timed("scheduler.update_contact_segments")
 def update_contact_segments():
 	"""Update contact counts for auto-updating segments"""
 	try:
@@ -0,0 +1,33 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# See license.txt
+
+import os
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp.whatsapp.tasks.export import run_export
+
+
+class TestExport(FrappeTestCase):
+	def test_export_larger_than_max_file_size_is_attached_once(self):
+		files_path = frappe.get_site_path("private", "files")
+		files_before = set(os.listdir(files_path))
+
+		# Any export is larger than a one-byte limit
+		with patch.dict(frappe.conf, {"max_file_size": 1}), patch("frappe.publish_realtime"):
+			file_url = run_export("Contacts", "csv", user="Administrator")
+
+		self.assertTrue(file_url)
+		file_name = os.path.basename(file_url)
+		try:
+			self.assertEqual(set(os.listdir(files_path)) - files_before, {file_name})
+			self.assertEqual(
+				frappe.db.get_value("File", {"file_url": file_url}, "file_size"),
+				os.path.getsize(os.path.join(files_path, file_name)),
+			)
+		finally:
+			frappe.db.delete("File", {"file_url": file_url})
+			frappe.db.commit()
+			os.remove(os.path.join(files_path, file_name))
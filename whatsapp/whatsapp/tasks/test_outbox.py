@@ -0,0 +1,40 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp.whatsapp.tasks import outbox
+from whatsapp.whatsapp.utils.priority_lanes import PRIORITY_LANES
+
+TARGET_DEPTH = 1000
+HEADROOM = 200
+
+
+def relay_pending(depth, relayed=0):
+	"""Run the relay briefly against a Bull queue stuck at `depth`"""
+	status = {"queue_waiting": depth, "queue_active": 0}
+	conf = {"whatsapp_outbox_target_depth": TARGET_DEPTH, "whatsapp_outbox_priority_headroom": HEADROOM}
+	with (
+		patch.dict(frappe.conf, conf),
+		patch.object(outbox, "use_bull_transport", return_value=False),
+		patch.object(outbox, "get_node_service_url", return_value="http://node.invalid"),
+		patch.object(outbox.requests, "get") as get,
+		patch.object(outbox, "relay_batch", return_value=relayed) as relay_batch,
+		patch.object(outbox.time, "sleep"),
+	):
+		get.return_value.json.return_value = status
+		outbox.relay_pending(0.05)
+	return relay_batch
+
+
+class TestOutboxRelay(FrappeTestCase):
+	def test_priority_lanes_fill_the_headroom_above_the_target(self):
+		relay_batch = relay_pending(TARGET_DEPTH + HEADROOM - 5)
+		relay_batch.assert_called_with(5, lanes=PRIORITY_LANES)
+
+	def test_priority_relays_stop_at_the_headroom(self):
+		relay_batch = relay_pending(TARGET_DEPTH + HEADROOM, relayed=50)
+		relay_batch.assert_not_called()
@@ -0,0 +1,156 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Bull-compatible job producer for the `whatsapp-messages` queue
+
+Writes jobs straight into the Redis queue the Node.js service consumes, so
+the outbox relay does not need an HTTP round trip through Express for every
+batch. Jobs are added with the same Lua script Bull itself uses (Bull 4.x,
+the version `package.json` pins for the Node.js service), many per
+pipelined round trip. Enable it with:
+
+	"whatsapp_outbox_transport": "bull",
+	"whatsapp_bull_redis_url": "redis://localhost:6379"
+"""
+
+import json
+import time
+
+import frappe
+from redis import Redis
+
+DEFAULT_REDIS_URL = "redis://localhost:6379"
+DEFAULT_PREFIX = "bull"
+DEFAULT_QUEUE = "whatsapp-messages"
+
+# Matches the options `/api/queue-message` passes to `messageQueue.add`
+DEFAULT_JOB_OPTIONS = {
+	"attempts": 3,
+	"backoff": {"type": "exponential", "delay": 2000},
+}
+
+# bull 4.12 lib/commands/addJob-6.lua (same KEYS/ARGV layout as lib/scripts.js `addJob`)
+ADD_JOB_SCRIPT = """
+local jobId
+local jobIdKey
+local rcall = redis.call
+
+local jobCounter = rcall("INCR", KEYS[4])
+
+if ARGV[2] == "" then
+  jobId = jobCounter
+  jobIdKey = ARGV[1] .. jobId
+else
+  jobId = ARGV[2]
+  jobIdKey = ARGV[1] .. jobId
+  if rcall("EXISTS", jobIdKey) == 1 then
+    return jobId .. ""
+  end
+end
+
+rcall("HMSET", jobIdKey, "name", ARGV[3], "data", ARGV[4], "opts", ARGV[5], "timestamp", ARGV[6], "delay", ARGV[7], "priority", ARGV[9])
+
+local delayedTimestamp = tonumber(ARGV[8])
+if(delayedTimestamp ~= 0) then
+  local timestamp = delayedTimestamp * 0x1000 + bit.band(jobCounter, 0xfff)
+  rcall("ZADD", KEYS[5], timestamp, jobId)
+  rcall("PUBLISH", KEYS[5], delayedTimestamp)
+else
+  local target
+
+  if rcall("EXISTS", KEYS[3]) ~= 1 then
+    target = KEYS[1]
+  else
+    target = KEYS[2]
+  end
+
+  local priority = tonumber(ARGV[9])
+  if priority == 0 then
+    rcall(ARGV[10], target, jobId)
+  else
+    rcall("ZADD", KEYS[6], priority, jobId)
+    local count = rcall("ZCOUNT", KEYS[6], 0, priority)
+
+    local len = rcall("LLEN", target)
+    local id = rcall("LINDEX", target, len - (count-1))
+    if id then
+      rcall("LINSERT", target, "BEFORE", id, jobId)
+    else
+      rcall("RPUSH", target, jobId)
+    end
+  end
+
+  rcall("PUBLISH", KEYS[1] .. "ing@" .. ARGV[11], jobId)
+end
+
+return jobId .. ""
+"""
+
+_clients = {}
+
+
+class BullProducer:
+	"""Adds jobs to a Bull queue in Redis"""
+
+	def __init__(self, redis_url=None, queue=None, prefix=None):
+		self.redis_url = redis_url or frappe.conf.get("whatsapp_bull_redis_url") or DEFAULT_REDIS_URL
+		self.queue = queue or frappe.conf.get("whatsapp_bull_queue") or DEFAULT_QUEUE
+		self.prefix = prefix or frappe.conf.get("whatsapp_bull_prefix") or DEFAULT_PREFIX
+		self.client = get_client(self.redis_url)
+		self.add_job_script = self.client.register_script(ADD_JOB_SCRIPT)
+
+	def key(self, name=""):
+		return f"{self.prefix}:{self.queue}:{name}"
+
+	def add_jobs(self, jobs):
+		"""Add `(data, opts)` pairs in one pipelined round trip; returns the job ids"""
+		pipe = self.client.pipeline(transaction=False)
+		keys = [self.key(name) for name in ("wait", "paused", "meta-paused", "id", "delayed", "priority")]
+
+		for data, opts in jobs:
+			opts = {**DEFAULT_JOB_OPTIONS, **(opts or {})}
+			timestamp = int(time.time() * 1000)
+			delay = int(opts.get("delay") or 0)
+			opts.setdefault("timestamp", timestamp)
+			self.add_job_script(
+				keys=keys,
+				args=[
+					self.key(),
+					str(opts.get("jobId") or ""),
+					"__default__",
+					json.dumps(data),
+					json.dumps(opts),
+					timestamp,
+					delay,
+					timestamp + delay if delay else 0,
+					int(opts.get("priority") or 0),
+					"RPUSH" if opts.get("lifo") else "LPUSH",
+					# Token: only names the channel new jobs are announced on (`...:waiting@<token>`).
+					# Bull 4 subscribes to `waiting@null` for its global "waiting" event (lib/queue.js),
+					# so "null" keeps that event firing; workers never rely on it, they block on the
+					# wait list (BRPOPLPUSH), and the Node.js service listens to no global events.
+					"null",
+				],
+				client=pipe,
+			)
+
+		return [frappe.safe_decode(job_id) for job_id in pipe.execute()]
+
+	def get_depth(self):
+		"""Jobs waiting plus jobs being processed, as `/api/status` reports them"""
+		pipe = self.client.pipeline(transaction=False)
+		pipe.llen(self.key("wait"))
+		pipe.llen(self.key("active"))
+		waiting, active = pipe.execute()
+		return {"queue_waiting": waiting, "queue_active": active}
+
+
+def get_client(redis_url):
+	"""One Redis connection pool per URL and process"""
+	if redis_url not in _clients:
+		_clients[redis_url] = Redis.from_url(redis_url)
+	return _clients[redis_url]
+
+
+def use_bull_transport():
+	return frappe.conf.get("whatsapp_outbox_transport") == "bull"
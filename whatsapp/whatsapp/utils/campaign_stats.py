@@ -0,0 +1,107 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Cached campaign statistics pushed to open forms
+
+The counters stored on a campaign are cached in Redis, so reading them, however
+many people watch a campaign, never aggregates message logs or writes the
+campaign. Whenever the counters change, the fields that differ from the last
+push are sent to the campaign's open forms, at most once every
+`whatsapp_campaign_stats_push_interval` seconds (default 2) per campaign.
+Changes that fall inside that interval are pushed by the next change or, at
+the latest, by the every-minute flush.
+
+Message status changes do not aggregate anything themselves: they mark their
+campaign stale, and the every-minute job re-aggregates each stale campaign
+once, however many receipts it got.
+"""
+
+import frappe
+
+STATS_FIELDS = (
+	"status", "total_contacts", "messages_sent", "messages_delivered", "messages_read", "messages_failed",
+	"messages_suppressed", "delivery_rate", "read_rate",
+)
+STATS_KEY = "whatsapp:campaign_stats:{}"
+PUSHED_KEY = "whatsapp:campaign_stats_pushed:{}"
+THROTTLE_KEY = "whatsapp:campaign_stats_throttle:{}"
+PENDING_KEY = "whatsapp:campaign_stats_pending"
+STALE_KEY = "whatsapp:campaign_stats_stale"
+STATS_EVENT = "whatsapp_campaign_stats"
+STATS_TTL = 60 * 60
+DEFAULT_PUSH_INTERVAL = 2
+
+
+def get_stats(campaign):
+	"""The campaign's counters, read from the database only on a cache miss"""
+	cache = frappe.cache()
+	stats = cache.get_value(STATS_KEY.format(campaign))
+	if stats is None:
+		stats = frappe.db.get_value("WhatsApp Campaign", campaign, STATS_FIELDS, as_dict=True)
+		if stats is None:
+			return None
+		cache.set_value(STATS_KEY.format(campaign), stats, expires_in_sec=STATS_TTL)
+	return stats
+
+
+def set_stats(campaign, values):
+	"""Cache the campaign's new counters and push the ones that changed"""
+	stats = frappe._dict({field: values.get(field) for field in STATS_FIELDS})
+	frappe.cache().set_value(STATS_KEY.format(campaign), stats, expires_in_sec=STATS_TTL)
+	push_stats(campaign)
+
+
+def push_stats(campaign):
+	"""Send the counters changed since the last push to the campaign's open forms"""
+	cache = frappe.cache()
+	interval = frappe.utils.cint(frappe.conf.get("whatsapp_campaign_stats_push_interval")) or DEFAULT_PUSH_INTERVAL
+	if not cache.set(cache.make_key(THROTTLE_KEY.format(campaign)), 1, nx=True, ex=interval):
+		cache.sadd(PENDING_KEY, campaign)
+		return
+
+	stats = get_stats(campaign)
+	if not stats:
+		return
+
+	pushed = cache.get_value(PUSHED_KEY.format(campaign)) or {}
+	changes = {field: value for field, value in stats.items() if pushed.get(field) != value}
+	if not changes:
+		return
+
+	cache.set_value(PUSHED_KEY.format(campaign), stats, expires_in_sec=STATS_TTL)
+	frappe.publish_realtime(
+		STATS_EVENT,
+		{"campaign": campaign, "changes": changes},
+		doctype="WhatsApp Campaign",
+		docname=campaign,
+	)
+
+
+def mark_stats_stale(campaign):
+	"""Have the campaign's counters re-aggregated by the next every-minute run"""
+	frappe.cache().sadd(STALE_KEY, campaign)
+
+
+def update_stale_stats():
+	"""Re-aggregate the counters of every campaign marked stale since the last run"""
+	cache = frappe.cache()
+	while True:
+		# SPOP hands each campaign to one run only, even if runs overlap
+		campaigns = cache.execute_command("SPOP", cache.make_key(STALE_KEY), 100)
+		if not campaigns:
+			break
+
+		for campaign in campaigns:
+			campaign = frappe.safe_decode(campaign)
+			if frappe.db.exists("WhatsApp Campaign", campaign):
+				frappe.get_doc("WhatsApp Campaign", campaign).update_statistics()
+		frappe.db.commit()
+
+
+def flush_pending_stats():
+	"""Push changes that were held back by the throttle; runs every minute"""
+	cache = frappe.cache()
+	for campaign in cache.smembers(PENDING_KEY):
+		campaign = frappe.safe_decode(campaign)
+		cache.srem(PENDING_KEY, campaign)
+		push_stats(campaign)
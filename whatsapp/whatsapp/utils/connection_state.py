@@ -0,0 +1,176 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Connection state kept out of the database hot path
+
+QR codes refresh roughly every 20 seconds while a number is pairing. They
+are only useful to whoever has the connection form open, so they live in a
+TTL cache and are pushed to the form over realtime instead of being saved
+on the `WhatsApp Connection` document.
+
+The connection registry is a Redis hash per connection holding its status,
+limits, Node service assignment and message counters. The send path reads
+it instead of loading the document; counters are incremented atomically in
+Redis and written back to the document by `flush_message_counters`.
+"""
+
+import frappe
+
+PAIRING_EVENT = "whatsapp_pairing"
+DEFAULT_PAIRING_TTL = 180
+
+REGISTRY_KEY = "whatsapp:connection:{}"
+DIRTY_KEY = "whatsapp:connection_dirty"
+STATE_FIELDS = ("status", "daily_message_limit", "monthly_message_limit")
+COUNTER_FIELDS = ("messages_sent_today", "messages_sent_this_month")
+
+
+def get_pairing_key(connection):
+	return f"whatsapp:pairing:{connection}"
+
+
+def set_pairing_state(connection, qr=None, pairing_code=None):
+	"""Cache the latest QR/pairing code and push it to open forms"""
+	state = get_pairing_state(connection) or {}
+	if qr is not None:
+		state["qr"] = qr
+	if pairing_code is not None:
+		state["pairing_code"] = pairing_code
+	state["updated_at"] = frappe.utils.now()
+
+	ttl = frappe.utils.cint(frappe.conf.get("whatsapp_pairing_ttl")) or DEFAULT_PAIRING_TTL
+	frappe.cache().set_value(get_pairing_key(connection), state, expires_in_sec=ttl)
+
+	frappe.publish_realtime(
+		PAIRING_EVENT,
+		{"connection": connection, **state},
+		doctype="WhatsApp Connection",
+		docname=connection,
+		after_commit=False,
+	)
+
+
+def get_pairing_state(connection):
+	return frappe.cache().get_value(get_pairing_key(connection))
+
+
+def clear_pairing_state(connection):
+	"""Forget pairing data once the connection is established or closed"""
+	frappe.cache().delete_value(get_pairing_key(connection))
+	frappe.publish_realtime(
+		PAIRING_EVENT,
+		{"connection": connection, "cleared": True},
+		doctype="WhatsApp Connection",
+		docname=connection,
+		after_commit=False,
+	)
+
+
+def get_connection_state(connection):
+	"""Status, limits, counters and Node service URL of a connection
+
+	Served from the registry; the document is read only on a cold cache.
+	Returns None for an unknown connection.
+	"""
+	# Raw commands throughout: registry fields are plain strings and integers
+	# (so HINCRBY works), not the pickled values of `frappe.cache().hset`
+	cache = frappe.cache()
+	key = _registry_key(connection)
+	state = cache.execute_command("HGETALL", key)
+
+	if not state:
+		values = frappe.db.get_value(
+			"WhatsApp Connection", connection, STATE_FIELDS + COUNTER_FIELDS, as_dict=True
+		)
+		if not values:
+			return None
+
+		values["node_service_url"] = get_node_service_url(connection)
+		pipe = cache.pipeline()
+		pipe.hset(key, mapping={field: values[field] or 0 for field in (*STATE_FIELDS, "node_service_url")})
+		# Do not clobber counters another worker incremented meanwhile
+		for field in COUNTER_FIELDS:
+			pipe.hsetnx(key, field, values[field] or 0)
+		pipe.hgetall(key)
+		state = pipe.execute()[-1]
+
+	state = {frappe.safe_decode(k): frappe.safe_decode(v) for k, v in state.items()}
+	for field in ("daily_message_limit", "monthly_message_limit", *COUNTER_FIELDS):
+		state[field] = frappe.utils.cint(state.get(field))
+	state["name"] = connection
+
+	return frappe._dict(state)
+
+
+def get_node_service_url(connection=None):
+	"""Node.js service the connection is assigned to"""
+	return frappe.conf.get("whatsapp_node_service_url", "http://localhost:3000")
+
+
+def check_rate_limit(state, count=1):
+	"""Check whether `count` more messages fit in the daily and monthly limits"""
+	if state.messages_sent_today + count > state.daily_message_limit:
+		return False, "Daily message limit exceeded"
+
+	if state.messages_sent_this_month + count > state.monthly_message_limit:
+		return False, "Monthly message limit exceeded"
+
+	return True, "OK"
+
+
+def record_messages_sent(connection, count=1):
+	"""Atomically add to a connection's message counters"""
+	cache = frappe.cache()
+	key = _registry_key(connection)
+	if not cache.execute_command("EXISTS", key):
+		# Load the persisted counters first so the increment lands on top of them
+		get_connection_state(connection)
+
+	pipe = cache.pipeline()
+	for field in COUNTER_FIELDS:
+		pipe.hincrby(key, field, count)
+	pipe.sadd(cache.make_key(DIRTY_KEY), connection)
+	pipe.execute()
+
+
+def update_connection_state(connection, **values):
+	"""Overwrite registry fields of a cached connection, e.g. after a status change"""
+	cache = frappe.cache()
+	key = _registry_key(connection)
+	if not cache.execute_command("EXISTS", key):
+		return
+
+	pipe = cache.pipeline()
+	pipe.hset(key, mapping={field: value if value is not None else "" for field, value in values.items()})
+	pipe.execute()
+
+
+def invalidate_connection_state(connection):
+	"""Drop a connection from the registry, flushing its counters first"""
+	flush_message_counters([connection])
+	frappe.cache().execute_command("DEL", _registry_key(connection))
+
+
+def flush_message_counters(connections=None):
+	"""Write registry counters back to the connection documents"""
+	cache = frappe.cache()
+	dirty_key = cache.make_key(DIRTY_KEY)
+	if connections is None:
+		connections = [frappe.safe_decode(name) for name in cache.execute_command("SMEMBERS", dirty_key)]
+
+	for connection in connections:
+		counters = cache.execute_command("HMGET", _registry_key(connection), *COUNTER_FIELDS)
+		cache.execute_command("SREM", dirty_key, connection)
+		if counters[0] is None:
+			continue
+
+		frappe.db.set_value(
+			"WhatsApp Connection",
+			connection,
+			dict(zip(COUNTER_FIELDS, (frappe.utils.cint(value) for value in counters))),
+			update_modified=False,
+		)
+
+
+def _registry_key(connection):
+	return frappe.cache().make_key(REGISTRY_KEY.format(connection))
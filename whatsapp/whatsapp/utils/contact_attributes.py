@@ -0,0 +1,272 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Typed, indexed projection of contact `custom_fields`
+
+Keys of the `custom_fields` JSON that are declared as a WhatsApp Contact
+Attribute are copied into WhatsApp Contact Attribute Value rows, one per
+value, in a column of the attribute's type. Segment filters such as
+
+	{"custom_field": {"city": "New York", "last_purchase_date": [">=", "2025-01-01"]}}
+
+then become range scans of the (attribute, value) indexes rather than JSON
+parsing of every contact. Undeclared keys stay in the JSON only.
+"""
+
+import datetime
+import json
+
+import frappe
+
+ATTRIBUTES_CACHE_KEY = "whatsapp:contact_attributes"
+REINDEX_METHOD = "whatsapp.whatsapp.utils.contact_attributes.reindex_attribute"
+REINDEX_PAGE_SIZE = 5000
+
+VALUE_COLUMNS = {"Text": "value_text", "Number": "value_number", "Date": "value_date"}
+COMPARISONS = ("=", "!=", ">", "<", ">=", "<=")
+TEXT_LENGTH = 140
+
+
+class AttributeFilterError(frappe.ValidationError):
+	pass
+
+
+def get_declared_attributes():
+	"""{attribute_name: attribute_type} of every declared attribute"""
+	return frappe.cache().get_value(
+		ATTRIBUTES_CACHE_KEY,
+		generator=lambda: dict(
+			frappe.get_all("WhatsApp Contact Attribute", fields=["name", "attribute_type"], as_list=True)
+		),
+	)
+
+
+def clear_attributes_cache():
+	frappe.cache().delete_value(ATTRIBUTES_CACHE_KEY)
+
+
+# Projection
+
+
+def get_attribute_values(custom_fields, strict=True, attributes=None):
+	"""[(attribute, column, value)] for the declared keys of a custom_fields dict
+
+	List values give one row each. With `strict` a value that does not fit its
+	attribute's type raises, otherwise it is skipped. `attributes` limits the
+	projection to some {attribute_name: attribute_type}.
+	"""
+	if not custom_fields:
+		return []
+	if isinstance(custom_fields, str):
+		custom_fields = json.loads(custom_fields)
+	if not isinstance(custom_fields, dict):
+		if strict:
+			frappe.throw("Custom fields must be a JSON object")
+		return []
+
+	rows = []
+	for attribute, attribute_type in (attributes or get_declared_attributes()).items():
+		values = custom_fields.get(attribute)
+		for value in values if isinstance(values, list) else [values]:
+			if value is None or value == "":
+				continue
+			try:
+				rows.append((attribute, VALUE_COLUMNS[attribute_type], convert(value, attribute_type)))
+			except (TypeError, ValueError):
+				if strict:
+					frappe.throw(f"Custom field {attribute} must be a {attribute_type.lower()}, got {value!r}")
+
+	return rows
+
+
+def convert(value, attribute_type):
+	"""Cast a JSON value to the column type of an attribute"""
+	if attribute_type == "Number":
+		if isinstance(value, (dict, list)):
+			raise TypeError(value)
+		return float(value)
+
+	if attribute_type == "Date":
+		if not isinstance(value, str):
+			raise TypeError(value)
+		# ISO dates, or the date part of an ISO datetime
+		return datetime.date.fromisoformat(value[:10])
+
+	if isinstance(value, (dict, list)):
+		raise TypeError(value)
+	return str(value)[:TEXT_LENGTH]
+
+
+def sync_contact_attributes(contact, rows):
+	"""Replace the attribute values stored for one contact"""
+	frappe.db.delete("WhatsApp Contact Attribute Value", {"contact": contact})
+	if rows:
+		insert_attribute_values([(contact, *row) for row in rows])
+
+
+def insert_attribute_values(rows):
+	"""Bulk insert (contact, attribute, column, value) rows"""
+	now = frappe.utils.now()
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		"WhatsApp Contact Attribute Value",
+		fields=[
+			"contact", "attribute", "value_text", "value_number", "value_date",
+			"creation", "modified", "owner", "modified_by",
+		],
+		values=[
+			(
+				contact, attribute,
+				value if column == "value_text" else None,
+				value if column == "value_number" else None,
+				value if column == "value_date" else None,
+				now, now, user, user,
+			)
+			for contact, attribute, column, value in rows
+		],
+	)
+
+
+def reindex_attribute(attribute):
+	"""Rebuild the stored values of one attribute from every contact's custom_fields
+
+	Runs as one transaction: segments and estimates keep seeing the old values
+	until every new one is in place, never a partly rebuilt attribute.
+	"""
+	try:
+		_reindex_attribute(attribute)
+	except Exception:
+		frappe.db.rollback()
+		raise
+	frappe.db.commit()
+
+
+def _reindex_attribute(attribute):
+	frappe.db.delete("WhatsApp Contact Attribute Value", {"attribute": attribute})
+	attribute_type = frappe.db.get_value("WhatsApp Contact Attribute", attribute, "attribute_type")
+	if not attribute_type:
+		return
+
+	# Cheap prefilter; the JSON is still parsed to find the exact key
+	pattern = f"%{json.dumps(attribute)}%"
+	last_name = None
+	while True:
+		keyset = "AND name > %(last_name)s" if last_name is not None else ""
+		page = frappe.db.sql(
+			f"""
+			SELECT name, custom_fields FROM `tabWhatsApp Contact`
+			WHERE custom_fields LIKE %(pattern)s {keyset}
+			ORDER BY name LIMIT %(page_size)s
+			""",
+			{"pattern": pattern, "last_name": last_name, "page_size": REINDEX_PAGE_SIZE},
+		)
+		if not page:
+			break
+
+		rows = []
+		for name, custom_fields in page:
+			try:
+				values = get_attribute_values(custom_fields, strict=False, attributes={attribute: attribute_type})
+			except ValueError:
+				continue
+			rows.extend((name, *row) for row in values)
+
+		if rows:
+			insert_attribute_values(rows)
+
+		if len(page) < REINDEX_PAGE_SIZE:
+			break
+		last_name = page[-1][0]
+
+
+# Segment filters
+
+
+def get_matching_contacts(custom_filters, contacts=None):
+	"""Names of the contacts matching every condition of a segment's `custom_field` filters
+
+	`contacts` restricts the lookup to some contact names.
+	"""
+	query, values = get_filter_query(custom_filters)
+	if contacts is not None:
+		if not contacts:
+			return set()
+		query += "\tAND value0.contact IN %(contacts)s\n"
+		values["contacts"] = tuple(contacts)
+	return set(frappe.db.sql_list(query, values))
+
+
+def count_matching_contacts(custom_filters):
+	query, values = get_filter_query(custom_filters)
+	return frappe.db.sql(f"SELECT COUNT(*) FROM ({query}) matching", values)[0][0]
+
+
+def get_filter_query(custom_filters):
+	"""One self-join of the value table per condition, each an index range scan
+
+	A condition is a plain value (equality) or `[operator, value]` with
+	operator one of =, !=, >, <, >=, <=, in, not in, between and like.
+	Contacts without a value for an attribute never match its condition.
+	"""
+	if not isinstance(custom_filters, dict) or not custom_filters:
+		raise AttributeFilterError("custom_field filters must be an object of attribute conditions")
+
+	declared = get_declared_attributes()
+	clauses, values = [], {}
+	for index, (attribute, condition) in enumerate(custom_filters.items()):
+		if attribute not in declared:
+			raise AttributeFilterError(
+				f"{attribute} is not a declared contact attribute; add it as a WhatsApp Contact Attribute first"
+			)
+
+		alias = f"value{index}"
+		condition_sql = get_condition_sql(alias, declared[attribute], condition, values, index)
+		values[f"attribute{index}"] = attribute
+		clauses.append(f"{alias}.attribute = %(attribute{index})s AND {condition_sql}")
+
+	joins = "".join(
+		f"\n\t\tJOIN `tabWhatsApp Contact Attribute Value` value{index}"
+		f" ON value{index}.contact = value0.contact AND {clause}"
+		for index, clause in enumerate(clauses[1:], 1)
+	)
+	query = f"""
+		SELECT DISTINCT value0.contact
+		FROM `tabWhatsApp Contact Attribute Value` value0{joins}
+		WHERE {clauses[0]}
+	"""
+	return query, values
+
+
+def get_condition_sql(alias, attribute_type, condition, values, index):
+	column = f"{alias}.{VALUE_COLUMNS[attribute_type]}"
+	operator, operand = "=", condition
+	if isinstance(condition, list):
+		if len(condition) != 2:
+			raise AttributeFilterError(f"Invalid custom_field condition: {condition}")
+		operator, operand = str(condition[0]).lower(), condition[1]
+
+	key = f"operand{index}"
+	try:
+		if operator in COMPARISONS:
+			values[key] = convert(operand, attribute_type)
+			return f"{column} {operator} %({key})s"
+
+		if operator in ("in", "not in"):
+			if not isinstance(operand, list) or not operand:
+				raise AttributeFilterError(f"{operator} needs a non-empty list: {condition}")
+			values[key] = tuple(convert(value, attribute_type) for value in operand)
+			return f"{column} {operator.upper()} %({key})s"
+
+		if operator == "between":
+			if not isinstance(operand, list) or len(operand) != 2:
+				raise AttributeFilterError(f"between needs two values: {condition}")
+			values[f"{key}_from"], values[f"{key}_to"] = (convert(value, attribute_type) for value in operand)
+			return f"{column} BETWEEN %({key}_from)s AND %({key}_to)s"
+
+		if operator == "like" and attribute_type == "Text":
+			values[key] = str(operand)
+			return f"{column} LIKE %({key})s"
+	except (TypeError, ValueError):
+		raise AttributeFilterError(f"Invalid {attribute_type.lower()} in custom_field condition: {condition}")
+
+	raise AttributeFilterError(f"Unsupported custom_field operator for a {attribute_type} attribute: {operator}")
@@ -0,0 +1,134 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Aggregated error reporting
+
+`report_error` fingerprints an error by its title, exception type and message,
+with numbers, IDs and quoted values masked, and counts it in process memory.
+Counts and the first example of each fingerprint are flushed to Redis every
+few seconds, like the metrics. Every minute `write_error_logs` turns each
+fingerprint seen since the last run into one Error Log carrying the example
+and the count, so an outage that fails every send of a campaign writes a
+handful of Error Logs rather than one per message.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+
+import frappe
+
+COUNTS_KEY = "whatsapp:error_counts"
+EXAMPLES_KEY = "whatsapp:error_examples"
+FLUSH_INTERVAL = 5
+
+# Parts of a message that vary between occurrences of the same error
+MASK_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|\b[0-9a-f]{8,}\b|\d+", re.I)
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = {}
+
+
+def report_error(title, error=None):
+	"""Count an error; call from an `except` block to keep its traceback as the example"""
+	message = str(error) if error is not None else ""
+	fingerprint = get_fingerprint(title, error)
+
+	with _lock:
+		pending = _get_pending()
+		entry = pending.get(fingerprint)
+		if entry:
+			entry["count"] += 1
+		else:
+			pending[fingerprint] = {
+				"count": 1,
+				"title": title,
+				"message": message,
+				"traceback": frappe.get_traceback() if isinstance(error, BaseException) else None,
+			}
+
+	maybe_flush()
+
+
+def get_fingerprint(title, error=None):
+	error_type = type(error).__name__ if isinstance(error, BaseException) else ""
+	parts = (MASK_PATTERN.sub("?", title), error_type, MASK_PATTERN.sub("?", str(error or "")))
+	return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+
+def maybe_flush():
+	"""Flush pending errors if the flush interval has passed"""
+	site = getattr(frappe.local, "site", None)
+	if site in _pending and time.monotonic() - _last_flush.get(site, 0) >= FLUSH_INTERVAL:
+		flush()
+
+
+def flush(*args, **kwargs):
+	"""Add pending counts and examples for the current site to Redis in one pipeline
+
+	Also registered as an `after_request`/`after_job` hook: a job's process
+	may exit right after it, and a lost example would be a lost error.
+	"""
+	site = getattr(frappe.local, "site", None)
+	if not site or site not in _pending:
+		return
+
+	with _lock:
+		pending = _pending.pop(site, None)
+		_last_flush[site] = time.monotonic()
+
+	if not pending:
+		return
+
+	try:
+		cache = frappe.cache()
+		pipe = cache.pipeline(transaction=False)
+		for fingerprint, entry in pending.items():
+			pipe.hincrby(cache.make_key(COUNTS_KEY), fingerprint, entry.pop("count"))
+			# Only the first example since the last Error Log is kept
+			pipe.hsetnx(cache.make_key(EXAMPLES_KEY), fingerprint, json.dumps(entry))
+		pipe.execute()
+	except Exception:
+		frappe.logger("whatsapp").warning("Failed to flush WhatsApp errors", exc_info=True)
+
+
+def write_error_logs():
+	"""One Error Log per fingerprint reported since the last run"""
+	flush()
+
+	cache = frappe.cache()
+	pipe = cache.pipeline(transaction=True)
+	pipe.hgetall(cache.make_key(COUNTS_KEY))
+	pipe.hgetall(cache.make_key(EXAMPLES_KEY))
+	pipe.delete(cache.make_key(COUNTS_KEY), cache.make_key(EXAMPLES_KEY))
+	counts, examples, _deleted = pipe.execute()
+
+	for fingerprint, count in counts.items():
+		example = examples.get(fingerprint)
+		if not example:
+			continue
+
+		example = json.loads(example)
+		count = int(count)
+		message = "\n\n".join(
+			part
+			for part in (
+				example["message"],
+				f"Occurrences: {count} (fingerprint {frappe.safe_decode(fingerprint)})",
+				example["traceback"],
+			)
+			if part
+		)
+		frappe.log_error(title=example["title"] if count == 1 else f"{example['title']} ({count}x)", message=message)
+
+
+def _get_pending():
+	site = getattr(frappe.local, "site", None) or ""
+	pending = _pending.get(site)
+	if pending is None:
+		pending = _pending[site] = {}
+		_last_flush.setdefault(site, time.monotonic())
+	return pending
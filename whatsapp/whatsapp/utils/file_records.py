@@ -0,0 +1,34 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""File rows for content that is already on disk
+
+`File.insert` runs `save_file(content=self.get_content())`, which reads the
+whole file back into memory, enforces the site's `max_file_size` and, when
+a file of that name already exists, writes a second copy under a new name.
+Inbound media and exports write their files themselves in chunks, so their
+File rows are inserted directly instead.
+"""
+
+import frappe
+
+
+def insert_file_record(
+	file_name, file_url, file_size, content_hash=None, attached_to_doctype=None, attached_to_name=None
+):
+	"""Insert a private File row pointing at an existing file, without reading it"""
+	file_doc = frappe.get_doc({
+		"doctype": "File",
+		"file_name": file_name,
+		"file_url": file_url,
+		"is_private": 1,
+		"file_size": file_size,
+		"content_hash": content_hash,
+		"folder": "Home/Attachments" if attached_to_doctype else "Home",
+		"attached_to_doctype": attached_to_doctype,
+		"attached_to_name": attached_to_name,
+	})
+	file_doc.set_new_name()
+	file_doc.set_user_and_timestamp()
+	file_doc.db_insert()
+	return file_doc
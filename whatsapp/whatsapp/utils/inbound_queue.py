@@ -0,0 +1,87 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Redis buffer between the inbound webhooks and the background workers
+
+Webhooks validate the payload, append it to a Redis list and return. A drain
+job is enqueued only when none is already pending, so a burst of webhooks
+results in one job that works through the list in batches.
+
+A batch is moved to a processing list rather than removed, and only dropped
+from there once it is committed. Only the drain job holding the inbound lock
+pops batches, so whatever is left in the processing list when a run starts
+belongs to a worker that died, and is put back at the head of the queue.
+"""
+
+import json
+
+import frappe
+
+QUEUE_KEY = "whatsapp:inbound"
+PROCESSING_KEY = "whatsapp:inbound_processing"
+DRAIN_FLAG_KEY = "whatsapp:inbound_drain_scheduled"
+DRAIN_FLAG_TTL = 300
+DRAIN_METHOD = "whatsapp.whatsapp.tasks.inbound.process_inbound_queue"
+
+# KEYS: queue, processing; ARGV: batch size
+POP_SCRIPT = """
+local items = redis.call("LRANGE", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+	redis.call("LTRIM", KEYS[1], #items, -1)
+	redis.call("RPUSH", KEYS[2], unpack(items))
+end
+return items
+"""
+
+# KEYS: queue, processing
+RECLAIM_SCRIPT = """
+local items = redis.call("LRANGE", KEYS[2], 0, -1)
+for i = #items, 1, -1 do
+	redis.call("LPUSH", KEYS[1], items[i])
+end
+redis.call("DEL", KEYS[2])
+return #items
+"""
+
+
+def enqueue_inbound(kind, payload):
+	"""Append an inbound event to the queue and make sure a drain job is pending"""
+	cache = frappe.cache()
+	cache.execute_command("RPUSH", cache.make_key(QUEUE_KEY), json.dumps({"kind": kind, **payload}, default=str))
+	schedule_drain()
+
+
+def schedule_drain():
+	"""Enqueue the drain job unless one is already scheduled or running"""
+	cache = frappe.cache()
+	if cache.set(cache.make_key(DRAIN_FLAG_KEY), 1, nx=True, ex=DRAIN_FLAG_TTL):
+		frappe.enqueue(DRAIN_METHOD, queue="short")
+
+
+def clear_drain_flag():
+	cache = frappe.cache()
+	cache.execute_command("DEL", cache.make_key(DRAIN_FLAG_KEY))
+
+
+def pop_inbound_batch(size):
+	"""Atomically move up to `size` events from the head of the queue to the processing list"""
+	cache = frappe.cache()
+	items = cache.eval(POP_SCRIPT, 2, cache.make_key(QUEUE_KEY), cache.make_key(PROCESSING_KEY), size)
+	return [frappe._dict(json.loads(item)) for item in items]
+
+
+def ack_inbound_batch():
+	"""Drop the batch in hand from the processing list; call once it is committed or requeued"""
+	cache = frappe.cache()
+	cache.execute_command("DEL", cache.make_key(PROCESSING_KEY))
+
+
+def reclaim_inbound():
+	"""Put the batch a dead worker left in the processing list back at the head of the queue"""
+	cache = frappe.cache()
+	return cache.eval(RECLAIM_SCRIPT, 2, cache.make_key(QUEUE_KEY), cache.make_key(PROCESSING_KEY))
+
+
+def get_queue_length():
+	cache = frappe.cache()
+	return cache.execute_command("LLEN", cache.make_key(QUEUE_KEY))
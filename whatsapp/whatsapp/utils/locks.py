@@ -0,0 +1,19 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import frappe
+
+
+def acquire_lock(name, timeout=60):
+	"""Take a site-scoped Redis lock; returns False if someone else holds it
+
+	The lock expires after `timeout` seconds so a crashed worker cannot hold
+	it forever.
+	"""
+	cache = frappe.cache()
+	return bool(cache.set(cache.make_key(f"whatsapp:lock:{name}"), 1, nx=True, ex=timeout))
+
+
+def release_lock(name):
+	cache = frappe.cache()
+	cache.delete(cache.make_key(f"whatsapp:lock:{name}"))
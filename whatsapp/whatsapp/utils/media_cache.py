@@ -0,0 +1,198 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Upload-once cache for outbound media
+
+Media messages used to carry only a URL, so the Node.js service downloaded
+and re-uploaded the same file to WhatsApp for every recipient. Files are now
+identified by the SHA-256 of their content, uploaded once per connection
+through `/api/upload-media`, and the returned media handle is reused for
+every send until it expires.
+
+Local files must resolve inside the site's `public/files` or `private/files`
+and belong to a File the current user can read. Remote URLs are never
+fetched here: they are identified by the URL itself and the Node.js service
+downloads them when uploading, as it did for plain URL sends.
+"""
+
+import hashlib
+import mimetypes
+import os
+import time
+
+import frappe
+import requests
+
+from whatsapp.whatsapp.utils.connection_state import get_node_service_url
+from whatsapp.whatsapp.utils.error_reporter import report_error
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_HANDLE_TTL = 7 * 24 * 60 * 60
+HASH_MEMO_TTL = 24 * 60 * 60
+LOCAL_MEMO_SIZE = 256
+
+MEDIA_TYPES = {
+	"Image": "image",
+	"Video": "video",
+	"Audio": "audio",
+	"Document": "document",
+}
+
+# Per-process memo so a campaign does not hit Redis for every recipient
+_local_handles = {}
+
+
+def get_media_handle(connection, media_url, message_type):
+	"""Return a reusable media handle for `media_url`, uploading it if needed
+
+	Returns None when the media cannot be uploaded, in which case the caller
+	should fall back to sending the URL.
+	"""
+	media_type = MEDIA_TYPES.get(message_type)
+	if not media_url or not media_type:
+		return None
+
+	try:
+		local_path = get_local_path(media_url)
+		# A file replaced at the same URL gets a new key, and a new upload
+		memo_key = (frappe.local.site, connection, media_url, *get_file_version(local_path))
+		memo = _local_handles.get(memo_key)
+		if memo and memo[1] > time.time():
+			return memo[0]
+
+		content_hash = get_content_hash(media_url, local_path)
+		cache_key = f"whatsapp:media_handle:{connection}:{content_hash}"
+
+		handle = frappe.cache().get_value(cache_key)
+		if not handle:
+			handle = upload_to_whatsapp(connection, media_url, media_type, local_path)
+			ttl = frappe.utils.cint(handle.get("expires_in")) or get_handle_ttl()
+			handle["expires_at"] = time.time() + ttl
+			frappe.cache().set_value(cache_key, handle, expires_in_sec=ttl)
+
+		_remember(memo_key, handle)
+		return handle
+
+	except frappe.PermissionError:
+		raise
+	except Exception as e:
+		report_error("Media Upload Error", e)
+		return None
+
+
+def apply_media_handle(message, connection, media_url, message_type):
+	"""Attach a cached media handle to a message object built for `media_url`"""
+	handle = get_media_handle(connection, media_url, message_type)
+	if handle:
+		message["media_handle"] = handle["media"]
+	return message
+
+
+def get_handle_ttl():
+	return frappe.utils.cint(frappe.conf.get("whatsapp_media_handle_ttl")) or DEFAULT_HANDLE_TTL
+
+
+def get_content_hash(media_url, local_path=None):
+	"""SHA-256 identifying the media: of the file content, memoised per file
+	version, or of the URL for remote media"""
+	if not local_path:
+		return hashlib.sha256(f"url:{media_url}".encode()).hexdigest()
+
+	memo_key = "whatsapp:media_hash:{}:{}:{}".format(media_url, *get_file_version(local_path))
+	content_hash = frappe.cache().get_value(memo_key)
+	if content_hash:
+		return content_hash
+
+	sha256 = hashlib.sha256()
+	with open(local_path, "rb") as f:
+		for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+			sha256.update(chunk)
+
+	content_hash = sha256.hexdigest()
+	frappe.cache().set_value(memo_key, content_hash, expires_in_sec=HASH_MEMO_TTL)
+	return content_hash
+
+
+def get_file_version(local_path):
+	"""(mtime, size) of a local file; empty for remote media"""
+	if not local_path:
+		return ()
+	stat = os.stat(local_path)
+	return (stat.st_mtime_ns, stat.st_size)
+
+
+def get_local_path(media_url):
+	"""Resolve a File URL (`/files/...` or `/private/files/...`) to a path on disk
+
+	Returns None for remote URLs. Raises `frappe.PermissionError` for paths
+	that leave the site's file folders and for files the user cannot read.
+	"""
+	media_url = media_url.split("?")[0]
+	if media_url.startswith("/private/files/"):
+		folder = frappe.get_site_path("private", "files")
+		relative_path = media_url[len("/private/files/") :]
+	elif media_url.startswith("/files/"):
+		folder = frappe.get_site_path("public", "files")
+		relative_path = media_url[len("/files/") :]
+	else:
+		return None
+
+	folder = os.path.realpath(folder)
+	path = os.path.realpath(os.path.join(folder, relative_path))
+	if os.path.commonpath([folder, path]) != folder:
+		frappe.throw(f"Invalid file URL {media_url}", frappe.PermissionError)
+
+	check_file_permission(media_url)
+	return path
+
+
+def check_file_permission(file_url):
+	"""Throw unless the current user can read the File stored at `file_url`"""
+	# Checked once per request or job, not for every recipient of a campaign
+	readable = frappe.flags.setdefault("whatsapp_readable_files", set())
+	if (frappe.session.user, file_url) in readable:
+		return
+
+	file_name = frappe.db.get_value("File", {"file_url": file_url}, "name")
+	if not file_name or not frappe.has_permission("File", "read", file_name):
+		frappe.throw(f"Not permitted to read {file_url}", frappe.PermissionError)
+
+	readable.add((frappe.session.user, file_url))
+
+
+def upload_to_whatsapp(connection, media_url, media_type, local_path=None):
+	"""Upload media to WhatsApp through the Node.js service and return its handle
+
+	Local files are streamed to the service; remote URLs are fetched by it.
+	"""
+	upload_url = f"{get_node_service_url(connection)}/api/upload-media"
+	mimetype = mimetypes.guess_type(media_url)[0] or "application/octet-stream"
+	params = {
+		"connection_id": connection,
+		"media_type": media_type,
+		"mimetype": mimetype,
+		"file_name": os.path.basename(media_url.split("?")[0]),
+	}
+
+	if local_path:
+		with open(local_path, "rb") as f:
+			response = requests.post(
+				upload_url,
+				params=params,
+				data=f,
+				headers={"Content-Type": "application/octet-stream"},
+				timeout=120,
+			)
+	else:
+		response = requests.post(upload_url, json={**params, "url": media_url}, timeout=120)
+
+	if response.status_code != 200:
+		frappe.throw(f"Failed to upload media: {response.text}")
+
+	return response.json()
+
+
+def _remember(memo_key, handle):
+	if len(_local_handles) >= LOCAL_MEMO_SIZE:
+		_local_handles.clear()
+	_local_handles[memo_key] = (handle, handle.get("expires_at") or time.time() + get_handle_ttl())
@@ -0,0 +1,190 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Content-addressed storage of inbound media
+
+Media of inbound messages is streamed from the Node.js service
+(`/api/media/<connection>/<message id>`) into a private file named after the
+SHA-256 of its content, in fixed-size chunks, so memory use does not depend
+on the attachment size. Media that is already stored, such as a forwarded
+image, is not written again. Each message gets its own File row pointing at
+the shared file, inserted without `File.save_file` reading the content back.
+
+Thumbnails are only made the first time one is requested.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+
+import frappe
+import requests
+from PIL import Image
+
+from whatsapp.whatsapp.utils.connection_state import get_node_service_url
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.file_records import insert_file_record
+from whatsapp.whatsapp.utils.metrics import increment
+
+STORE_METHOD = "whatsapp.whatsapp.utils.media_store.store_inbound_media"
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE_MB = 64
+THUMBNAIL_SIZE = 320
+FILE_PREFIX = "wa-"
+
+
+class MediaTooLarge(Exception):
+	pass
+
+
+def get_max_size():
+	return (frappe.utils.cint(frappe.conf.get("whatsapp_inbound_media_max_size_mb")) or DEFAULT_MAX_SIZE_MB) * 1024 * 1024
+
+
+def enqueue_media_downloads(messages):
+	"""Fetch the media of saved inbound messages in the background"""
+	for message in messages:
+		if message.media:
+			frappe.enqueue(
+				STORE_METHOD,
+				queue="long",
+				enqueue_after_commit=True,
+				connection_id=message.connection_id,
+				message_id=message.message_id,
+				media=message.media,
+			)
+
+
+def store_inbound_media(connection_id, message_id, media):
+	"""Store the media of one inbound message and attach it to its message log"""
+	media = frappe._dict(media)
+	log = frappe.db.get_value("WhatsApp Message Log", {"message_id": message_id, "direction": "Inbound"}, "name")
+	if not log:
+		return
+
+	max_size = get_max_size()
+	try:
+		if frappe.utils.cint(media.file_length) > max_size:
+			raise MediaTooLarge
+
+		file_name, file_size = download_media(connection_id, message_id, media, max_size)
+		file_doc = attach_file(log, file_name, file_size, media.file_name)
+	except MediaTooLarge:
+		increment("media.too_large")
+		frappe.db.set_value("WhatsApp Message Log", log, "media_status", "Too Large", update_modified=False)
+		frappe.db.commit()
+		return
+	except Exception as e:
+		frappe.db.rollback()
+		increment("media.failed")
+		frappe.db.set_value("WhatsApp Message Log", log, "media_status", "Failed", update_modified=False)
+		frappe.db.commit()
+		report_error(f"Inbound Media Error ({message_id})", e)
+		return
+
+	frappe.db.set_value(
+		"WhatsApp Message Log",
+		log,
+		{"media_url": file_doc.file_url, "media_status": "Stored"},
+		update_modified=False,
+	)
+	frappe.db.commit()
+
+
+def download_media(connection_id, message_id, media, max_size):
+	"""Stream the media into content-addressed storage; returns (file name, size)"""
+	extension = get_extension(media)
+
+	# The hash the sender reports is not trusted: storage is keyed by the hash
+	# of what was actually downloaded
+	sha256 = hashlib.sha256()
+	size = 0
+	part_path = get_media_path(f".{FILE_PREFIX}{frappe.generate_hash(length=12)}.part")
+	try:
+		with requests.get(
+			f"{get_node_service_url(connection_id)}/api/media/{connection_id}/{message_id}",
+			stream=True,
+			timeout=(5, 60),
+		) as response:
+			response.raise_for_status()
+			with open(part_path, "wb") as f:
+				for chunk in response.iter_content(CHUNK_SIZE):
+					size += len(chunk)
+					if size > max_size:
+						raise MediaTooLarge
+					sha256.update(chunk)
+					f.write(chunk)
+
+		file_name = f"{FILE_PREFIX}{sha256.hexdigest()}{extension}"
+		path = get_media_path(file_name)
+		if os.path.exists(path):
+			increment("media.deduplicated")
+		else:
+			os.replace(part_path, path)
+	finally:
+		if os.path.exists(part_path):
+			os.remove(part_path)
+
+	increment("media.stored_bytes", size)
+	return file_name, size
+
+
+def attach_file(message_log, file_name, file_size, original_name=None):
+	"""A File row for the message log pointing at the shared content file"""
+	return insert_file_record(
+		original_name or file_name,
+		f"/private/files/{file_name}",
+		file_size,
+		attached_to_doctype="WhatsApp Message Log",
+		attached_to_name=message_log,
+	)
+
+
+def get_extension(media):
+	extension = os.path.splitext(media.file_name or "")[1]
+	if not extension and media.mimetype:
+		extension = mimetypes.guess_extension(media.mimetype.split(";")[0].strip()) or ""
+	# The file name comes from the sender; only a plain extension goes into the path
+	extension = extension.lower()
+	return extension if re.fullmatch(r"\.[a-z0-9]{1,10}", extension) else ""
+
+
+def get_media_path(file_name):
+	return frappe.get_site_path("private", "files", file_name)
+
+
+@frappe.whitelist()
+def get_media_thumbnail(message_log):
+	"""URL of a thumbnail of an inbound image, made on first request"""
+	frappe.has_permission("WhatsApp Message Log", "read", message_log, throw=True)
+	media_url, message_type = frappe.db.get_value("WhatsApp Message Log", message_log, ["media_url", "message_type"])
+	if message_type != "Image" or not media_url or not media_url.startswith(f"/private/files/{FILE_PREFIX}"):
+		return None
+
+	thumbnail_name = f"{os.path.splitext(os.path.basename(media_url))[0]}-thumb.jpg"
+	thumbnail_url = f"/private/files/{thumbnail_name}"
+	if not os.path.exists(get_media_path(thumbnail_name)):
+		make_thumbnail(get_media_path(os.path.basename(media_url)), get_media_path(thumbnail_name))
+
+	if not frappe.db.exists("File", {"file_url": thumbnail_url, "attached_to_name": message_log}):
+		attach_file(message_log, thumbnail_name, os.path.getsize(get_media_path(thumbnail_name)))
+		frappe.db.set_value(
+			"File",
+			{"file_url": media_url, "attached_to_name": message_log},
+			"thumbnail_url",
+			thumbnail_url,
+		)
+
+	return thumbnail_url
+
+
+def make_thumbnail(source_path, thumbnail_path):
+	part_path = f"{thumbnail_path}.{frappe.generate_hash(length=8)}.part"
+	with Image.open(source_path) as image:
+		# Lets JPEG decode at a reduced scale instead of loading the full image
+		image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+		image = image.convert("RGB")
+		image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+		image.save(part_path, "JPEG", quality=80)
+	os.replace(part_path, thumbnail_path)
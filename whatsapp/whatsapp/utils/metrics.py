@@ -0,0 +1,180 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Low-overhead hot-path metrics
+
+Timings and counters are accumulated in process memory and flushed to Redis
+in a single pipeline every few seconds, so observing a stage costs a dict
+update rather than a network round trip. All workers flush into the same
+site-scoped Redis hash, which `whatsapp.whatsapp.api.metrics.get_metrics`
+renders in the Prometheus text format.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+import frappe
+
+from whatsapp.whatsapp.utils.query_recorder import QueryRecorder
+
+METRICS_KEY = "whatsapp:metrics"
+FLUSH_INTERVAL = 5
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+_pending = {}
+_last_flush = {}
+
+
+def is_enabled():
+	return not frappe.conf.get("whatsapp_disable_metrics")
+
+
+def observe(stage, duration):
+	"""Record one duration (in seconds) for a stage"""
+	bucket = bisect_left(BUCKETS, duration)
+	with _lock:
+		pending = _get_pending()
+		key = f"h|{stage}|{bucket}"
+		pending["counts"][key] = pending["counts"].get(key, 0) + 1
+		pending["counts"][f"n|{stage}"] = pending["counts"].get(f"n|{stage}", 0) + 1
+		pending["sums"][stage] = pending["sums"].get(stage, 0.0) + duration
+
+	maybe_flush()
+
+
+def increment(name, value=1):
+	"""Increment a counter"""
+	with _lock:
+		pending = _get_pending()
+		key = f"c|{name}"
+		pending["counts"][key] = pending["counts"].get(key, 0) + value
+
+	maybe_flush()
+
+
+@contextmanager
+def timer(stage, track_queries=True):
+	"""Time a block and the DB queries it runs
+
+	Records `stage` and, when queries are tracked, `<stage>.db` with the time
+	spent inside `frappe.db.sql` plus a `<stage>.queries` counter.
+	"""
+	if not is_enabled():
+		yield
+		return
+
+	recorder = None
+	if track_queries and getattr(frappe.local, "db", None):
+		recorder = QueryRecorder()
+		recorder.start()
+
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		observe(stage, time.perf_counter() - start)
+		if recorder:
+			recorder.stop()
+			observe(f"{stage}.db", recorder.duration)
+			increment(f"{stage}.queries", recorder.count)
+
+
+def timed(stage, track_queries=True):
+	"""Decorator form of `timer`"""
+
+	def decorator(fn):
+		@wraps(fn)
+		def wrapper(*args, **kwargs):
+			with timer(stage, track_queries=track_queries):
+				return fn(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
+def maybe_flush(*args, **kwargs):
+	"""Flush pending metrics if the flush interval has passed
+
+	Also registered as an `after_request`/`after_job` hook so idle workers
+	do not sit on unflushed observations.
+	"""
+	site = getattr(frappe.local, "site", None)
+	if not site or site not in _pending:
+		return
+
+	if time.monotonic() - _last_flush.get(site, 0) >= FLUSH_INTERVAL:
+		flush()
+
+
+def flush():
+	"""Push pending metrics for the current site to Redis in one pipeline"""
+	site = frappe.local.site
+	with _lock:
+		pending = _pending.pop(site, None)
+		_last_flush[site] = time.monotonic()
+
+	if not pending:
+		return
+
+	try:
+		cache = frappe.cache()
+		key = cache.make_key(METRICS_KEY)
+		pipe = cache.pipeline(transaction=False)
+		for field, value in pending["counts"].items():
+			pipe.hincrby(key, field, value)
+		for stage, value in pending["sums"].items():
+			pipe.hincrbyfloat(key, f"s|{stage}", value)
+		pipe.execute()
+	except Exception:
+		frappe.logger("whatsapp").warning("Failed to flush WhatsApp metrics", exc_info=True)
+
+
+def get_snapshot():
+	"""Return flushed metrics as `(histograms, counters)`"""
+	flush()
+
+	# Raw HGETALL: the counters are plain integers, not pickled cache values
+	cache = frappe.cache()
+	raw = cache.execute_command("HGETALL", cache.make_key(METRICS_KEY)) or {}
+
+	histograms = {}
+	counters = {}
+	for field, value in raw.items():
+		field = frappe.safe_decode(field)
+		kind, name, *rest = field.split("|")
+		value = float(value) if kind == "s" else int(value)
+
+		if kind == "c":
+			counters[name] = value
+			continue
+
+		histogram = histograms.setdefault(name, {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0})
+		if kind == "h":
+			histogram["buckets"][int(rest[0])] = value
+		elif kind == "s":
+			histogram["sum"] = value
+		elif kind == "n":
+			histogram["count"] = value
+
+	return histograms, counters
+
+
+def reset():
+	"""Drop all recorded metrics for the current site"""
+	with _lock:
+		_pending.pop(frappe.local.site, None)
+	frappe.cache().delete_value(METRICS_KEY)
+
+
+def _get_pending():
+	site = getattr(frappe.local, "site", None) or ""
+	pending = _pending.get(site)
+	if pending is None:
+		pending = _pending[site] = {"counts": {}, "sums": {}}
+		_last_flush.setdefault(site, time.monotonic())
+	return pending
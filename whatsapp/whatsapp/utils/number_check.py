@@ -0,0 +1,151 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Bulk checks of whether contacts' numbers are on WhatsApp
+
+Numbers are checked through the Node.js service (`/api/check-numbers`) many
+per request, and the result is kept on the contact (`whatsapp_status`,
+`whatsapp_checked_at`) for `whatsapp_number_check_ttl_days` (default 30).
+Numbers not on WhatsApp are suppressed with reason Invalid Number, so
+campaign dispatch skips them like any other suppressed contact.
+"""
+
+import frappe
+import requests
+
+from whatsapp.whatsapp.utils.connection_state import get_node_service_url
+from whatsapp.whatsapp.utils.error_reporter import report_error
+from whatsapp.whatsapp.utils.metrics import increment
+from whatsapp.whatsapp.utils.recipient_filter import suppress, unsuppress
+
+VALIDATE_METHOD = "whatsapp.whatsapp.utils.number_check.validate_segment_numbers"
+REQUEST_BATCH_SIZE = 500
+PAGE_SIZE = 1000
+DEFAULT_TTL_DAYS = 30
+VALIDATION_EVENT = "whatsapp_number_check"
+
+
+def get_ttl_days():
+	return frappe.utils.cint(frappe.conf.get("whatsapp_number_check_ttl_days")) or DEFAULT_TTL_DAYS
+
+
+def check_numbers(connection, phone_numbers):
+	"""{phone_number: on WhatsApp} for the given numbers"""
+	results = {}
+	for chunk in frappe.utils.create_batch(phone_numbers, REQUEST_BATCH_SIZE):
+		response = requests.post(
+			f"{get_node_service_url(connection)}/api/check-numbers",
+			json={"connection_id": connection, "phone_numbers": [get_digits(number) for number in chunk]},
+			timeout=60,
+		)
+		response.raise_for_status()
+		exists = {result["phone_number"]: result["exists"] for result in response.json()["results"]}
+		for number in chunk:
+			results[number] = bool(exists.get(get_digits(number)))
+
+	return results
+
+
+def refresh_contacts(connection, names):
+	"""Check the contacts among `names` whose result is missing or expired
+
+	Returns the number of contacts found not to be on WhatsApp.
+	"""
+	if not names:
+		return 0
+
+	cutoff = frappe.utils.add_days(frappe.utils.now_datetime(), -get_ttl_days())
+	stale = frappe.db.sql(
+		"""
+		SELECT name, phone_number FROM `tabWhatsApp Contact`
+		WHERE name IN %s AND (whatsapp_checked_at IS NULL OR whatsapp_checked_at < %s)
+		""",
+		(tuple(names), cutoff),
+	)
+	if not stale:
+		return 0
+
+	numbers = {name: phone_number or name for name, phone_number in stale}
+	results = check_numbers(connection, list(numbers.values()))
+	valid = [name for name, number in numbers.items() if results.get(number)]
+	invalid = [name for name, number in numbers.items() if not results.get(number)]
+
+	save_results(valid, invalid)
+	increment("number_check.checked", len(numbers))
+	increment("number_check.invalid", len(invalid))
+	return len(invalid)
+
+
+def save_results(valid, invalid):
+	"""Store check results and move the Invalid Number suppressions to match"""
+	now = frappe.utils.now()
+	for names, status in ((valid, "Valid"), (invalid, "Not on WhatsApp")):
+		if names:
+			frappe.db.sql(
+				"""
+				UPDATE `tabWhatsApp Contact`
+				SET whatsapp_status = %s, whatsapp_checked_at = %s
+				WHERE name IN %s
+				""",
+				(status, now, tuple(names)),
+			)
+
+	if invalid:
+		newly_invalid = frappe.db.sql_list(
+			"""
+			SELECT name FROM `tabWhatsApp Contact`
+			WHERE name IN %s AND IFNULL(suppression_reason, '') = ''
+			""",
+			(tuple(invalid),),
+		)
+		if newly_invalid:
+			frappe.db.sql(
+				"UPDATE `tabWhatsApp Contact` SET suppression_reason = 'Invalid Number' WHERE name IN %s",
+				(tuple(newly_invalid),),
+			)
+			suppress(newly_invalid)
+
+	if valid:
+		# Numbers that have joined WhatsApp since their last check
+		rejoined = frappe.db.sql_list(
+			"""
+			SELECT name FROM `tabWhatsApp Contact`
+			WHERE name IN %s AND suppression_reason = 'Invalid Number'
+			""",
+			(tuple(valid),),
+		)
+		if rejoined:
+			frappe.db.sql(
+				"UPDATE `tabWhatsApp Contact` SET suppression_reason = NULL WHERE name IN %s",
+				(tuple(rejoined),),
+			)
+			unsuppress(rejoined)
+
+
+def validate_segment_numbers(segment_name, connection, user=None):
+	"""Check every number of a segment whose result is missing or expired"""
+	segment = frappe.get_doc("WhatsApp Contact Segment", segment_name)
+	names = [contact.name for contact in segment.get_contacts()]
+
+	invalid = 0
+	try:
+		for chunk in frappe.utils.create_batch(names, PAGE_SIZE):
+			invalid += refresh_contacts(connection, chunk)
+			frappe.db.commit()
+	except Exception as e:
+		report_error(f"Number Validation Error ({segment_name})", e)
+		frappe.publish_realtime(
+			VALIDATION_EVENT, {"segment": segment_name, "error": str(e)}, user=user, after_commit=False
+		)
+		return
+
+	frappe.publish_realtime(
+		VALIDATION_EVENT,
+		{"segment": segment_name, "contacts": len(names), "invalid": invalid, "done": True},
+		user=user,
+		after_commit=False,
+	)
+
+
+def get_digits(phone_number):
+	return "".join(character for character in phone_number if character.isdigit())
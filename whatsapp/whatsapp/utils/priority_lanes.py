@@ -0,0 +1,68 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Priority lanes for outbound messages
+
+Every outbound message log is put in a lane from its caller and template
+category. The outbox relay shares each batch between connections and then
+between lanes by weight, and lanes map to Bull job priorities so interactive
+messages also overtake the bulk backlog already in the Bull queue.
+"""
+
+import random
+
+INTERACTIVE = "Interactive"
+TRANSACTIONAL = "Transactional"
+BULK = "Bulk"
+
+# Most urgent first
+LANES = (INTERACTIVE, TRANSACTIONAL, BULK)
+PRIORITY_LANES = (INTERACTIVE, TRANSACTIONAL)
+
+LANE_WEIGHTS = {INTERACTIVE: 6, TRANSACTIONAL: 3, BULK: 1}
+
+# Bull priorities: lower runs first, 0 is a plain FIFO push behind all prioritized jobs
+BULL_PRIORITIES = {INTERACTIVE: 1, TRANSACTIONAL: 2, BULK: 0}
+
+
+def get_lane(caller, template_category=None):
+	"""Lane for a message sent by `caller` ("API", "Auto Reply" or "Campaign")"""
+	if caller == "Auto Reply" or template_category == "OTP":
+		return INTERACTIVE
+
+	if caller == "Campaign" or template_category == "Marketing":
+		return BULK
+
+	return TRANSACTIONAL
+
+
+def allocate(size, lanes_by_connection, weights=None):
+	"""Split a batch of `size` between connections, then between their lanes
+
+	`lanes_by_connection` maps each connection to the lanes it has queued
+	messages in. Returns {(connection, lane): quota} with quotas summing to at
+	most `size`. Connections get equal shares; within a share every lane gets
+	one slot, most urgent first, and the rest is split by weight.
+	"""
+	weights = weights or LANE_WEIGHTS
+	if not lanes_by_connection or size <= 0:
+		return {}
+
+	connections = list(lanes_by_connection)
+	if len(connections) > size:
+		# Not every connection fits in this batch; pick them at random so none is starved
+		connections = random.sample(connections, size)
+
+	base, extra = divmod(size, len(connections))
+	quotas = {}
+	for i, connection in enumerate(connections):
+		share = base + (1 if i < extra else 0)
+		lanes = sorted(lanes_by_connection[connection], key=LANES.index)[:share]
+		total_weight = sum(weights[lane] for lane in lanes)
+		spare = share - len(lanes)
+		for lane in lanes:
+			quotas[(connection, lane)] = 1 + spare * weights[lane] // total_weight
+		# Whatever the weight split rounded away goes to the most urgent lane
+		quotas[(connection, lanes[0])] += share - sum(quotas[(connection, lane)] for lane in lanes)
+
+	return quotas
@@ -0,0 +1,248 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Opt-in sampling profiler for the webhook endpoints
+
+Enable it in `site_config.json`:
+
+	"whatsapp_profile_sample_rate": 100
+
+to profile roughly 1 in 100 requests. A sampled request records wall-clock
+stacks (collapsed, flamegraph-ready), SQL query counts and durations, and is
+appended as one JSON line to `sites/<site>/logs/whatsapp_profile.<pid>.jsonl`.
+Every worker process writes its own file and rotates it by size, since
+rotating a file shared between processes loses and interleaves samples.
+Files no process has written to for `whatsapp_profile_retention_days`
+(default 7) are removed.
+"""
+
+import glob
+import heapq
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+import frappe
+
+from whatsapp.whatsapp.utils.query_recorder import QueryRecorder
+
+PROFILE_FILE = "whatsapp_profile.{}.jsonl"
+DEFAULT_INTERVAL_MS = 5
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+DEFAULT_FILE_COUNT = 5
+DEFAULT_RETENTION_DAYS = 7
+MAX_STACK_DEPTH = 64
+SLOWEST_QUERIES = 5
+
+_loggers = {}
+
+
+def get_sample_rate():
+	return frappe.utils.cint(frappe.conf.get("whatsapp_profile_sample_rate"))
+
+
+@contextmanager
+def profile_sample(endpoint):
+	"""Profile the wrapped block for 1 in N calls"""
+	sample_rate = get_sample_rate()
+	if sample_rate <= 0 or random.randrange(sample_rate) != 0:
+		yield
+		return
+
+	sampler = StackSampler(
+		threading.get_ident(),
+		frappe.utils.cint(frappe.conf.get("whatsapp_profile_interval_ms")) or DEFAULT_INTERVAL_MS,
+	)
+	recorder = QueryRecorder(capture_queries=True)
+
+	recorder.start()
+	sampler.start()
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		duration = time.perf_counter() - start
+		sampler.stop()
+		recorder.stop()
+		_write_sample(endpoint, duration, sampler, recorder)
+
+
+def profiled(endpoint):
+	"""Decorator form of `profile_sample`"""
+
+	def decorator(fn):
+		@wraps(fn)
+		def wrapper(*args, **kwargs):
+			with profile_sample(endpoint):
+				return fn(*args, **kwargs)
+
+		return wrapper
+
+	return decorator
+
+
+class StackSampler(threading.Thread):
+	"""Periodically capture the call stack of another thread"""
+
+	def __init__(self, target_thread_id, interval_ms):
+		super().__init__(daemon=True)
+		self.target_thread_id = target_thread_id
+		self.interval = interval_ms / 1000
+		self.stacks = Counter()
+		self.samples = 0
+		self._stopped = threading.Event()
+
+	def run(self):
+		while not self._stopped.wait(self.interval):
+			frame = sys._current_frames().get(self.target_thread_id)
+			if frame is None:
+				continue
+			self.stacks[self._collapse(frame)] += 1
+			self.samples += 1
+
+	def stop(self):
+		self._stopped.set()
+		self.join()
+
+	def _collapse(self, frame):
+		stack = []
+		while frame is not None and len(stack) < MAX_STACK_DEPTH:
+			code = frame.f_code
+			module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+			stack.append(f"{module}.{code.co_name}:{frame.f_lineno}")
+			frame = frame.f_back
+		return ";".join(reversed(stack))
+
+
+def _write_sample(endpoint, duration, sampler, recorder):
+	try:
+		slowest = sorted(recorder.queries, key=lambda q: q["duration"], reverse=True)[:SLOWEST_QUERIES]
+		sample = {
+			"endpoint": endpoint,
+			"timestamp": frappe.utils.now(),
+			"duration_ms": round(duration * 1000, 3),
+			"sql": {
+				"count": recorder.count,
+				"duration_ms": round(recorder.duration * 1000, 3),
+				"slowest": [
+					{"query": q["query"], "duration_ms": round(q["duration"] * 1000, 3)} for q in slowest
+				],
+			},
+			"samples": sampler.samples,
+			"stacks": dict(sampler.stacks.most_common()),
+		}
+		_get_logger().info(json.dumps(sample, default=str))
+	except Exception:
+		frappe.logger("whatsapp").warning("Failed to write WhatsApp profile sample", exc_info=True)
+
+
+def _get_logger():
+	site = frappe.local.site
+	pid = os.getpid()
+	# Keyed by process too: a logger made before a fork must not be shared with the children
+	logger = _loggers.get((site, pid))
+	if logger:
+		return logger
+
+	remove_stale_profiles()
+	logger = logging.getLogger(f"whatsapp_profile.{site}.{pid}")
+	logger.setLevel(logging.INFO)
+	logger.propagate = False
+
+	handler = RotatingFileHandler(
+		get_profile_path(pid),
+		maxBytes=frappe.utils.cint(frappe.conf.get("whatsapp_profile_max_size")) or DEFAULT_MAX_SIZE,
+		backupCount=frappe.utils.cint(frappe.conf.get("whatsapp_profile_file_count")) or DEFAULT_FILE_COUNT,
+	)
+	handler.setFormatter(logging.Formatter("%(message)s"))
+	logger.addHandler(handler)
+
+	_loggers[(site, pid)] = logger
+	return logger
+
+
+def get_profile_path(pid="*"):
+	return frappe.get_site_path("logs", PROFILE_FILE.format(pid))
+
+
+def remove_stale_profiles():
+	"""Delete the profile files of processes that stopped writing long ago"""
+	retention_days = frappe.utils.cint(frappe.conf.get("whatsapp_profile_retention_days")) or DEFAULT_RETENTION_DAYS
+	cutoff = time.time() - retention_days * 24 * 60 * 60
+	for path in glob.glob(f"{get_profile_path()}*"):
+		try:
+			if os.path.getmtime(path) < cutoff:
+				os.remove(path)
+		except OSError:
+			pass
+
+
+def read_recent_samples(endpoint=None, limit=20):
+	"""Return the most recent profile samples of all processes, newest first
+
+	Each process's files are read backwards from the end, the current one
+	first and then its rotated backups, and only until `limit` samples are
+	found; the per-process results are then merged by timestamp. Lines that
+	are not valid JSON, such as one still being written, are skipped.
+	"""
+	limit = frappe.utils.cint(limit)
+	if limit <= 0:
+		return []
+
+	per_process = [_read_process_samples(paths, endpoint, limit) for paths in get_profile_paths()]
+	merged = heapq.merge(*per_process, key=lambda sample: sample.get("timestamp") or "", reverse=True)
+	return [sample for sample, _ in zip(merged, range(limit))]
+
+
+def get_profile_paths():
+	"""[[current file, rotated backups...]] per process that left a profile file, newest first"""
+	file_count = frappe.utils.cint(frappe.conf.get("whatsapp_profile_file_count")) or DEFAULT_FILE_COUNT
+	processes = []
+	for path in glob.glob(get_profile_path()):
+		paths = [path] + [f"{path}.{i}" for i in range(1, file_count + 1)]
+		processes.append([path for path in paths if os.path.exists(path)])
+	return processes
+
+
+def _read_process_samples(paths, endpoint, limit):
+	samples = []
+	for path in paths:
+		for line in _read_lines_reversed(path):
+			try:
+				sample = json.loads(line)
+			except ValueError:
+				continue
+			if not isinstance(sample, dict) or (endpoint and sample.get("endpoint") != endpoint):
+				continue
+			samples.append(sample)
+			if len(samples) >= limit:
+				return samples
+	return samples
+
+
+def _read_lines_reversed(path, block_size=64 * 1024):
+	"""Yield the lines of a file last to first, reading it in blocks from the end"""
+	with open(path, "rb") as f:
+		f.seek(0, os.SEEK_END)
+		position = f.tell()
+		remainder = b""
+		while position > 0:
+			read_size = min(block_size, position)
+			position -= read_size
+			f.seek(position)
+			lines = (f.read(read_size) + remainder).split(b"\n")
+			# The first piece may be the tail of a line that starts in an earlier block
+			remainder = lines.pop(0)
+			for line in reversed(lines):
+				if line.strip():
+					yield line.decode("utf-8", "replace")
+		if remainder.strip():
+			yield remainder.decode("utf-8", "replace")
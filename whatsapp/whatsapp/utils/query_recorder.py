@@ -0,0 +1,59 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+import time
+
+import frappe
+
+
+class QueryRecorder:
+	"""Count and time every `frappe.db.sql` call made while the recorder is active
+
+	Usage:
+		with QueryRecorder() as recorder:
+			send_message(...)
+		recorder.count, recorder.duration
+	"""
+
+	def __init__(self, capture_queries=False):
+		self.capture_queries = capture_queries
+		self.count = 0
+		self.duration = 0.0
+		self.queries = []
+		self._db = None
+		self._original_sql = None
+
+	def __enter__(self):
+		self.start()
+		return self
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	def start(self):
+		"""Wrap `sql` on the current site's database connection"""
+		self._db = frappe.local.db
+		self._original_sql = self._db.sql
+		self._db.sql = self._sql
+
+	def stop(self):
+		"""Restore the original `sql` method"""
+		if self._db is not None:
+			self._db.sql = self._original_sql
+			self._db = None
+
+	def reset(self):
+		self.count = 0
+		self.duration = 0.0
+		self.queries = []
+
+	def _sql(self, query, *args, **kwargs):
+		start = time.perf_counter()
+		try:
+			return self._original_sql(query, *args, **kwargs)
+		finally:
+			elapsed = time.perf_counter() - start
+			self.count += 1
+			self.duration += elapsed
+			if self.capture_queries:
+				self.queries.append({"query": str(query)[:500], "duration": elapsed})
@@ -0,0 +1,170 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Suppression list and frequency caps for campaign recipients
+
+The suppression set is a Redis set of the contacts that must never receive
+campaign messages: opt-outs, bounces and invalid numbers. The contact's
+`suppression_reason` is the source of truth; the set mirrors it and is
+rebuilt from that indexed column if Redis loses it.
+
+Campaign sends are counted per contact in hourly Redis hashes. A contact that
+has had `whatsapp_frequency_cap` campaign messages (default 3) within the last
+`whatsapp_frequency_cap_hours` (default 24) is skipped by broadcasts. Both
+checks take a few round trips per batch of recipients, whatever its size.
+"""
+
+import datetime
+import re
+
+import frappe
+
+SUPPRESSION_KEY = "whatsapp:suppressed_contacts"
+SEND_COUNT_KEY = "whatsapp:campaign_sends:{}"
+BUILT_MEMBER = "__built__"
+CHUNK_SIZE = 1000
+
+DEFAULT_FREQUENCY_CAP = 3
+DEFAULT_FREQUENCY_CAP_HOURS = 24
+
+# Send errors meaning the number cannot receive WhatsApp messages at all
+BOUNCE_PATTERN = re.compile(r"not (on|a) whatsapp|not.?registered|invalid (jid|number|recipient)|no such user", re.I)
+
+
+def filter_recipients(contacts, apply_frequency_cap=True):
+	"""Split campaign recipients into (allowed, suppressed, capped)
+
+	`contacts` are dicts with a `name`. Each batch costs one SMISMEMBER per
+	thousand contacts plus, with `apply_frequency_cap`, one HMGET per hour
+	bucket of the cap window.
+	"""
+	names = [contact.get("name") for contact in contacts]
+	suppressed = get_suppressed(names)
+	remaining = [contact for contact in contacts if contact.get("name") not in suppressed]
+	suppressed_contacts = [contact for contact in contacts if contact.get("name") in suppressed]
+
+	cap = get_frequency_cap()
+	if not apply_frequency_cap or not cap or not remaining:
+		return remaining, suppressed_contacts, []
+
+	counts = get_send_counts([contact.get("name") for contact in remaining])
+	allowed, capped = [], []
+	for contact in remaining:
+		(capped if counts.get(contact.get("name"), 0) >= cap else allowed).append(contact)
+
+	return allowed, suppressed_contacts, capped
+
+
+# Suppression
+
+
+def get_suppressed(names):
+	"""The suppressed contacts among `names`"""
+	if not names:
+		return set()
+
+	cache = frappe.cache()
+	key = cache.make_key(SUPPRESSION_KEY)
+	if not cache.execute_command("SISMEMBER", key, BUILT_MEMBER):
+		rebuild_suppression_set()
+
+	suppressed = set()
+	for chunk in frappe.utils.create_batch(names, CHUNK_SIZE):
+		flags = cache.execute_command("SMISMEMBER", key, *chunk)
+		suppressed.update(name for name, flag in zip(chunk, flags) if flag)
+	return suppressed
+
+
+def suppress(names):
+	_update_set("sadd", names)
+
+
+def unsuppress(names):
+	_update_set("srem", names)
+
+
+def rebuild_suppression_set():
+	"""Reload the set from the contacts' suppression reasons"""
+	cache = frappe.cache()
+	key = cache.make_key(SUPPRESSION_KEY)
+	names = frappe.db.sql_list(
+		"SELECT name FROM `tabWhatsApp Contact` WHERE suppression_reason IS NOT NULL AND suppression_reason != ''"
+	)
+
+	pipe = cache.pipeline(transaction=True)
+	pipe.delete(key)
+	for chunk in frappe.utils.create_batch(names, CHUNK_SIZE):
+		pipe.sadd(key, *chunk)
+	pipe.sadd(key, BUILT_MEMBER)
+	pipe.execute()
+
+
+def is_bounce(error_message):
+	"""Whether a send error means the number cannot receive WhatsApp messages"""
+	return bool(error_message and BOUNCE_PATTERN.search(error_message))
+
+
+def _update_set(command, names):
+	names = [name for name in names if name]
+	if not names:
+		return
+
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	for chunk in frappe.utils.create_batch(names, CHUNK_SIZE):
+		getattr(pipe, command)(cache.make_key(SUPPRESSION_KEY), *chunk)
+	pipe.execute()
+
+
+# Frequency caps
+
+
+def get_frequency_cap():
+	cap = frappe.conf.get("whatsapp_frequency_cap")
+	return DEFAULT_FREQUENCY_CAP if cap is None else frappe.utils.cint(cap)
+
+
+def get_send_counts(names):
+	"""{contact: campaign messages sent within the cap window}"""
+	if not names:
+		return {}
+
+	cache = frappe.cache()
+	pipe = cache.pipeline()
+	for bucket in _window_buckets():
+		pipe.hmget(cache.make_key(SEND_COUNT_KEY.format(bucket)), names)
+
+	counts = {}
+	for bucket_counts in pipe.execute():
+		for name, count in zip(names, bucket_counts):
+			if count:
+				counts[name] = counts.get(name, 0) + int(count)
+	return counts
+
+
+def record_sends(names):
+	"""Count one campaign message for each contact in the current hour"""
+	names = [name for name in names if name]
+	if not names:
+		return
+
+	cache = frappe.cache()
+	key = cache.make_key(SEND_COUNT_KEY.format(_window_buckets()[0]))
+	pipe = cache.pipeline()
+	for name in names:
+		pipe.hincrby(key, name, 1)
+	pipe.expire(key, (_get_window_hours() + 1) * 60 * 60)
+	pipe.execute()
+
+
+def _get_window_hours():
+	return frappe.utils.cint(frappe.conf.get("whatsapp_frequency_cap_hours")) or DEFAULT_FREQUENCY_CAP_HOURS
+
+
+def _window_buckets():
+	"""Hour buckets of the cap window, current hour first"""
+	now = frappe.utils.now_datetime()
+	return [
+		(now - datetime.timedelta(hours=hours)).strftime("%Y%m%d%H")
+		for hours in range(_get_window_hours())
+	]
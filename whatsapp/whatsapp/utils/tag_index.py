@@ -0,0 +1,458 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Bitmap index of contact tags
+
+Every contact has an `ordinal`. For every tag a Redis bitmap has bit
+`ordinal` set for the contacts carrying it, plus one bitmap of all contacts.
+Bitmaps are kept current by the contact controller and evaluated as Python
+integers, so a tag expression like
+
+	VIP AND (Active OR "Trial User") AND NOT Churned
+
+over millions of contacts costs a few GETs and big-integer operations.
+
+The bitmaps live in the Redis cache. If any of them is evicted the index is
+marked stale, callers fall back to SQL and a rebuild is enqueued.
+
+Contact changes flip their bits only once their transaction commits, so a
+rolled back save leaves the index alone. A rebuild writes into separate keys
+and swaps them in atomically; bits flipped while it reads the database are
+journaled and replayed onto the new keys before the swap.
+"""
+
+import re
+from functools import partial
+
+import frappe
+
+BITMAP_KEY = "whatsapp:tag_bitmap:{}"
+ALL_CONTACTS_KEY = "whatsapp:tag_bitmap_all"
+META_KEY = "whatsapp:tag_index"
+BUILD_BITMAP_KEY = "whatsapp:tag_bitmap_build:{}"
+BUILD_ALL_CONTACTS_KEY = "whatsapp:tag_bitmap_build_all"
+BUILD_META_KEY = "whatsapp:tag_index_build"
+REBUILDING_KEY = "whatsapp:tag_index_rebuilding"
+JOURNAL_KEY = "whatsapp:tag_index_journal"
+REBUILD_TIMEOUT = 60 * 60
+ORDINAL_KEY = "whatsapp:contact_ordinal"
+BUILT_FIELD = "__built__"
+REBUILD_METHOD = "whatsapp.whatsapp.utils.tag_index.rebuild_tag_index"
+REBUILD_PAGE_SIZE = 10000
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+KEYWORDS = ("AND", "OR", "NOT")
+
+
+# Journal entries are "<bit>|<ordinal>|<tag>", with an empty tag for the all-contacts bitmap
+
+# KEYS: meta, journal, rebuilding, all contacts
+# ARGV: tag bitmap key prefix, ordinal, all-contacts bit or "", then bit, tag pairs
+FLIP_SCRIPT = """
+local prefix, ordinal = ARGV[1], ARGV[2]
+local rebuilding = redis.call("EXISTS", KEYS[3]) == 1
+local function flip(key, bit, tag)
+	redis.call("SETBIT", key, ordinal, bit)
+	if rebuilding then
+		redis.call("RPUSH", KEYS[2], bit .. "|" .. ordinal .. "|" .. tag)
+		-- Outlives a rebuild that died before its swap
+		redis.call("EXPIRE", KEYS[2], 2 * 3600)
+	end
+end
+if ARGV[3] ~= "" then
+	flip(KEYS[4], ARGV[3], "")
+end
+for i = 4, #ARGV, 2 do
+	flip(prefix .. ARGV[i + 1], ARGV[i], ARGV[i + 1])
+	if ARGV[i] == "1" then
+		redis.call("HSET", KEYS[1], ARGV[i + 1], 1)
+	end
+end
+"""
+
+# KEYS: journal, rebuilding, meta, build meta, all contacts, build all contacts
+# ARGV: tag bitmap key prefix, build bitmap key prefix, then every tag to swap
+SWAP_SCRIPT = """
+local prefix, build_prefix = ARGV[1], ARGV[2]
+local tags = {}
+for i = 3, #ARGV do
+	tags[ARGV[i]] = true
+end
+for _, entry in ipairs(redis.call("LRANGE", KEYS[1], 0, -1)) do
+	local bit, ordinal, tag = string.match(entry, "^(%d)|(%d+)|(.*)$")
+	if tag == "" then
+		redis.call("SETBIT", KEYS[6], ordinal, bit)
+	else
+		redis.call("SETBIT", build_prefix .. tag, ordinal, bit)
+		if bit == "1" then
+			redis.call("HSET", KEYS[4], tag, 1)
+		end
+		tags[tag] = true
+	end
+end
+for tag in pairs(tags) do
+	if redis.call("EXISTS", build_prefix .. tag) == 1 then
+		redis.call("RENAME", build_prefix .. tag, prefix .. tag)
+	else
+		redis.call("DEL", prefix .. tag)
+	end
+end
+redis.call("RENAME", KEYS[6], KEYS[5])
+redis.call("RENAME", KEYS[4], KEYS[3])
+redis.call("DEL", KEYS[1], KEYS[2])
+"""
+
+
+class TagExpressionError(frappe.ValidationError):
+	pass
+
+
+# Ordinals
+
+
+def next_contact_ordinal():
+	"""Allocate an ordinal for a new contact"""
+	cache = frappe.cache()
+	key = cache.make_key(ORDINAL_KEY)
+	if not cache.execute_command("EXISTS", key):
+		current = frappe.db.sql("SELECT IFNULL(MAX(ordinal), 0) FROM `tabWhatsApp Contact`")[0][0]
+		cache.execute_command("SET", key, current, "NX")
+	return cache.execute_command("INCR", key)
+
+
+# Maintenance
+
+
+def update_contact_tags(ordinal, added=(), removed=(), is_new=False):
+	"""Flip the bits of one contact for the tags added to or removed from it, once committed"""
+	if not ordinal or not (added or removed or is_new):
+		return
+
+	bits = [(1, tag) for tag in added] + [(0, tag) for tag in removed]
+	frappe.db.after_commit.add(partial(_flip_bits, ordinal, 1 if is_new else None, bits))
+
+
+def remove_contact(ordinal, tags):
+	"""Clear a deleted contact from every bitmap, once committed"""
+	if not ordinal:
+		return
+
+	frappe.db.after_commit.add(partial(_flip_bits, ordinal, 0, [(0, tag) for tag in tags]))
+
+
+def _flip_bits(ordinal, everyone_bit, bits):
+	cache = frappe.cache()
+	args = [_bitmap_key(""), ordinal, "" if everyone_bit is None else everyone_bit]
+	for bit, tag in bits:
+		args.extend((bit, tag))
+	cache.eval(
+		FLIP_SCRIPT,
+		4,
+		cache.make_key(META_KEY),
+		cache.make_key(JOURNAL_KEY),
+		cache.make_key(REBUILDING_KEY),
+		cache.make_key(ALL_CONTACTS_KEY),
+		*args,
+	)
+
+
+# Evaluation
+
+
+def parse_tag_expression(expression):
+	"""Parse a boolean tag expression into a tree of tuples
+
+	Grammar: expr := term (OR term)*; term := factor (AND factor)*;
+	factor := NOT factor | "(" expr ")" | tag. Tags containing spaces or
+	parentheses are written in double quotes; keywords are case-insensitive.
+	"""
+	tokens = tokenize(expression)
+	position = 0
+
+	def peek():
+		return tokens[position] if position < len(tokens) else (None, None)
+
+	def take():
+		nonlocal position
+		position += 1
+		return tokens[position - 1]
+
+	def parse_or():
+		operands = [parse_and()]
+		while peek() == ("keyword", "OR"):
+			take()
+			operands.append(parse_and())
+		return operands[0] if len(operands) == 1 else ("or", operands)
+
+	def parse_and():
+		operands = [parse_factor()]
+		while peek() == ("keyword", "AND"):
+			take()
+			operands.append(parse_factor())
+		return operands[0] if len(operands) == 1 else ("and", operands)
+
+	def parse_factor():
+		kind, value = take() if position < len(tokens) else (None, None)
+		if kind == "keyword" and value == "NOT":
+			return ("not", parse_factor())
+		if kind == "(":
+			node = parse_or()
+			if peek() != (")", ")"):
+				raise TagExpressionError(f"Unbalanced parentheses in tag expression: {expression}")
+			take()
+			return node
+		if kind == "tag":
+			return ("tag", value)
+		raise TagExpressionError(f"Invalid tag expression: {expression}")
+
+	tree = parse_or()
+	if position != len(tokens):
+		raise TagExpressionError(f"Invalid tag expression: {expression}")
+	return tree
+
+
+def tokenize(expression):
+	tokens = []
+	position = 0
+	expression = expression.strip()
+	while position < len(expression):
+		match = TOKEN_PATTERN.match(expression, position)
+		if not match:
+			raise TagExpressionError(f"Invalid tag expression: {expression}")
+		position = match.end()
+
+		opening, closing, quoted, word = match.groups()
+		if opening:
+			tokens.append(("(", "("))
+		elif closing:
+			tokens.append((")", ")"))
+		elif quoted is not None:
+			tokens.append(("tag", quoted))
+		elif word.upper() in KEYWORDS:
+			tokens.append(("keyword", word.upper()))
+		else:
+			tokens.append(("tag", word))
+
+	return tokens
+
+
+def get_tags(tree):
+	"""Every tag named in a parsed expression"""
+	kind, value = tree
+	if kind == "tag":
+		return {value}
+	if kind == "not":
+		return get_tags(value)
+	return set().union(*(get_tags(operand) for operand in value))
+
+
+def evaluate(expression):
+	"""Bitmap of the contacts matching a tag expression, or None if the index is stale"""
+	tree = parse_tag_expression(expression) if isinstance(expression, str) else expression
+	bitmaps = load_bitmaps(get_tags(tree))
+	if bitmaps is None:
+		return None
+
+	def walk(node):
+		kind, value = node
+		if kind == "tag":
+			return bitmaps[value]
+		if kind == "not":
+			return bitmaps[None] & ~walk(value)
+		results = [walk(operand) for operand in value]
+		combined = results[0]
+		for result in results[1:]:
+			combined = combined & result if kind == "and" else combined | result
+		return combined
+
+	return Bitmap(walk(tree), bitmaps.width)
+
+
+def load_bitmaps(tags):
+	"""{tag: int} for the given tags plus {None: all contacts}, or None if stale"""
+	cache = frappe.cache()
+	tags = sorted(tags)
+	pipe = cache.pipeline()
+	pipe.hmget(cache.make_key(META_KEY), [BUILT_FIELD, *tags])
+	pipe.get(cache.make_key(ALL_CONTACTS_KEY))
+	for tag in tags:
+		pipe.get(_bitmap_key(tag))
+	meta, everyone, *raw = pipe.execute()
+
+	# Built, and no known tag's bitmap has been evicted
+	stale = not meta[0] or everyone is None or any(known and value is None for known, value in zip(meta[1:], raw))
+	if stale:
+		schedule_rebuild()
+		return None
+
+	width = max(len(value or b"") for value in (everyone, *raw))
+	bitmaps = _BitmapSet(width)
+	bitmaps[None] = _to_int(everyone, width)
+	for tag, value in zip(tags, raw):
+		bitmaps[tag] = _to_int(value or b"", width)
+	return bitmaps
+
+
+class _BitmapSet(dict):
+	def __init__(self, width):
+		super().__init__()
+		self.width = width
+
+
+class Bitmap:
+	"""Result of a tag expression: a set of contact ordinals"""
+
+	def __init__(self, value, width):
+		self.value = value
+		self.width = width
+
+	def count(self):
+		return self.value.bit_count()
+
+	def __contains__(self, ordinal):
+		position = self.width * 8 - 1 - ordinal
+		return position >= 0 and bool(self.value >> position & 1)
+
+	def ordinals(self):
+		"""Ordinals in ascending order"""
+		data = self.value.to_bytes(self.width, "big")
+		for index, byte in enumerate(data):
+			if byte:
+				for bit in range(8):
+					if byte & (0x80 >> bit):
+						yield index * 8 + bit
+
+
+def get_sql_condition(tree, alias="contact"):
+	"""SQL equivalent of a parsed expression, for when the bitmaps are unavailable"""
+	kind, value = tree
+	if kind == "tag":
+		return (
+			"EXISTS (SELECT 1 FROM `tabWhatsApp Contact Tag` contact_tag"
+			f" WHERE contact_tag.parent = {alias}.name AND contact_tag.parenttype = 'WhatsApp Contact'"
+			f" AND contact_tag.tag = {frappe.db.escape(value)})"
+		)
+	if kind == "not":
+		return f"NOT {get_sql_condition(value, alias)}"
+
+	joiner = " AND " if kind == "and" else " OR "
+	return "(" + joiner.join(get_sql_condition(operand, alias) for operand in value) + ")"
+
+
+def schedule_rebuild():
+	cache = frappe.cache()
+	if cache.set(cache.make_key(f"{META_KEY}:rebuild_scheduled"), 1, nx=True, ex=60 * 60):
+		frappe.enqueue(REBUILD_METHOD, queue="long", timeout=60 * 60)
+
+
+def rebuild_tag_index():
+	"""Assign missing ordinals and rebuild every bitmap from the database"""
+	cache = frappe.cache()
+	build_meta_key = cache.make_key(BUILD_META_KEY)
+
+	# Clear what a rebuild that died before its swap left behind, then start journaling
+	pipe = cache.pipeline(transaction=True)
+	for tag in cache.execute_command("HKEYS", build_meta_key):
+		pipe.delete(_bitmap_key(frappe.safe_decode(tag), build=True))
+	pipe.delete(build_meta_key, cache.make_key(BUILD_ALL_CONTACTS_KEY), cache.make_key(JOURNAL_KEY))
+	pipe.set(cache.make_key(REBUILDING_KEY), 1, ex=REBUILD_TIMEOUT)
+	pipe.execute()
+
+	backfill_ordinals()
+
+	everyone = bytearray()
+	for page in _keyset_pages(
+		"""
+		SELECT contact.name, contact.ordinal
+		FROM `tabWhatsApp Contact` contact
+		WHERE contact.ordinal > 0 {keyset}
+		ORDER BY contact.name LIMIT %(page_size)s
+		""",
+		alias="contact",
+	):
+		for _name, ordinal in page:
+			_set_bit(everyone, ordinal)
+
+	tag_bitmaps = {}
+	for page in _keyset_pages(
+		"""
+		SELECT tag.name, tag.tag, contact.ordinal
+		FROM `tabWhatsApp Contact Tag` tag
+		JOIN `tabWhatsApp Contact` contact ON contact.name = tag.parent
+		WHERE tag.parenttype = 'WhatsApp Contact' AND contact.ordinal > 0 {keyset}
+		ORDER BY tag.name LIMIT %(page_size)s
+		""",
+		alias="tag",
+	):
+		for _name, tag, ordinal in page:
+			_set_bit(tag_bitmaps.setdefault(tag, bytearray()), ordinal)
+
+	pipe = cache.pipeline(transaction=False)
+	pipe.set(cache.make_key(BUILD_ALL_CONTACTS_KEY), bytes(everyone))
+	for tag, bitmap in tag_bitmaps.items():
+		pipe.set(_bitmap_key(tag, build=True), bytes(bitmap))
+		pipe.hset(build_meta_key, tag, 1)
+	pipe.hset(build_meta_key, BUILT_FIELD, 1)
+	pipe.execute()
+
+	# Replay the bits flipped meanwhile onto the new bitmaps and swap them in, atomically
+	old_tags = {frappe.safe_decode(tag) for tag in cache.execute_command("HKEYS", cache.make_key(META_KEY))}
+	tags = (old_tags | set(tag_bitmaps)) - {BUILT_FIELD}
+	cache.eval(
+		SWAP_SCRIPT,
+		6,
+		cache.make_key(JOURNAL_KEY),
+		cache.make_key(REBUILDING_KEY),
+		cache.make_key(META_KEY),
+		build_meta_key,
+		cache.make_key(ALL_CONTACTS_KEY),
+		cache.make_key(BUILD_ALL_CONTACTS_KEY),
+		_bitmap_key(""),
+		_bitmap_key("", build=True),
+		*tags,
+	)
+	cache.execute_command("DEL", cache.make_key(f"{META_KEY}:rebuild_scheduled"))
+
+
+def backfill_ordinals():
+	"""Give contacts created before the index existed an ordinal"""
+	while True:
+		names = frappe.db.sql_list(
+			"SELECT name FROM `tabWhatsApp Contact` WHERE ordinal = 0 OR ordinal IS NULL LIMIT %s",
+			(REBUILD_PAGE_SIZE,),
+		)
+		if not names:
+			return
+
+		for name in names:
+			frappe.db.set_value("WhatsApp Contact", name, "ordinal", next_contact_ordinal(), update_modified=False)
+		frappe.db.commit()
+
+
+def _keyset_pages(query, alias):
+	last_name = None
+	while True:
+		keyset = f"AND {alias}.name > %(last_name)s" if last_name is not None else ""
+		page = frappe.db.sql(query.format(keyset=keyset), {"last_name": last_name, "page_size": REBUILD_PAGE_SIZE})
+		if not page:
+			return
+		yield page
+		if len(page) < REBUILD_PAGE_SIZE:
+			return
+		last_name = page[-1][0]
+
+
+def _set_bit(bitmap, ordinal):
+	index = ordinal >> 3
+	if index >= len(bitmap):
+		bitmap.extend(b"\0" * (index + 1 - len(bitmap)))
+	bitmap[index] |= 0x80 >> (ordinal & 7)
+
+
+def _to_int(value, width):
+	# Redis bit 0 is the most significant bit of the first byte
+	return int.from_bytes(value.ljust(width, b"\0"), "big")
+
+
+def _bitmap_key(tag, build=False):
+	return frappe.cache().make_key((BUILD_BITMAP_KEY if build else BITMAP_KEY).format(tag))
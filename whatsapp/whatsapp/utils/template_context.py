@@ -0,0 +1,102 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# For license information, please see license.txt
+
+"""Template context for a whole dispatch batch
+
+The variables a template uses (its parsed `variables`) decide what is read:
+contact columns for the built-in variables, tags only when `{{tags}}` is
+used, and `custom_fields` only when a variable is not built in. Everything
+is read with one query per batch, and each contact's `custom_fields` JSON
+is parsed once. Variables a contact has no value for render as empty text.
+"""
+
+import json
+
+import frappe
+
+# Template variable: contact column
+CONTACT_VARIABLES = {
+	"name": "name1",
+	"phone": "phone_number",
+	"email": "email",
+}
+TAGS_VARIABLE = "tags"
+
+
+def get_template_variables(template):
+	"""The variables used in a template's content"""
+	if template.variables:
+		return json.loads(template.variables)
+	return list(set(template.get_variables())) if template.content else []
+
+
+def get_batch_context(contacts, variables):
+	"""{contact name: template context} for the given contact names"""
+	contacts = [contact for contact in contacts if contact]
+	if not contacts or not variables:
+		return {contact: {} for contact in contacts}
+
+	custom_variables = [
+		variable for variable in variables if variable not in CONTACT_VARIABLES and variable != TAGS_VARIABLE
+	]
+	columns = {CONTACT_VARIABLES[variable] for variable in variables if variable in CONTACT_VARIABLES}
+	if custom_variables:
+		columns.add("custom_fields")
+	columns = sorted(columns)
+
+	rows = {}
+	if columns:
+		select = ", ".join(f"`{column}`" for column in columns)
+		rows = {
+			row.name: row
+			for row in frappe.db.sql(
+				f"SELECT name, {select} FROM `tabWhatsApp Contact` WHERE name IN %s",
+				(tuple(contacts),),
+				as_dict=True,
+			)
+		}
+
+	tags = get_tags(contacts) if TAGS_VARIABLE in variables else {}
+
+	contexts = {}
+	for contact in contacts:
+		row = rows.get(contact) or {}
+		context = {variable: "" for variable in variables}
+		for variable, column in CONTACT_VARIABLES.items():
+			if variable in context:
+				context[variable] = row.get(column) or ""
+		if TAGS_VARIABLE in context:
+			context[TAGS_VARIABLE] = ", ".join(tags.get(contact, []))
+		if custom_variables:
+			custom_fields = parse_custom_fields(row.get("custom_fields"))
+			for variable in custom_variables:
+				value = custom_fields.get(variable)
+				context[variable] = "" if value is None else value
+		contexts[contact] = context
+
+	return contexts
+
+
+def get_tags(contacts):
+	"""{contact: [tag, ...]} in one query"""
+	tags = {}
+	for parent, tag in frappe.db.sql(
+		"""
+		SELECT parent, tag FROM `tabWhatsApp Contact Tag`
+		WHERE parenttype = 'WhatsApp Contact' AND parent IN %s
+		ORDER BY idx
+		""",
+		(tuple(contacts),),
+	):
+		tags.setdefault(parent, []).append(tag)
+	return tags
+
+
+def parse_custom_fields(custom_fields):
+	if not custom_fields:
+		return {}
+	try:
+		value = json.loads(custom_fields)
+	except ValueError:
+		return {}
+	return value if isinstance(value, dict) else {}
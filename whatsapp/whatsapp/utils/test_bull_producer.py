@@ -0,0 +1,71 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# See license.txt
+
+import json
+from urllib.parse import urlsplit, urlunsplit
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from redis.exceptions import ConnectionError
+
+from whatsapp.whatsapp.utils.bull_producer import BullProducer
+
+TEST_QUEUE = "whatsapp-messages-test"
+# Keeps test jobs out of the database the bench's workers and the Node.js service use
+TEST_DB = 15
+
+
+class TestBullProducer(FrappeTestCase):
+	def setUp(self):
+		# A throwaway database of the bench's queue Redis stands in for the Node.js service's Redis
+		redis_url = frappe.conf.get("whatsapp_bull_redis_url") or frappe.conf.get("redis_queue")
+		redis_url = urlunsplit(urlsplit(redis_url)._replace(path=f"/{TEST_DB}"))
+		self.producer = BullProducer(redis_url=redis_url, queue=TEST_QUEUE)
+		try:
+			self.producer.client.ping()
+		except ConnectionError:
+			self.skipTest(f"Redis not reachable at {redis_url}")
+		self.clear_queue()
+
+	def tearDown(self):
+		self.clear_queue()
+
+	def clear_queue(self):
+		for key in self.producer.client.scan_iter(match=f"{self.producer.key()}*", count=1000):
+			self.producer.client.delete(key)
+
+	def test_jobs_are_stored_in_bull_format(self):
+		job_ids = self.producer.add_jobs([({"message_log_id": 1, "recipient": "+10000000001"}, {"jobId": "1"})])
+		self.assertEqual(job_ids, ["1"])
+
+		job = self.producer.client.hgetall(self.producer.key("1"))
+		self.assertEqual(job[b"name"], b"__default__")
+		self.assertEqual(json.loads(job[b"data"])["recipient"], "+10000000001")
+		opts = json.loads(job[b"opts"])
+		self.assertEqual(opts["attempts"], 3)
+		self.assertEqual(opts["jobId"], "1")
+		self.assertEqual(self.producer.client.lrange(self.producer.key("wait"), 0, -1), [b"1"])
+
+	def test_fifo_order_and_generated_ids(self):
+		job_ids = self.producer.add_jobs([({"n": n}, None) for n in range(3)])
+		self.assertEqual(len(set(job_ids)), 3)
+
+		# Workers pop from the right of the wait list
+		wait = self.producer.client.lrange(self.producer.key("wait"), 0, -1)
+		self.assertEqual([frappe.safe_decode(job_id) for job_id in reversed(wait)], job_ids)
+		self.assertEqual(self.producer.get_depth(), {"queue_waiting": 3, "queue_active": 0})
+
+	def test_duplicate_job_id_is_ignored(self):
+		self.producer.add_jobs([({"n": 1}, {"jobId": "42"})])
+		self.producer.add_jobs([({"n": 2}, {"jobId": "42"})])
+
+		self.assertEqual(self.producer.client.llen(self.producer.key("wait")), 1)
+		data = json.loads(self.producer.client.hget(self.producer.key("42"), "data"))
+		self.assertEqual(data["n"], 1)
+
+	def test_priority_jobs_are_taken_first(self):
+		self.producer.add_jobs([({"n": 1}, {"jobId": "bulk"})])
+		self.producer.add_jobs([({"n": 2}, {"jobId": "urgent", "priority": 1})])
+
+		wait = self.producer.client.lrange(self.producer.key("wait"), 0, -1)
+		self.assertEqual(wait[-1], b"urgent")
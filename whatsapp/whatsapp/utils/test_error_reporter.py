@@ -0,0 +1,25 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp.whatsapp.utils.error_reporter import get_fingerprint
+
+
+class TestErrorReporter(FrappeTestCase):
+	def test_same_error_with_different_values_shares_a_fingerprint(self):
+		first = get_fingerprint("Send Message Error", ConnectionError("Connection to 10.0.0.4:3000 refused"))
+		second = get_fingerprint("Send Message Error", ConnectionError("Connection to 10.0.0.7:3000 refused"))
+		self.assertEqual(first, second)
+
+	def test_ids_in_titles_are_masked(self):
+		self.assertEqual(
+			get_fingerprint("Inbound Media Error (3EB0C4F1A2B3C4D5)", ValueError("x")),
+			get_fingerprint("Inbound Media Error (3EB0A1B2C3D4E5F6)", ValueError("x")),
+		)
+
+	def test_exception_type_is_part_of_the_fingerprint(self):
+		self.assertNotEqual(
+			get_fingerprint("Send Message Error", ConnectionError("failed")),
+			get_fingerprint("Send Message Error", TimeoutError("failed")),
+		)
@@ -0,0 +1,46 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp.whatsapp.utils.media_cache import get_content_hash, get_local_path
+
+
+class TestMediaCache(FrappeTestCase):
+	def setUp(self):
+		frappe.flags.pop("whatsapp_readable_files", None)
+
+	def tearDown(self):
+		frappe.set_user("Administrator")
+		frappe.flags.pop("whatsapp_readable_files", None)
+
+	def test_parent_segments_are_rejected(self):
+		for url in ("/private/files/../../site_config.json", "/files/../private/files/x.png"):
+			with self.assertRaises(frappe.PermissionError):
+				get_local_path(url)
+
+	def test_files_without_a_file_record_are_rejected(self):
+		with self.assertRaises(frappe.PermissionError):
+			get_local_path(f"/private/files/{frappe.generate_hash()}.png")
+
+	def test_private_file_needs_read_permission(self):
+		file_doc = frappe.get_doc({
+			"doctype": "File",
+			"file_name": f"{frappe.generate_hash()}.txt",
+			"content": b"media",
+			"is_private": 1,
+		}).insert(ignore_permissions=True)
+
+		self.assertTrue(get_local_path(file_doc.file_url))
+
+		frappe.flags.pop("whatsapp_readable_files", None)
+		frappe.set_user("Guest")
+		with self.assertRaises(frappe.PermissionError):
+			get_local_path(file_doc.file_url)
+
+	def test_remote_urls_are_not_fetched(self):
+		# Identified by URL only; an unreachable host would fail if it were fetched
+		content_hash = get_content_hash("http://media.invalid/image.png")
+		self.assertEqual(content_hash, get_content_hash("http://media.invalid/image.png"))
+		self.assertNotEqual(content_hash, get_content_hash("http://media.invalid/other.png"))
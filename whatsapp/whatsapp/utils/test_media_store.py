@@ -0,0 +1,34 @@
+# Copyright (c) 2025, INIA GLOBAL and contributors
+# See license.txt
+
+import os
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from whatsapp.whatsapp.utils.media_store import FILE_PREFIX, attach_file, get_media_path
+
+
+class TestMediaStore(FrappeTestCase):
+	def setUp(self):
+		self.file_name = f"{FILE_PREFIX}{frappe.generate_hash(length=64)}.jpg"
+		with open(get_media_path(self.file_name), "wb") as f:
+			f.write(b"\xff\xd8" + os.urandom(1024))
+
+	def tearDown(self):
+		frappe.db.rollback()
+		os.remove(get_media_path(self.file_name))
+
+	def test_attachments_share_the_content_file(self):
+		files_before = set(os.listdir(get_media_path("")))
+
+		first = attach_file("message-1", self.file_name, 1026, "photo.jpg")
+		second = attach_file("message-2", self.file_name, 1026, "photo.jpg")
+
+		# No copy under the original name or a generated one
+		self.assertEqual(set(os.listdir(get_media_path(""))), files_before)
+		self.assertEqual(first.file_url, f"/private/files/{self.file_name}")
+		self.assertEqual(second.file_url, first.file_url)
+		self.assertEqual(
+			frappe.db.get_value("File", first.name, ["file_name", "attached_to_name"]), ("photo.jpg", "message-1")
+		)